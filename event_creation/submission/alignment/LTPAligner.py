@@ -1,8 +1,11 @@
 import os
 import numpy as np
 from ..log import logger
+from .window_matching import match_windows
 import pandas as pd
 
+MATCH_CHUNK_SIZE = 256  # Number of ephys pulse windows matched against the behavioral pulses at once
+
 class LTPAligner:
     """
     Used for aligning the EEG data from the ephys computer with the task events from the behavioral computer.
@@ -112,13 +115,11 @@ class LTPAligner:
 
                 # Add eeg offset and eeg file information to the events
                 logger.debug('Adding EEG file and offset information to events structure...')
-                oob = 0  # Counts the number of events that are out of bounds of the start and end sync pulses
-                for i in range(self.events.shape[0]):
-                    if 0 <= eeg_offsets[i] <= self.num_samples:
-                        self.events[i].eegoffset = eeg_offsets[i]
-                        self.events[i].eegfile = basename
-                    else:
-                        oob += 1
+                in_bounds = (eeg_offsets >= 0) & (eeg_offsets <= self.num_samples)
+                self.events.eegoffset[in_bounds] = eeg_offsets[in_bounds]
+                self.events.eegfile[in_bounds] = basename
+                # Counts the number of events that are out of bounds of the start and end sync pulses
+                oob = np.count_nonzero(~in_bounds)
                 logger.debug('Done.')
 
                 if oob > 0:
@@ -218,31 +219,22 @@ def times_to_offsets(behav_ms, ephys_ms, ev_ms, samplerate, window=100, thresh_m
     :return s_ind: The index of the EEG sample that matches the beginning of the behavioral pulse syncs.
     :return e_ind: The index of the EEG sample that matches the end of the behavioral pulse syncs.
     """
-    s_ind = None
-    e_ind = None
-
     # Determine which range of samples in the ephys computer's pulse log matches the behavioral computer's sync pulse timings
     # Determine which ephys sync pulses correspond to the beginning behavioral sync pulses
-    for i in xrange(len(ephys_ms) - window):
-        s_ind = match_sequence(np.diff(ephys_ms[i:i + window]), np.diff(behav_ms), thresh_ms)
-        if s_ind is not None:
-            start_ephys_vals = ephys_ms[i:i + window]
-            start_behav_vals = behav_ms[s_ind:s_ind + window]
-            break
+    i, s_ind = find_first_window(ephys_ms, behav_ms, window, thresh_ms)
     if s_ind is None:
         raise ValueError("Unable to find a start window.")
+    start_ephys_vals = ephys_ms[i:i + window]
+    start_behav_vals = behav_ms[s_ind:s_ind + window]
 
     # Determine which ephys sync pulses correspond with the ending behavioral sync pulses
-    for i in xrange(len(ephys_ms) - window):
-        e_ind = match_sequence(np.diff(ephys_ms[::-1][i:i + window]), np.diff(behav_ms[::-1]), thresh_ms)
-        if e_ind is not None:
-            e_ind = len(behav_ms) - e_ind - window
-            i = len(ephys_ms) - i - window
-            end_ephys_vals = ephys_ms[i:i + window]
-            end_behav_vals = behav_ms[e_ind:e_ind + window]
-            break
+    i, e_ind = find_first_window(ephys_ms[::-1], behav_ms[::-1], window, thresh_ms)
     if e_ind is None:
         raise ValueError("Unable to find an end window.")
+    e_ind = len(behav_ms) - e_ind - window
+    i = len(ephys_ms) - i - window
+    end_ephys_vals = ephys_ms[i:i + window]
+    end_behav_vals = behav_ms[e_ind:e_ind + window]
 
     # Perform a regression on the corresponding behavioral and ephys sync pulse times to enable a conversion between
     # event mstimes and EEG offsets.
@@ -260,16 +252,54 @@ def times_to_offsets(behav_ms, ephys_ms, ev_ms, samplerate, window=100, thresh_m
     return offsets, s_ind, e_ind
 
 
+def find_first_window(ephys_ms, behav_ms, window, thresh_ms):
+    """
+    Finds the first window of ephys sync pulses whose spacing matches a window of the behavioral sync pulses, as
+    calling match_sequence on each ephys window in turn would, but checking a chunk of ephys windows at a time.
+
+    :param ephys_ms: The mstimes for all sync pulses received by the ephys computer.
+    :param behav_ms: The mstimes for all sync pulses sent by the behavioral computer.
+    :param window: The number of sync pulses to match.
+    :param thresh_ms: The magnitude of discrepancy permitted when matching behavioral and ephys sync pulses.
+
+    :return: The index of the first pulse of the matching ephys window and of the matching behavioral window, or
+    (None, None) if no window matches.
+    """
+    ephys_diff = np.diff(ephys_ms)
+    behav_diff = np.diff(behav_ms)
+    starts = np.arange(len(ephys_ms) - window)
+    for chunk_start in range(0, len(starts), MATCH_CHUNK_SIZE):
+        chunk = starts[chunk_start:chunk_start + MATCH_CHUNK_SIZE]
+        offsets = match_sequences(ephys_diff, chunk, window - 1, behav_diff, thresh_ms)
+        matched = np.nonzero(offsets >= 0)[0]
+        if len(matched) > 0:
+            return chunk[matched[0]], offsets[matched[0]]
+    return None, None
+
+
+def match_sequences(sequence, starts, nlen, haystack, maxdiff):
+    """
+    Look for matching subsequences in a long sequence, for each of the needles sequence[start:start + nlen].
+
+    :return: For each start, the first offset that match_sequence would return, or -1 if there is no match.
+    """
+    # As in match_sequence, the final offset in the haystack is never tried
+    n_offsets = len(haystack) - nlen
+    if n_offsets <= 0:
+        return np.full(len(starts), -1, dtype=int)
+
+    positions, offsets = match_windows(sequence, starts, nlen, haystack, maxdiff, n_offsets)
+    first_offsets = np.full(len(starts), n_offsets, dtype=int)
+    np.minimum.at(first_offsets, positions, offsets)
+    first_offsets[first_offsets == n_offsets] = -1
+    return first_offsets
+
+
 def match_sequence(needle, haystack, maxdiff):
     """
     Look for a matching subsequence in a long sequence.
     """
-    nlen = len(needle)
-    found = False
-    for i in range(len(haystack)-nlen):
-        if np.abs(haystack[i:i+nlen] - needle).max() < maxdiff:
-            found = True
-            break
-    if not found:
+    i = match_sequences(np.asarray(needle), [0], len(needle), np.asarray(haystack), maxdiff)[0]
+    if i < 0:
         i = None
     return i
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+
+from ..configuration import config
+
+FIT_FILE_SUFFIX = '_fit.npz'
+
+
+def save_fit(x, y, coefficients, save_dir, label):
+    """
+    Saves the points, coefficients and residuals of a linear fit to <label>_fit.npz, so that it can be plotted later
+    with plot_saved_fit. The fit is only plotted straight away if the show_plots option is set
+    :param x: source times
+    :param y: destination times
+    :param coefficients: (slope, intercept)
+    :param save_dir: Where to save the fit
+    :param label: What to name the saved fit
+    :return: path to the saved fit
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    coefficients = np.asarray(coefficients[:2], dtype=float)
+    fit_file = os.path.join(save_dir, label + FIT_FILE_SUFFIX)
+    np.savez(fit_file, x=x, y=y, coefficients=coefficients, residuals=y - (coefficients[0] * x + coefficients[1]))
+    if config.show_plots:
+        plot_saved_fit(fit_file, show=True)
+    return fit_file
+
+
+def plot_saved_fit(fit_file, plot_save_dir=None, ext='.png', show=False):
+    """
+    Plots a fit saved by save_fit, saving the fit itself to <label>_fit<ext> and its residuals to <label>_residuals<ext>
+    :param fit_file: path to the saved fit
+    :param plot_save_dir: Where to save the plots. Defaults to the directory of the saved fit
+    :param ext: Image file extension
+    :param show: Whether to also show the plots
+    :return: paths to the two plots
+    """
+    import matplotlib.pyplot as plt
+
+    label = os.path.basename(fit_file)[:-len(FIT_FILE_SUFFIX)]
+    if plot_save_dir is None:
+        plot_save_dir = os.path.dirname(fit_file)
+    saved = np.load(fit_file)
+    x, y, residuals = saved['x'], saved['y'], saved['residuals']
+
+    plot_files = []
+    for suffix, lines in (('fit', (x, y, 'g.', x, y - residuals, 'b-')),
+                          ('residuals', (x, residuals, 'g-', [min(x), max(x)], [0, 0], 'k-'))):
+        plt.clf()
+        plt.plot(*lines)
+        plot_files.append(os.path.join(plot_save_dir, '{label}_{suffix}{ext}'.format(label=label, suffix=suffix,
+                                                                                     ext=ext)))
+        plt.savefig(plot_files[-1])
+        if show:
+            plt.show()
+    return plot_files
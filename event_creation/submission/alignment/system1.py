@@ -5,6 +5,7 @@ import os
 import json
 from ..exc import AlignmentError
 from ..log import logger
+from .window_matching import match_windows
 
 
 class System1Aligner:
@@ -24,6 +25,7 @@ class System1Aligner:
     ALIGNMENT_WINDOW_STEP = 10      # Reduces window by this amount if it cannot align
     MIN_ALIGNMENT_WINDOW = 5        # Does not drop below this many aligned pulses
     ALIGNMENT_THRESHOLD = 10        # This many ms may differ between sync pulse times
+    MATCH_CHUNK_SIZE = 256          # Number of window positions matched at once
 
     def __init__(self, events, files):
         """
@@ -194,15 +196,24 @@ class System1Aligner:
         start_i = 0 if from_front else len(eeg_diff) - alignment_window
         end_i = len(eeg_diff) - alignment_window if from_front else 0
         step_i = 1 if from_front else -1
-
-        # Slide the window, looking for one that fits the differences
-        for i in range(start_i, end_i, step_i):
-            task_start_ind = cls.get_best_offset(eeg_diff[i:i + alignment_window],
-                                            task_diff,
-                                            cls.ALIGNMENT_THRESHOLD)
+        eeg_inds = np.arange(start_i, end_i, step_i)
+
+        # Slide the window a chunk of positions at a time, looking for one that fits the differences
+        for chunk_start in range(0, len(eeg_inds), cls.MATCH_CHUNK_SIZE):
+            chunk_inds = eeg_inds[chunk_start:chunk_start + cls.MATCH_CHUNK_SIZE]
+            positions, offsets = match_windows(eeg_diff, chunk_inds, alignment_window, task_diff,
+                                               cls.ALIGNMENT_THRESHOLD)
+            n_matches = np.bincount(positions, minlength=len(chunk_inds))
+            n_nonzero_matches = np.bincount(positions, weights=offsets != 0, minlength=len(chunk_inds))
+            # A single match at offset 0 has never counted as an alignment, so the search carries on past it
+            found = (n_matches > 1) | (n_nonzero_matches > 0)
             # If it finds an offset, we can stop looking
-            if task_start_ind:
-                eeg_start_ind = i
+            if found.any():
+                position = np.argmax(found)
+                if n_matches[position] > 1:
+                    raise AlignmentError("Multiple matching windows. Lower threshold or increase window.")
+                task_start_ind = offsets[positions == position][0]
+                eeg_start_ind = chunk_inds[position]
                 break
 
         # If it didn't find an offset, reduce the window and try again
@@ -228,15 +239,9 @@ class System1Aligner:
         :return:  the offset of eeg_diff at which it begins matching with task_diff
         """
 
-        # Find any differences that match
-        ind = np.where(abs(task_diff - eeg_diff[0]) < delta)
-
-        # For each difference, find the indices that still match
-        for i, this_eeg_diff in enumerate(eeg_diff):
-            ind = np.intersect1d(ind, np.where(abs(task_diff-this_eeg_diff) < delta)[0] - i)
-            # If there are no indices left, return None
-            if len(ind) == 0:
-                return None
+        _, ind = match_windows(eeg_diff, [0], len(eeg_diff), task_diff, delta)
+        if len(ind) == 0:
+            return None
 
         # Raise an exception if we've found more than one
         if len(ind) > 1:
@@ -1,17 +1,19 @@
+import glob
 import itertools
 import json
 import os
 from copy import deepcopy
 
-import matplotlib.pyplot as plt
 import numpy as np
 import scipy.stats
 
+from ..configuration import config
 from ..exc import AlignmentError
 from ..readers.eeg_reader import NSx_reader
 from ..readers.eeg_reader import read_jacksheet
 from ..log import logger
 from ..parsers.system2_log_parser import System2LogParser
+from .fit_plots import save_fit, plot_saved_fit, FIT_FILE_SUFFIX
 
 
 def System2Aligner(events, files, plot_save_dir=None, align_micros=False):
@@ -209,17 +211,20 @@ class System2TaskAligner(object):
             min_errors = errors[best_index]
             if min_errors > 10000:
                 raise AlignmentError('Guess at beginning of recording inaccurate by over ten seconds (%d ms)' % min_errors)
-            plt.clf()
-            fig, ax = plt.subplots()
-            error_indices = np.arange(len(min_errors)) if isinstance(min_errors, list) else 1
-            ax.bar(error_indices, min_errors)
-            ax.set_ylabel('Error in estimated time difference between start of recordings')
-            ax.set_title('Accuracy of multiple-nsx file match-up')
-            try:
-                plt.savefig(os.path.join(self.plot_save_dir, 'multi-ns2{ext}'.format(ext=self.PLOT_SAVE_FILE_EXT)))
-            except Exception:
-                logger.log('Could not save plot')
-            plt.close()
+            logger.debug('Error in estimated time difference between start of recordings: {} ms'.format(min_errors))
+            if config.show_plots:
+                import matplotlib.pyplot as plt
+                plt.clf()
+                fig, ax = plt.subplots()
+                error_indices = np.arange(len(min_errors)) if isinstance(min_errors, list) else 1
+                ax.bar(error_indices, min_errors)
+                ax.set_ylabel('Error in estimated time difference between start of recordings')
+                ax.set_title('Accuracy of multiple-nsx file match-up')
+                try:
+                    plt.savefig(os.path.join(self.plot_save_dir, 'multi-ns2{ext}'.format(ext=self.PLOT_SAVE_FILE_EXT)))
+                except Exception:
+                    logger.log('Could not save plot')
+                plt.close()
 
         return nsx_file_combinations[best_index]
 
@@ -432,28 +437,30 @@ class System2TaskAligner(object):
     @classmethod
     def plot_fit(cls, x, y, coefficients, plot_save_dir, plot_save_label):
         """
-        Plots a fit between two values (both plotting fit itself and residuals
+        Saves a fit between two values, with its residuals, to <plot_save_label>_fit.npz. The fit and residuals are
+        only plotted during alignment if the show_plots option is set; otherwise use plot_saved_fits afterwards
         :param x:
         :param y:
         :param coefficients:
-        :param plot_save_dir: Where to save the plot
-        :param plot_save_label: What to name the saved plot
+        :param plot_save_dir: Where to save the fit
+        :param plot_save_label: What to name the saved fit
         :return: None
         """
-        fit = coefficients[0] * np.array(x) + coefficients[1]
         if plot_save_dir:
-            plt.clf()
-            plt.plot(x, y, 'g.', x, fit, 'b-')
-            plt.savefig(os.path.join(plot_save_dir, '{label}_fit{ext}'.format(label=plot_save_label,
-                                                                              ext=cls.PLOT_SAVE_FILE_EXT)))
-            plt.show()
+            save_fit(x, y, coefficients, plot_save_dir, plot_save_label)
 
-        if plot_save_dir:
-            plt.clf()
-            plt.plot(x, y-fit, 'g-', [min(x), max(x)], [0, 0], 'k-')
-            plt.savefig(os.path.join(plot_save_dir, '{label}_residuals{ext}'.format(label=plot_save_label,
-                                                                              ext=cls.PLOT_SAVE_FILE_EXT)))
-            plt.show()
+    @classmethod
+    def plot_saved_fits(cls, plot_save_dir):
+        """
+        Plots every fit saved by plot_fit in a directory, i.e. every <label>_fit.npz file in it. Event creation does not
+        call this; run it by hand on a session's db folder to look at its fits
+        :param plot_save_dir: The directory that was passed to the aligner
+        :return: paths to the plots
+        """
+        plot_files = []
+        for fit_file in sorted(glob.glob(os.path.join(plot_save_dir, '*' + FIT_FILE_SUFFIX))):
+            plot_files.extend(plot_saved_fit(fit_file, ext=cls.PLOT_SAVE_FILE_EXT))
+        return plot_files
 
 
 
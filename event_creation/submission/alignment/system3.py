@@ -8,6 +8,7 @@ import scipy.stats
 
 from ..log import logger
 from ..parsers.system3_log_parser import System3LogParser
+from ..readers.event_log_reader import read_event_log
 from ..exc import AlignmentError
 import itertools
 
@@ -76,19 +77,44 @@ class System3Aligner(object):
         else:
             host_time = event['host_time']
 
-        coef_inds = np.where(host_time <= self.host_ends)[0]
+        task_times, _ = self.host_times_to_mstimes([host_time])
+        return task_times[0]
 
-        if len(coef_inds) > 0:
-            coef_ind = coef_inds[-1]
-        else:
-            if host_time - self.host_ends[-1] > 2000:
-                logger.error("Time extends beyond end of log file!")
-            coef_ind = len(self.host_ends)-1
+    def stim_params_to_mstimes(self, stim_params):
+        """
+        Converts an array of stim_params to mstimes, as stim_event_to_mstime does for each one
+        :param stim_params: 1-d array of stim_params, or 2-d array whose first column of stim_params is used
+        :return: array of mstimes
+        """
+        host_times = stim_params['host_time']
+        if host_times.ndim > 1:
+            host_times = host_times[:, 0]
+        task_times, _ = self.host_times_to_mstimes(host_times)
+        return task_times
+
+    def host_times_to_mstimes(self, host_times):
+        """
+        Converts host PC times to task times and EEG offsets, using the coefficients of the last event log whose
+        alignment ends at or after each time, or the last event log for times after every end
+        :param host_times: array of times on the host PC
+        :return: (task times, eeg offsets)
+        """
+        host_times = np.asarray(host_times, dtype=float)
+        n_logs = len(self.host_ends)
+
+        within_log = host_times[:, np.newaxis] <= np.asarray(self.host_ends)[np.newaxis, :]
+        coef_inds = n_logs - 1 - np.argmax(within_log[:, ::-1], axis=1)
+        beyond_end = ~within_log.any(axis=1)
+        coef_inds[beyond_end] = n_logs - 1
+        if (host_times[beyond_end] - self.host_ends[-1] > 2000).any():
+            logger.error("Time extends beyond end of log file!")
 
-        ens_time = self.apply_coefficients(host_time, self.host_to_ens_coefs[coef_ind])
-        task_time = self.apply_coefficients_backwards(ens_time, self.task_to_ens_coefs[coef_ind])
+        host_to_ens_coefs = np.asarray(self.host_to_ens_coefs)[coef_inds]
+        task_to_ens_coefs = np.asarray(self.task_to_ens_coefs)[coef_inds]
+        ens_times = self.apply_coefficients(host_times, host_to_ens_coefs.T)
+        task_times = self.apply_coefficients_backwards(ens_times, task_to_ens_coefs.T)
 
-        return task_time
+        return task_times, ens_times
 
     def add_stim_events(self, event_template, persistent_fields=lambda *_: tuple()):
         # Merge in the stim events
@@ -96,7 +122,8 @@ class System3Aligner(object):
         logger.debug("Generating system 3 log parser")
         s3lp = System3LogParser(self.events_logs, self.electrode_config)
         logger.debug("Merging events")
-        self.merged_events = s3lp.merge_events(self.events, event_template, self.stim_event_to_mstime, persistent_fields)
+        self.merged_events = s3lp.merge_events(self.events, event_template, self.stim_event_to_mstime, persistent_fields,
+                                               self.stim_params_to_mstimes)
 
         # Have to manually correct subject and session due to events appearing before start of session
         self.merged_events['subject'] = self.events[-1].subject
@@ -111,7 +138,7 @@ class System3Aligner(object):
 
         for i, event_log in enumerate(self.events_logs):
 
-            event_dict = json.load(open(event_log))['events']
+            event_dict = read_event_log(event_log)['events']
 
             froms = [float(event[from_label]) * 1000. / rate for event in event_dict \
                     if from_label in event and to_label in event and event['event_label'] not in exclude]
@@ -0,0 +1,42 @@
+import numpy as np
+
+
+def match_windows(sequence, starts, window, haystack, maxdiff, n_offsets=None):
+    """
+    Finds every offset of haystack at which each of the windows sequence[start:start + window] occurs, i.e. where each
+    of the window's values differs from the corresponding value of haystack by less than maxdiff.
+
+    Candidate offsets are looked up by the first value of each window in a sorted copy of haystack, then the rest of
+    every candidate is checked at once, rather than comparing each window against each offset in turn.
+    :param sequence: values (e.g. differences between received sync pulses) from which the windows are taken
+    :param starts: indices of sequence at which windows start
+    :param window: number of values in each window
+    :param haystack: values (e.g. differences between sent sync pulses) in which the windows are looked for
+    :param maxdiff: threshold under which values are considered a match
+    :param n_offsets: number of offsets of haystack to try. Defaults to every offset at which a whole window fits
+    :return: (positions in starts, offsets of haystack) of each match, in the order of starts
+    """
+    starts = np.asarray(starts, dtype=int)
+    if n_offsets is None:
+        n_offsets = len(haystack) - window + 1
+    if len(starts) == 0 or n_offsets <= 0:
+        return np.array([], dtype=int), np.array([], dtype=int)
+
+    order = np.argsort(haystack[:n_offsets], kind='mergesort')
+    index = haystack[:n_offsets][order]
+    # Bounds are widened so that the exact comparison below decides every edge case
+    first_values = sequence[starts]
+    lo = np.searchsorted(index, first_values - 2 * maxdiff, 'left')
+    hi = np.searchsorted(index, first_values + 2 * maxdiff, 'right')
+    n_candidates = hi - lo
+
+    positions = np.repeat(np.arange(len(starts)), n_candidates)
+    # Rank in the sorted copy of each candidate: lo of its window plus its place among that window's candidates
+    ranks = np.arange(n_candidates.sum()) - np.repeat(np.cumsum(n_candidates) - n_candidates - lo, n_candidates)
+    offsets = order[ranks]
+
+    for i in range(window):
+        matches = np.abs(haystack[offsets + i] - sequence[starts[positions] + i]) < maxdiff
+        positions = positions[matches]
+        offsets = offsets[matches]
+    return positions, offsets
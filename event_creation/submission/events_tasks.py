@@ -1,6 +1,8 @@
 import glob
+import json
 import os
 import re
+import shutil
 import traceback
 import requests
 
@@ -37,14 +39,15 @@ from .parsers.thief_log_parser import ThiefSessionLogParser
 from .parsers.math_parser import MathSessionLogParser
 from .parsers.hostpc_parsers import FRHostPCLogParser, catFRHostPCLogParser,\
         TiclFRParser
-from .readers.eeg_reader import get_eeg_reader
+from .readers.eeg_reader import get_eeg_reader, SplitManifest
+from .readers.event_log_reader import read_event_log
+from . import fileutil
 from .tasks import PipelineTask
 from .quality.util import get_time_field
 
-from .viewers.recarray import to_json, from_json
+from .viewers.recarray import from_json, detect_json_format, GZIP_SUFFIX
 from .log import logger
 from .exc import NoEventsError, ProcessingError,WebAPIError
-import json
 
 
 class SplitMicroTask(PipelineTask):
@@ -137,6 +140,51 @@ class SplitEEGTask(PipelineTask):
         raw_eeg_groups = [group[0] if len(group) == 1 else group for group in raw_eeg_groups]
         return raw_eeg_groups
 
+    def resume_interrupted_splits(self, db_folder):
+        """
+        Carries over the channel files written by earlier splits of this session that were interrupted, i.e. that
+        their split manifests still mark as incomplete, along with their records in the manifest. The readers check
+        each file against its record and only write the ones that are missing or incomplete. Splits that finished
+        are never carried over.
+        """
+        if self.pipeline is None:
+            return
+        manifest_filename = os.path.join(db_folder, SplitManifest.FILENAME)
+        for previous_folder in sorted(glob.glob(os.path.join(self.pipeline.destination_root, '*_processed'))):
+            previous_manifest = os.path.join(previous_folder, SplitManifest.FILENAME)
+            if os.path.samefile(previous_folder, db_folder) or not os.path.isfile(previous_manifest):
+                continue
+            try:
+                with open(previous_manifest) as f:
+                    previous = {basename: entry for basename, entry in json.load(f).items()
+                                if entry.get('complete') is False}
+            except ValueError:
+                continue
+            if not previous:
+                continue
+            try:
+                with open(manifest_filename) as f:
+                    manifests = json.load(f)
+            except (IOError, ValueError):
+                manifests = {}
+            logger.info('Resuming split from {}'.format(previous_folder))
+            for basename, entry in previous.items():
+                for filename in entry['channels']:
+                    source = os.path.join(previous_folder, 'noreref', filename)
+                    destination = os.path.join(db_folder, 'noreref', filename)
+                    if not os.path.exists(source) or os.path.exists(destination):
+                        continue
+                    if not os.path.exists(os.path.dirname(destination)):
+                        fileutil.makedirs(os.path.dirname(destination))
+                    try:
+                        # Never written in place, so a link is as good as a copy
+                        os.link(source, destination)
+                    except OSError:
+                        # Keeps the modification time, which the manifest checks along with the size
+                        shutil.copy2(source, destination)
+                manifests.setdefault(basename, entry)
+            with fileutil.open_with_perms(manifest_filename, 'w') as f:
+                json.dump(manifests, f, indent=2, sort_keys=True)
 
     def _run(self, files, db_folder):
         logger.set_label(self.name)
@@ -145,6 +193,7 @@ class SplitEEGTask(PipelineTask):
             raw_eegs = [raw_eegs]
 
         raw_eeg_groups = self.group_ns2_files(raw_eegs)
+        self.resume_interrupted_splits(db_folder)
 
         if self.protocol == 'ltp':
             for i in range(len(raw_eeg_groups)):
@@ -322,8 +371,8 @@ class EventCreationTask(PipelineTask):
         logger.set_label(self.name)
         logger.debug('self._parser_type is %s'%(None if not self._parser_type else str(self._parser_type)))
         if self.r1_sys_num>=3:
-            with open(files['event_log'][0]) as event_log:
-                self._r1_sys_num = json.load(event_log)['versions']['Ramulator'].rpartition('.')[0].replace('.','_')
+            event_log = read_event_log(files['event_log'][0])
+            self._r1_sys_num = event_log['versions']['Ramulator'].rpartition('.')[0].replace('.','_')
 
         parser = self.parser_type(self.protocol, self.subject, self.montage, self.experiment, self.session, files)
         logger.debug('Using %s'%str(self.parser_type))
@@ -372,8 +421,7 @@ class EventCreationTask(PipelineTask):
 
         events = parser.clean_events(events) if events.shape != () else events
         self.pipeline.importer.tests.extend(parser.check_event_quality(events,files))
-        self.create_file(self.filename, to_json(events),
-                         '{}_events'.format(self.event_label))
+        self.filename = self.create_events_file(events, self.event_label)
 
 
 class PruneEventsTask(PipelineTask):
@@ -382,15 +430,24 @@ class PruneEventsTask(PipelineTask):
         self.filter = cond
 
     def _run(self,files,db_folder):
-        event_files = glob.glob(os.path.join(db_folder,'*_events.json'))
-        for fid in event_files:
+        event_files = glob.glob(os.path.join(db_folder, '*_events.json')) + \
+                      glob.glob(os.path.join(db_folder, '*_events.json' + GZIP_SUFFIX))
+        event_labels = sorted(set(os.path.basename(fid).rpartition('_events.json')[0] for fid in event_files))
+        for event_label in event_labels:
+            fid = os.path.join(db_folder, '{}_events.json'.format(event_label))
             events = from_json(fid)
             filtered_events = events[self.filter(events)]
             if len(filtered_events) == 0 or events is None:
                 logger.info('No events for this experiment. If there are subsequent PS4 sessions, do not panic.')
                 raise NoEventsError()
-            filtered_events = to_json(filtered_events)
-            self.create_file(fid, filtered_events, os.path.splitext(os.path.basename(fid))[0])
+            # The copy that from_json reads is rewritten in its own format, along with any .npy copy, and a copy in
+            # the other format is removed so that it cannot be read instead
+            npy_file = os.path.join(db_folder, '{}_events.npy'.format(event_label))
+            filename = self.create_events_file(filtered_events, event_label, detect_json_format(fid),
+                                               write_npy=os.path.exists(npy_file) or None)
+            for copy in (fid, fid + GZIP_SUFFIX):
+                if copy != os.path.join(db_folder, filename) and os.path.exists(copy):
+                    os.remove(copy)
 
 
 class RecognitionFlagTask(PipelineTask):
@@ -457,13 +514,12 @@ class EventCombinationTask(PipelineTask):
         else:
             sort_field = self.sort_field
         event_files = [os.path.join(db_folder, '{}_events.json'.format(label)) for label in self.event_labels]
-        event_files = [f for f in event_files if os.path.isfile(f)]
+        event_files = [f for f in event_files if os.path.isfile(f) or os.path.isfile(f + GZIP_SUFFIX)]
         events = [from_json(event_file) for event_file in event_files]
         combiner = EventCombiner(events,sort_field=sort_field)
         combined_events = combiner.combine()
 
-        self.create_file('{}_events.json'.format(self.COMBINED_LABEL),
-                         to_json(combined_events), '{}_events'.format(self.COMBINED_LABEL))
+        self.create_events_file(combined_events, self.COMBINED_LABEL)
 
 class MontageLinkerTask(PipelineTask):
     """
@@ -536,8 +592,7 @@ class MatlabEventConversionTask(PipelineTask):
                                         self.original_session, files)
         events = converter.convert()
 
-        self.create_file( self.filename, to_json(events),
-                         '{}_events'.format(self.event_label))
+        self.filename = self.create_events_file(events, self.event_label)
 
 
 class ImportEventsTask(PipelineTask):
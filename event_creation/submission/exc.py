@@ -43,5 +43,9 @@ class EEGError(Exception):
     """Raised when there are errors in EEG processing."""
 
 
+class DecompressionError(EEGError):
+    """Raised when a compressed EEG file can't be decompressed."""
+
+
 class PeakFindingError(Exception):
     """Raised when there are errors peak finding."""
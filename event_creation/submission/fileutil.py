@@ -29,5 +29,5 @@ def open_with_perms(filename, mode='r', *args, **kwargs):
     with open(filename, mode, *args, **kwargs) as f:
         yield f
 
-    if mode == 'w':
+    if 'w' in mode:
         os.chmod(filename, 0o644)
@@ -1,4 +1,6 @@
+import bisect
 import codecs
+from copy import deepcopy
 import json
 import os
 import re
@@ -10,7 +12,8 @@ import pandas as pd
 from ..log import logger
 from ..exc import LogParseError, UnknownExperimentError, EventFieldError
 from ..readers.eeg_reader import read_jacksheet
-from ..viewers.recarray import pformat_rec, to_dict, from_dict
+from ..readers.event_log_reader import read_event_log
+from ..viewers.recarray import pformat_rec
 from ..exc import NoAnnotationError
 from . import dtypes
 
@@ -37,6 +40,9 @@ class BaseLogParser(object):
     # Tests to run in order to validate output
     _TESTS = []
 
+    # (fields, persistent values, event) from which _empty_event copies new events
+    _event_prototype = None
+
     def __init__(self, protocol, subject, montage, experiment, session, files,
                  primary_log='session_log', allow_unparsed_events=False, include_stim_params=False):
         """
@@ -189,16 +195,21 @@ class BaseLogParser(object):
         """
         Returns an event with fieldnames and defaults from self._fields
         Additionally adds the fields which persist across every event in the structure (subject, montage ...)
+        The event is copied from a prototype which is rebuilt only when the fields or persistent values change
         :return:
         """
-        event = self.event_from_template(self._fields)
-        event.protocol = self._protocol
-        event.subject = self._subject
-        event.montage = self._montage
-        event.experiment = self._experiment
-        event.session = self._session
+        persistent = (self._protocol, self._subject, self._montage, self._experiment, self._session)
+        prototype = self._event_prototype
+        if prototype is None or prototype[0] is not self._fields or prototype[1] != persistent:
+            event = self.event_from_template(self._fields)
+            event.protocol = self._protocol
+            event.subject = self._subject
+            event.montage = self._montage
+            event.experiment = self._experiment
+            event.session = self._session
+            prototype = self._event_prototype = (self._fields, persistent, event)
 
-        return event
+        return prototype[2].copy()
 
     @staticmethod
     def set_event_stim_params(event, jacksheet, index=0, **params):
@@ -310,7 +321,7 @@ class BaseLogParser(object):
         :return: all events
         """
         # Start with a single empty event
-        events = self._empty_event
+        events = EventAccumulator(self._empty_event)
         # Loop over the contents of the log file
         for raw_event in self._contents:
             this_type = self._get_raw_event_type(raw_event)
@@ -328,19 +339,193 @@ class BaseLogParser(object):
             if not isinstance(new_event, np.recarray) and not (new_event is False):
                 raise Exception('Event not properly provided from log parser for raw event {}'.format(raw_event))
             elif isinstance(new_event, np.recarray):
-                events = np.append(events, new_event)
+                events.append(new_event)
 
             # Modify existing events if necessary
             if this_type in self._type_to_modify_events:
-                events = self._type_to_modify_events[this_type](events.view(np.recarray))
+                events.replace(self._type_to_modify_events[this_type](events.view()))
 
         # Remove first (empty) event
+        events = events.materialize()
         if events.ndim > 0:
             return events[1:]
         else:
             return events
 
 
+class EventAccumulator(object):
+    """
+    Collects events into a preallocated buffer which doubles in size when it fills, so that building an events
+    structure of n events copies O(n) records rather than the O(n^2) of calling np.append once per event.
+    Before any event is appended it holds the single initial event unchanged, as np.append would.
+    """
+
+    INITIAL_CAPACITY = 256
+
+    def __init__(self, first_event):
+        """
+        :param first_event: The (empty) event the structure starts with
+        """
+        self._events = first_event
+        self._buffer = None
+        self._n = 0
+
+    def __len__(self):
+        return self._events.size if self._buffer is None else self._n
+
+    def _reset(self, events):
+        """
+        Refills the buffer from an events structure not created by this accumulator
+        :param events: 1-d array of events
+        """
+        self._buffer = np.empty(max(self.INITIAL_CAPACITY, 2 * events.size), dtype=events.dtype)
+        self._buffer[:events.size] = events
+        self._n = events.size
+        self._events = None
+
+    def append(self, new_events):
+        """
+        Adds events to the end of the structure
+        :param new_events: recarray of one or more events
+        """
+        new_events = np.ravel(new_events)
+        if self._buffer is None:
+            self._reset(np.ravel(self._events))
+        if new_events.dtype != self._buffer.dtype:
+            # Leave any dtype promotion to np.append
+            self._reset(np.append(self.materialize(), new_events))
+            return
+        end = self._n + new_events.size
+        if end > self._buffer.size:
+            buffer = np.empty(max(2 * self._buffer.size, end), dtype=self._buffer.dtype)
+            buffer[:self._n] = self._buffer[:self._n]
+            self._buffer = buffer
+        self._buffer[self._n:end] = new_events
+        self._n = end
+
+    def replace(self, events):
+        """
+        Replaces the contents of the structure with the output of a function that modified it
+        :param events: The modified events
+        """
+        if self._buffer is None:
+            self._events = events
+        elif not self._is_prefix(events):
+            self._reset(np.ravel(events))
+        else:
+            self._n = events.size
+
+    def _is_prefix(self, events):
+        """
+        :return: True if events is a view onto the start of the buffer (e.g. the events were modified in place)
+        """
+        return (events.ndim == 1 and events.dtype == self._buffer.dtype and
+                events.strides == self._buffer.strides and events.size <= self._buffer.size and
+                events.__array_interface__['data'][0] == self._buffer.__array_interface__['data'][0])
+
+    def materialize(self):
+        """
+        :return: The events accumulated so far, as an array independent of the buffer
+        """
+        if self._buffer is None:
+            return self._events
+        return self._buffer[:self._n].copy()
+
+    def view(self):
+        """
+        :return: The events accumulated so far as a recarray sharing memory with the buffer, to be modified in place
+        """
+        if self._buffer is None:
+            return self._events.view(np.recarray)
+        return self._buffer[:self._n].view(np.recarray)
+
+
+def merge_stim_events(events, stim_events, off_events, has_off, event_template, persistent_field_fn, stim_fields,
+                      mark_stim_fn, sort_field='mstime'):
+    """
+    Merges stim events and their STIM_OFF events into a structure of task events in a single pass, with the same
+    result as inserting each stim event and its STIM_OFF event in turn, in the order in which they were logged.
+    Each stim event is placed after every event that does not come after it, and each STIM_OFF event after the events
+    that occurred during stimulation. Fields in persistent_field_fn(previous event) are copied into every inserted
+    event from the event that preceded it when it was inserted.
+    :param events: Task events, sorted by sort_field
+    :param stim_events: Stim events, with stim_fields set, in the order in which they were logged
+    :param off_events: STIM_OFF events, with stim_fields set, for each stim event in which has_off is True
+    :param has_off: Boolean array marking the stim events that are followed by a STIM_OFF event
+    :param event_template: Gives default values for the inserted events
+    :param persistent_field_fn: Function that accepts an event and returns the fields which persist into a stim event
+    :param stim_fields: Fields of the inserted events which are not copied from the preceding event
+    :param mark_stim_fn: Called as mark_stim_fn(merged_events, indices, off_index) to mark the events at indices,
+                         which occurred between a stim event and off_events[off_index], as stimulated
+    :param sort_field: Field by which the merged events are ordered
+    :return: recarray of the merged events
+    """
+    n_events, n_stims, n_offs = len(events), len(stim_events), len(off_events)
+    stim_indices = np.arange(n_stims)
+    off_stim_indices = np.nonzero(has_off)[0]
+
+    # The first event after a value is the first at which the running maximum exceeds it
+    latest = np.maximum.accumulate(events[sort_field])
+    stim_values = stim_events[sort_field]
+    off_values = off_events[sort_field]
+    stim_gaps = np.searchsorted(latest, stim_values, side='right')
+    off_gaps = np.maximum(np.searchsorted(latest, off_values, side='left'), stim_gaps[has_off])
+
+    # Order by the task event each inserted event precedes, then by time. At the same time, a STIM_OFF event comes
+    # before the events already there, so later logged ones come first, and a stim event after them, in log order.
+    # A STIM_OFF event that does not come after its stim event follows it directly
+    follows_stim = off_values <= stim_values[has_off]
+    gaps = np.concatenate([np.arange(n_events), stim_gaps, off_gaps])
+    is_task = np.concatenate([np.ones(n_events, bool), np.zeros(n_stims + n_offs, bool)])
+    times = np.concatenate([np.zeros(n_events), stim_values, np.maximum(off_values, stim_values[has_off])])
+    after_others = np.concatenate([np.zeros(n_events, bool), np.ones(n_stims, bool), follows_stim])
+    sequence = np.concatenate([np.zeros(n_events, int), 2 * stim_indices,
+                               np.where(follows_stim, 2 * off_stim_indices + 1, -off_stim_indices)])
+    order = np.lexsort((sequence, after_others, times, is_task, gaps))
+    positions = np.empty(len(order), int)
+    positions[order] = np.arange(len(order))
+    event_positions = positions[:n_events]
+    new_positions = positions[n_events:]
+
+    empty_event = BaseLogParser.event_from_template(event_template)
+    merged_events = np.empty(len(order), dtype=events.dtype).view(np.recarray)
+    merged_events[event_positions] = events
+    merged_events[new_positions] = empty_event
+
+    new_events = np.concatenate([stim_events, off_events])
+    new_values = np.concatenate([stim_values, off_values])
+    new_stim_indices = np.concatenate([stim_indices, off_stim_indices])
+    # Positions of the task events and of the events inserted so far, in merged order
+    present = list(event_positions)
+
+    def insert(new_index):
+        position = new_positions[new_index]
+        n_before = bisect.bisect_left(present, position)
+        previous_event = merged_events[present[n_before - 1]] if n_before > 0 else empty_event
+        for field in persistent_field_fn(previous_event):
+            merged_events[field][position] = deepcopy(previous_event[field])
+        for field in stim_fields:
+            merged_events[field][position] = new_events[field][new_index]
+        present.insert(n_before, position)
+
+    # Fill in inserted events in log order, so that persistent fields carry over from earlier inserted events, and
+    # mark the events that occurred during each stimulation, including stim events that were logged before it
+    off_indices = np.cumsum(has_off) - 1
+    for stim_index in range(n_stims):
+        insert(stim_index)
+        if has_off[stim_index]:
+            off_index = off_indices[stim_index]
+            during = (new_stim_indices < stim_index) & (new_values > stim_values[stim_index]) & \
+                     (new_values < off_values[off_index])
+            indices = np.sort(np.concatenate([event_positions[stim_gaps[stim_index]:off_gaps[off_index]],
+                                              new_positions[during]]))
+            if len(indices) > 0:
+                mark_stim_fn(merged_events, indices, off_index)
+            insert(n_stims + off_index)
+
+    return merged_events
+
+
 class BaseSessionLogParser(BaseLogParser):
     """
     BaseSessionLogParser contains the basic structure for creating events from session.log files
@@ -464,7 +649,7 @@ class BaseSys3LogParser(BaseLogParser):
     def _read_primary_log(self):
         contents = []
         for log in self._primary_log:
-            contents += json.load(codecs.open(log,  encoding='utf-8'))['events']
+            contents += read_event_log(log)['events']
         return contents
 
     def event_default(self, event_json):
@@ -590,8 +775,7 @@ class BaseSys3_1LogParser(BaseSessionLogParser):
     def clean_events(self, events):
         # Add in experiment version
         events = super(BaseSys3_1LogParser,self).clean_events(events)
-        with open(self._files['event_log'][0],'r') as event_log:
-            version_info = json.load(event_log)['versions']
+        version_info = read_event_log(self._files['event_log'][0])['versions']
         events.exp_version = version_info['task']['version']
         return events
 
@@ -613,6 +797,48 @@ class RecogParser(BaseSessionLogParser):
         raise NotImplementedError
 
 
+def index_events_by_type(events, match_field):
+    """
+    Groups events by type, sorting each group by match_field, so that events close to a value can be found by bisection
+    :param events: The events to index
+    :param match_field: The field on which events are matched
+    :return: {type: (values of match_field in ascending order, indices of those events in events)}
+    """
+    types = events['type']
+    values = events[match_field]
+    if len(types) == 0:
+        return {}
+    order = np.argsort(values, kind='mergesort')
+    order = order[np.argsort(types[order], kind='mergesort')]
+    sorted_types = types[order]
+    starts = np.concatenate(([0], np.nonzero(sorted_types[1:] != sorted_types[:-1])[0] + 1))
+    ends = np.append(starts[1:], len(order))
+    return {sorted_types[start]: (values[order[start:end]], order[start:end]) for start, end in zip(starts, ends)}
+
+
+def find_matching_events(match_index, value, types, tolerance):
+    """
+    Finds the indexed events of the given types whose match_field is within tolerance of value
+    :param match_index: As returned by index_events_by_type
+    :param value: The value of match_field to match
+    :param types: The types of event which can match
+    :param tolerance: The maximum difference between value and the match_field of a matching event
+    :return: indices of the matching events, in ascending order
+    """
+    matches = []
+    for this_type in types:
+        if this_type not in match_index:
+            continue
+        values, indices = match_index[this_type]
+        start = np.searchsorted(values, value - tolerance, side='left')
+        end = np.searchsorted(values, value + tolerance, side='right')
+        close = np.abs(values[start:end] - value) <= tolerance
+        matches.append(indices[start:end][close])
+    if not matches:
+        return np.array([], dtype=int)
+    return np.unique(np.concatenate(matches))
+
+
 class EventComparator(object):
     """
     Compares two sets of np.recarray events, comparing events with matching types and mstimes and producing a list of
@@ -696,6 +922,9 @@ class EventComparator(object):
                 mismatch.append('%s: %s v. %s' % (field, ev1[field], ev2[field]))
         return mismatch
 
+    # Maximum difference in match_field between events that are compared
+    MATCH_TOLERANCE = 4
+
     def compare(self):
         """
         Compares the provided events structures
@@ -711,40 +940,35 @@ class EventComparator(object):
         for this_ignore in self.type_ignore:
             mask2[self.events2['type'] == this_ignore] = False
 
-        # Collect the events that failed comparison. Have to initialize with an event, which will be removed later.
-        bad_events1 = self.events1[0]
+        # Collect the indices of the events that failed comparison
+        bad_indices1 = []
 
+        match_index = index_events_by_type(self.events2, self.match_field)
         for i, event1 in enumerate(self.events1):
-            # Get events that occurred close in time, and with the same type
-            this_mask2 = np.logical_and(
-                    np.abs(event1[self.match_field] - self.events2[self.match_field]) <= 4,
-                    event1['type'] == self.events2['type'])
-
-            # Get any other events with equivalent types
+            # Get events that occurred close in time, and with the same or an equivalent type
+            types = [event1['type']]
             if event1['type'] in self.type_switch:
-                for type in self.type_switch[event1['type']]:
-                    this_mask2 = np.logical_or(this_mask2, np.logical_and(
-                        np.abs(event1[self.match_field] - self.events2[self.match_field]) <= 4, type == self.events2['type']
-                    ))
+                types.extend(self.type_switch[event1['type']])
+            matches2 = find_matching_events(match_index, event1[self.match_field], types, self.MATCH_TOLERANCE)
 
             # If we couldn't find a match, record this event
-            if not this_mask2.any() and not event1['type'] in self.type_ignore:
-                bad_events1 = np.append(bad_events1, event1)
+            if not len(matches2) and not event1['type'] in self.type_ignore:
+                bad_indices1.append(i)
             elif event1['type'] not in self.type_ignore:  # Otherwise, compare the events
-                mismatches = self._get_field_mismatch(event1, self.events2[this_mask2])
+                mismatches = self._get_field_mismatch(event1, self.events2[matches2])
                 if len(mismatches) > 0:
                     found_bad = True
-                    bad_events1 = np.append(bad_events1, event1)
+                    bad_indices1.append(i)
                     for mismatch in mismatches:
                         err_msg += 'mismatch: %d %s\n' % (i, mismatch)
 
             # Mark that these events have been seen
-            mask2[this_mask2] = False
+            mask2[matches2] = False
 
         if self.verbose:
             # Gather any bad events from events1
-            if bad_events1.size > 1:
-                for bad_event1 in bad_events1[1:]:
+            if bad_indices1:
+                for bad_event1 in self.events1[bad_indices1]:
                     if not self.exceptions(bad_event1, None, None):
                         found_bad = True
                         err_msg += '\n--1--\n' + pformat_rec(bad_event1)
@@ -764,6 +988,9 @@ class StimComparator(object):
     Similar to EventComparator, but specifically for stimulation events, as it requires field/subfield comparison
     """
 
+    # Maximum difference in match_field between events that are compared
+    MATCH_TOLERANCE = 4
+
     def __init__(self, events1, events2, fields_to_compare, exceptions, match_field='mstime'):
         """
         :param events1:
@@ -804,50 +1031,102 @@ class StimComparator(object):
                 return None
         return event_field
 
-    def _get_field_mismatch(self, event1, event2):
+    @classmethod
+    def get_subfield_column(cls, events, field_whole):
         """
-        Gets the fields that do not match between two events
-        :param event1:
-        :param event2:
-        :return: a string of any mismatches
+        Gets a subfield from every event in a recarray based on a string 'a.b.c'
+        :param events: the events from which to retrieve the subfield
+        :param field_whole: the string representing the subfield to retrieve
+        :return: 2-d array with one row of values per event
         """
-        mismatches = ''
-        bad_events_1 = []
-        bad_events_2 = []
-        for field_name1, field_name2 in self.fields_to_compare.items():
-            field1 = self.get_subfield(event1, field_name1)
-            field2 = self.get_subfield(event2, field_name2)
-            try:
-                field2_is_nan = np.isnan(field2)
-            except:
-                field2_is_nan = False
-            if not (field1 is None and field2_is_nan) and field1 != field2:
-                if not self.exceptions(event1, event2, field_name1, field_name2):
-                    mismatches += '{}/{}: {} vs {}\n'.format(field_name1, field_name2, field1, field2)
-                    bad_events_1.append(event1)
-                    bad_events_2.append(event2)
-
-        for (ev1, ev2) in zip(bad_events_1, bad_events_2):
-            mismatches += '--1--\n{}\n--2--\n{}'.format(pformat_rec(ev1), pformat_rec(ev2))
+        try:
+            column = events
+            for field in field_whole.split('.'):
+                column = column[field]
+            return np.asarray(column).reshape(len(events), -1)
+        except (ValueError, IndexError, KeyError):
+            # Subfields stored as objects have to be retrieved one event at a time
+            return np.array([cls.get_subfield(event, field_whole) for event in events],
+                            dtype=object).reshape(len(events), -1)
+
+    def _match_pairs(self):
+        """
+        Pairs each event in events1 with every event in events2 of the same type that occurs close to it
+        :return: (indices into events1, indices into events2) of each pair, ordered by index into events1
+        """
+        match_index = index_events_by_type(self.events2, self.match_field)
+        values1 = self.events1[self.match_field]
+        pairs1, pairs2 = [np.array([], dtype=int)], [np.array([], dtype=int)]
+        for this_type, (values2, indices2) in match_index.items():
+            indices1 = np.nonzero(self.events1['type'] == this_type)[0]
+            starts = np.searchsorted(values2, values1[indices1] - self.MATCH_TOLERANCE, side='left')
+            ends = np.searchsorted(values2, values1[indices1] + self.MATCH_TOLERANCE, side='right')
+            counts = ends - starts
+            this_pairs1 = np.repeat(indices1, counts)
+            # Each pair's position in values2 is the start of its range plus its offset within the range
+            positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            close = np.abs(values2[positions] - values1[this_pairs1]) <= self.MATCH_TOLERANCE
+            pairs1.append(this_pairs1[close])
+            pairs2.append(indices2[positions][close])
+        pairs1 = np.concatenate(pairs1)
+        pairs2 = np.concatenate(pairs2)
+        order = np.lexsort((pairs2, pairs1))
+        return pairs1[order], pairs2[order]
 
-        return mismatches
+    @staticmethod
+    def _is_nan(values):
+        try:
+            return np.isnan(values.astype(float))
+        except (TypeError, ValueError):
+            return np.zeros(values.shape, dtype=bool)
+
+    def _mismatched_pairs(self, pairs1, pairs2, field_name1, field_name2):
+        """
+        Compares one field across all matched pairs at once
+        :return: boolean array, true for the pairs in which the field does not match
+        """
+        field1 = self.get_subfield_column(self.events1[pairs1], field_name1)
+        field2 = self.get_subfield_column(self.events2[pairs2], field_name2)
+        if field1.shape[1] == 0:
+            # Events without stim params only match a missing value
+            return ~self._is_nan(field2).all(1)
+        if field1.shape[1] != field2.shape[1] and 1 not in (field1.shape[1], field2.shape[1]):
+            return np.ones(len(pairs1), dtype=bool)
+        mismatched = np.asarray(field1 != field2, dtype=bool)
+        return np.broadcast_to(mismatched, (len(pairs1), max(field1.shape[1], field2.shape[1]))).any(1)
+
+    def diff_table(self):
+        """
+        Compares the fields of every pair of matching events in events1 and events2
+        :return: DataFrame with a row (event, type, <match_field>, field1, field2, value1, value2) for each mismatch
+                 that is not an exception, where event is the index into events1, and type and <match_field> are
+                 those of that event
+        """
+        pairs1, pairs2 = self._match_pairs()
+        rows = []
+        for field_order, (field_name1, field_name2) in enumerate(self.fields_to_compare.items()):
+            mismatched = self._mismatched_pairs(pairs1, pairs2, field_name1, field_name2)
+            for i in np.unique(pairs1[mismatched]):
+                # Exceptions are given the event from events1 and all of its matches in events2
+                event1 = self.events1[i]
+                event2 = self.events2[pairs2[np.searchsorted(pairs1, i, 'left'):np.searchsorted(pairs1, i, 'right')]]
+                if not self.exceptions(event1, event2, field_name1, field_name2):
+                    rows.append((i, field_order, event1['type'], event1[self.match_field], field_name1, field_name2,
+                                 self.get_subfield(event1, field_name1), self.get_subfield(event2, field_name2)))
+        rows.sort(key=lambda row: row[:2])
+        return pd.DataFrame([row[:1] + row[2:] for row in rows],
+                            columns=['event', 'type', self.match_field, 'field1', 'field2', 'value1', 'value2'])
 
     def compare(self):
         """
         Compares all events in event1 and events2
-        :return:
+        :return: a table of any mismatches, with the index, type and match_field of each mismatched event in events1,
+                 or an empty string if there are none
         """
-        mismatches = ''
-
-        for i, event1 in enumerate(self.events1):
-            this_mask2 = np.logical_and(
-                    np.abs(event1[self.match_field] - self.events2[self.match_field]) <= 4, event1['type'] == self.events2['type'])
-            if not this_mask2.any():
-                continue
-            this_mismatch = self._get_field_mismatch(event1, self.events2[this_mask2])
-            if this_mismatch:
-                mismatches += this_mismatch + '\n'
-        return mismatches
+        diffs = self.diff_table()
+        if len(diffs) == 0:
+            return ''
+        return diffs.to_string(index=False) + '\n'
 
 
 
@@ -882,36 +1161,73 @@ class EventCombiner(object):
             return {}
 
 
+    @staticmethod
+    def fill_defaults(events):
+        """
+        Fills every field with the default used for fields that are missing from some of the combined events
+        (see get_default): '' for strings, -999 for numbers, and zeros (i.e. empty) for nested and list fields
+        :param events: the array to fill
+        """
+        for name in events.dtype.names:
+            field = events[name]
+            if field.dtype.names or field.ndim > events.ndim:
+                field[...] = np.zeros(1, field.dtype)
+            elif field.dtype.kind in 'SU':
+                field[...] = ''
+            elif field.dtype.kind in 'iuf':
+                field[...] = -999
+            else:
+                field[...] = np.zeros(1, field.dtype)
+
+    @classmethod
+    def copy_fields(cls, dest, src):
+        """
+        Copies the fields of src into the matching fields of dest, casting each to the type in dest.
+        List fields (i.e. sub-arrays) are truncated or padded with empty entries to fit.
+        :param dest: array with the combined dtype
+        :param src: array of the same shape as dest, with a subset of its fields
+        """
+        for name in src.dtype.names:
+            if name == '_remove' or name not in dest.dtype.names:
+                continue
+            dest_field = dest[name]
+            src_field = src[name]
+            if dest_field.ndim > dest.ndim or src_field.ndim > src.ndim:
+                length = min(dest_field.shape[-1] if dest_field.ndim > dest.ndim else 1,
+                             src_field.shape[-1] if src_field.ndim > src.ndim else 1)
+                dest_field = dest_field.reshape(dest.shape + (-1,))[..., :length]
+                src_field = src_field.reshape(src.shape + (-1,))[..., :length]
+            if dest_field.dtype.names and src_field.dtype.names:
+                cls.copy_fields(dest_field, src_field)
+            else:
+                dest_field[...] = src_field
+
     def combine(self):
         """
         Combines the events that were passed into the constructor
         :return: combined events, sorted by the specified sort_field
         """
+        dtype = self.combine_dtypes([e.dtype for e in self.events])
 
-        # Convert the events to a dictionary
-        all_dict_events = []
-        for events in self.events:
-            if len(events) == 0:
-                continue
-            dict_events = to_dict(events)
-            # Add fields to each dictionary that don't appear in the other
-            if len(all_dict_events) > 0:
-                keys = [k for k in dict_events[0].keys() if k not in all_dict_events[0].keys()]
-                for key in keys:
-                    default = self.get_default(dict_events[0][key])
-                    for event in all_dict_events:
-                        event[key] = default
-                keys = [k for k in all_dict_events[0].keys() if k not in dict_events[0].keys()]
-                for key in keys:
-                    default = self.get_default(all_dict_events[0][key])
-                    for event in dict_events:
-                        event[key] = default
-            all_dict_events += dict_events
+        # Events marked as removed are left out, as they would be from a JSON file
+        sources = [events if '_remove' not in events.dtype.names else events[~events['_remove'].astype(bool)]
+                   for events in self.events]
+        sources = [events for events in sources if len(events) > 0]
+
+        # Cast each set of events into the combined dtype
+        combined = np.empty(sum(len(events) for events in sources), dtype=dtype)
+        self.fill_defaults(combined)
+        if '_remove' in combined.dtype.names:
+            # None of the combined events are removed
+            combined['_remove'] = 0
+        start = 0
+        for events in sources:
+            self.copy_fields(combined[start:start + len(events)], events)
+            start += len(events)
 
         # Sort them, and return them
-        all_dict_events = sorted(all_dict_events, key=lambda d:d[self.sort_field])
-        dtypes = self.combine_dtypes([e.dtype for e in self.events])
-        return from_dict(all_dict_events,dtypes=dtypes)
+        order = np.argsort(combined[self.sort_field], kind='mergesort')
+        return combined[order].view(np.recarray)
 
     def combine_dtypes(self,dtypes):
         assert len(dtypes)>1
@@ -1,6 +1,5 @@
-from .base_log_parser import BaseSessionLogParser
+from .base_log_parser import BaseSessionLogParser, merge_stim_events
 import numpy as np
-from copy import deepcopy
 import re
 
 class System2LogParser:
@@ -40,14 +39,16 @@ class System2LogParser:
 
 
     def __init__(self, host_logs, jacksheet=None):
-        stim_events = self._empty_event()
+        stim_events = []
         for i, log in enumerate(host_logs):
             stim_lines = self.get_rows_by_type(log, 'STIM')
             for line in stim_lines:
                 if len(line) > 4:
-                    stim_events = np.append(stim_events, self.make_stim_event(line, jacksheet))
-                    stim_events[-1].stim_params['file_index'][0] = i
-        self._stim_events = stim_events[1:] if stim_events.shape else stim_events
+                    stim_event = self.make_stim_event(line, jacksheet)
+                    stim_event.stim_params['file_index'][0] = i
+                    stim_events.append(stim_event)
+        # Collect the stim events into one array, or a single empty event if there are none
+        self._stim_events = np.hstack(stim_events).view(np.recarray) if stim_events else self._empty_event()
 
     @classmethod
     def sys2_fields(cls):
@@ -92,64 +93,47 @@ class System2LogParser:
         # If no stim events available
         if len(self.stim_events.shape) == 0:
             return merged_events
-        for i, stim_event in enumerate(self.stim_events):
-            # Get the mstime for this host event
-            sort_value = event_to_sort_value(stim_event.stim_params)
-            # Determine where to insert it in the full events structure
-            after_events = (merged_events[self._TASK_SORT_FIELD] > sort_value)
-            if after_events.any():
-                insert_index = after_events.nonzero()[0][0]
-            else:
-                insert_index = merged_events.shape[0]
-            # Copy the persistent fields from the previous event, modify the remaining fields
-            if insert_index > 0:
-                event_to_copy = merged_events[insert_index-1]
-            else:
-                event_to_copy = BaseSessionLogParser.event_from_template(event_template)
-            new_event = self.partial_copy(event_to_copy, event_template, persistent_field_fn)
-            new_event.type = 'STIM_ON' if stim_event.stim_params['n_pulses'][0] > 1 else 'STIM_SINGLE_PULSE'
-            new_event[self._STIM_ON_FIELD] = True
-            new_event[self._TASK_SORT_FIELD] = sort_value
-            new_event[self._STIM_PARAMS_FIELD] = stim_event.stim_params
-            # Insert into the events structure
-            merged_events = np.append(merged_events[:insert_index],
-                                      np.append(new_event, merged_events[insert_index:]))
-
-            if stim_event.stim_params['n_pulses'][0] > 1:
-                # Do the same for the stim_off_event
-                stim_off_sub_event = deepcopy(stim_event.stim_params).view(np.recarray)
-                stim_off_sub_event.stim_on = False
-                stim_off_sub_event.hosttime += stim_off_sub_event.stim_duration
-                stim_off_value = event_to_sort_value(stim_off_sub_event)
-                modify_indices = np.where(np.logical_and(merged_events[self._TASK_SORT_FIELD] > sort_value,
-                                                         merged_events[self._TASK_SORT_FIELD] < stim_off_value))[0]
-
-                # Modify the events between STIM and STIM_OFF to show that stim was applied
-                for modify_index in modify_indices:
-                    merged_events[modify_index][self._STIM_PARAMS_FIELD][0] = stim_event[0]
-                    merged_events[modify_index][self._STIM_ON_FIELD] = True
-
-                # Insert the STIM_OFF event after the modified events if any, otherwise directly after the STIM event
-                insert_index = modify_indices[-1] + 1 if len(modify_indices) > 0 else insert_index + 1
-                stim_off_event = self.partial_copy(merged_events[insert_index-1], event_template, persistent_field_fn)
-                stim_off_event.type = 'STIM_OFF'
-                stim_off_event[self._STIM_ON_FIELD] = False
-                stim_off_event[self._STIM_PARAMS_FIELD] = stim_off_sub_event
-                stim_off_event[self._TASK_SORT_FIELD] = stim_off_value
-
-                # Merge the stim off event
-                merged_events = np.append(merged_events[:insert_index],
-                                          np.append(stim_off_event, merged_events[insert_index:]))
+
+        # Get the mstime for each host event, to insert them in the order they were logged
+        stim_events = self.stim_events.view(np.recarray)
+        sort_values = np.array([event_to_sort_value(stim_event.stim_params) for stim_event in stim_events])
+
+        new_events = np.repeat(np.atleast_1d(BaseSessionLogParser.event_from_template(event_template)),
+                               len(stim_events)).view(np.recarray)
+        has_off = stim_events.stim_params['n_pulses'][:, 0] > 1
+        new_events.type = np.where(has_off, 'STIM_ON', 'STIM_SINGLE_PULSE')
+        new_events[self._STIM_ON_FIELD] = True
+        new_events[self._TASK_SORT_FIELD] = sort_values
+        new_events[self._STIM_PARAMS_FIELD] = stim_events.stim_params
+
+        # Do the same for the stim_off_events
+        stim_off_sub_events = stim_events.stim_params[has_off].copy().view(np.recarray)
+        stim_off_sub_events.stim_on = False
+        stim_off_sub_events.hosttime += stim_off_sub_events.stim_duration
+        stim_off_events = np.repeat(np.atleast_1d(BaseSessionLogParser.event_from_template(event_template)),
+                                    len(stim_off_sub_events)).view(np.recarray)
+        stim_off_events.type = 'STIM_OFF'
+        stim_off_events[self._STIM_ON_FIELD] = False
+        stim_off_events[self._STIM_PARAMS_FIELD] = stim_off_sub_events
+        stim_off_events[self._TASK_SORT_FIELD] = [event_to_sort_value(stim_off_sub_event)
+                                                  for stim_off_sub_event in stim_off_sub_events]
+        stim_events_with_off = stim_events[has_off]
+
+        def mark_stim(merged_events, indices, off_index):
+            # Modify the events between STIM and STIM_OFF to show that stim was applied
+            stim_event = stim_events_with_off[off_index]
+            for modify_index in indices:
+                merged_events[modify_index][self._STIM_PARAMS_FIELD][0] = stim_event[0]
+                merged_events[modify_index][self._STIM_ON_FIELD] = True
+
+        merged_events = merge_stim_events(merged_events, new_events, stim_off_events, has_off,
+                                          event_template, persistent_field_fn,
+                                          ('type', self._STIM_ON_FIELD, self._TASK_SORT_FIELD,
+                                           self._STIM_PARAMS_FIELD),
+                                          mark_stim, sort_field=self._TASK_SORT_FIELD)
         merged_events = self.mark_stim_items(merged_events)
         return merged_events
 
-    @staticmethod
-    def partial_copy(event_to_copy, event_template, persistent_field_fn):
-        new_event = BaseSessionLogParser.event_from_template(event_template)
-        for field in persistent_field_fn(event_to_copy):
-            new_event[field] = deepcopy(event_to_copy[field])
-        return new_event
-
     @staticmethod
     def get_duration(params):
         duration_sec = (float(params['n_bursts'] - 1) / params['burst_freq']) + \
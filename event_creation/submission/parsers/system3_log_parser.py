@@ -1,10 +1,9 @@
-from copy import deepcopy
-import json
 import numpy as np
 import re
 
-from .base_log_parser import BaseLogParser, BaseSys3LogParser
+from .base_log_parser import BaseLogParser, BaseSys3LogParser, merge_stim_events
 from .electrode_config_parser import ElectrodeConfig
+from ..readers.event_log_reader import read_event_log
 from ..log import logger
 
 
@@ -61,25 +60,25 @@ class System3LogParser(object):
         self.source_time_field = self.SOURCE_TIME_FIELD
         self.source_time_multiplier = self.SOURCE_TIME_MULTIPLIER
 
-        stim_events = self._empty_event()
+        stim_events = []
         for i, (log, electrode_config_file) in enumerate(zip(event_logs, electrode_config_files)):
             electrode_config = ElectrodeConfig(electrode_config_file)
 
             # This is necessary because v3.1.7 stores Odin status messages as
             # events and improperly doesn't have the right key. In later
             # verisons, this is fixed to store Odin status messages elsewhere.
-            event_dict = [event for event in json.load(open(log))['events'] if self._LABEL_FIELD in event]
+            event_dict = [event for event in read_event_log(log)['events'] if self._LABEL_FIELD in event]
 
             stim_dicts = [event for event in event_dict if event[self._LABEL_FIELD] == self._STIM_LABEL]
 
             for event_json in stim_dicts:
-                new_event = self.make_stim_event(event_json, electrode_config)
-                stim_events = np.append(stim_events, new_event)
+                stim_events.append(self.make_stim_event(event_json, electrode_config))
 
-        self._stim_events = stim_events[1:] if stim_events.shape else stim_events
+        # Collect the stim events into one array, or a single empty event if there are none
+        self._stim_events = np.hstack(stim_events).view(np.recarray) if stim_events else self._empty_event()
 
-        if stim_events.shape:
-            logger.info("Found {} stim events".format(stim_events.shape))
+        if stim_events:
+            logger.info("Found {} stim events".format(self._stim_events.shape))
         else:
             logger.warn("Found no stim events")
 
@@ -134,7 +133,17 @@ class System3LogParser(object):
     def _empty_event(cls):
         return BaseLogParser.event_from_template(cls.stim_params_template())
 
-    def merge_events(self, events, event_template, event_to_sort_value, persistent_field_fn):
+    def merge_events(self, events, event_template, event_to_sort_value, persistent_field_fn,
+                     stim_params_to_sort_values=None):
+        """
+        Merges the stim events into the task events
+        :param event_to_sort_value: function giving the value of the sort field for a single stim_params
+        :param stim_params_to_sort_values: optional function giving the values for a whole array of stim_params at once
+        """
+
+        if stim_params_to_sort_values is None:
+            def stim_params_to_sort_values(stim_params):
+                return np.array([event_to_sort_value(params) for params in stim_params])
 
         merged_events = events[:]
 
@@ -142,71 +151,42 @@ class System3LogParser(object):
         if len(self.stim_events.shape) == 0:
             return merged_events
 
-        for i, stim_event in enumerate(self.stim_events):
-            # Get the mstime for this host event
-            sort_value = event_to_sort_value(stim_event.stim_params[0])
-
-            # Determine where to insert it in the full events structure
-            after_events = (merged_events[self._DEST_SORT_FIELD] > sort_value)
-            if after_events.any():
-                insert_index = after_events.nonzero()[0][0]
-            else:
-                insert_index = merged_events.shape[0]
-
-            # Copy the persistent fields from the previous event, modify the remaining fields
-            if insert_index > 0:
-                event_to_copy = merged_events[insert_index-1]
-            else:
-                event_to_copy = BaseLogParser.event_from_template(event_template)
-            new_event = self.partial_copy(event_to_copy, event_template, persistent_field_fn)
-
-            if 'type' in stim_event.dtype.names:
-                new_event.type=stim_event['type']
-            else:
-                new_event.type = 'STIM_ON' if stim_event.stim_params['n_pulses'][0] > 1 else 'STIM_SINGLE_PULSE'
-            new_event.stim_params = stim_event.stim_params
-
-            new_event[self._DEST_SORT_FIELD] = sort_value
-
-            # Insert into the events structure
-            merged_events = np.append(merged_events[:insert_index],
-                                      np.append(new_event, merged_events[insert_index:]))
-
-            if new_event.type=='STIM_ON':
-                # Do the same to create the stim_off_event
-                stim_off_sub_event = deepcopy(stim_event.stim_params).view(np.recarray)
-                stim_off_sub_event.stim_on = False
-                stim_off_sub_event['host_time'] += stim_off_sub_event.stim_duration
-                stim_off_time = event_to_sort_value(stim_off_sub_event)
-
-                modify_indices = np.where(np.logical_and(merged_events[self._DEST_SORT_FIELD] > sort_value,
-                                                         merged_events[self._DEST_SORT_FIELD] < stim_off_time))[0]
-
-                # Modify the events between STIM and STIM_OFF to show that stim was applied
-                for modify_index in modify_indices:
-                    merged_events[modify_index].stim_params = stim_off_sub_event
-                    merged_events[modify_index].is_stim = True
-
-                # Insert the STIM_OFF event after the modified events if any, otherwise directly after the STIM event
-                insert_index = modify_indices[-1] + 1 if len(modify_indices) > 0 else insert_index + 1
-                stim_off_event = self.partial_copy(merged_events[insert_index-1], event_template, persistent_field_fn)
-                stim_off_event.type = 'STIM_OFF'
-                stim_off_event.stim_params = stim_off_sub_event
-                stim_off_event[self._DEST_SORT_FIELD] = stim_off_time
-
-                # Merge the stim off event
-                merged_events = np.append(merged_events[:insert_index],
-                                          np.append(stim_off_event, merged_events[insert_index:]))
+        # Get the mstime for each host event, to insert them in the order they were logged
+        stim_events = self.stim_events.view(np.recarray)
+        sort_values = stim_params_to_sort_values(stim_events.stim_params[:, 0])
+
+        new_events = np.repeat(np.atleast_1d(BaseLogParser.event_from_template(event_template)),
+                               len(stim_events)).view(np.recarray)
+        if 'type' in stim_events.dtype.names:
+            new_events.type = stim_events['type']
+        else:
+            new_events.type = np.where(stim_events.stim_params['n_pulses'][:, 0] > 1, 'STIM_ON', 'STIM_SINGLE_PULSE')
+        new_events.stim_params = stim_events.stim_params
+        new_events[self._DEST_SORT_FIELD] = sort_values
+
+        # Do the same to create the stim_off_events
+        has_off = new_events.type == 'STIM_ON'
+        stim_off_sub_events = stim_events.stim_params[has_off].copy().view(np.recarray)
+        stim_off_sub_events.stim_on = False
+        stim_off_sub_events['host_time'] += stim_off_sub_events.stim_duration
+        stim_off_events = np.repeat(np.atleast_1d(BaseLogParser.event_from_template(event_template)),
+                                    len(stim_off_sub_events)).view(np.recarray)
+        stim_off_events.type = 'STIM_OFF'
+        stim_off_events.stim_params = stim_off_sub_events
+        stim_off_events[self._DEST_SORT_FIELD] = stim_params_to_sort_values(stim_off_sub_events)
+
+        def mark_stim(merged_events, indices, off_index):
+            # Modify the events between STIM and STIM_OFF to show that stim was applied
+            merged_events.stim_params[indices] = stim_off_sub_events[off_index]
+            merged_events.is_stim[indices] = True
+
+        merged_events = merge_stim_events(merged_events, new_events, stim_off_events, has_off,
+                                          event_template, persistent_field_fn,
+                                          ('type', 'stim_params', self._DEST_SORT_FIELD), mark_stim,
+                                          sort_field=self._DEST_SORT_FIELD)
         merged_events = self.mark_stim_items(merged_events)
         return merged_events
 
-    @staticmethod
-    def partial_copy(event_to_copy, event_template, persistent_field_fn):
-        new_event = BaseLogParser.event_from_template(event_template)
-        for field in persistent_field_fn(event_to_copy):
-            new_event[field] = deepcopy(event_to_copy[field])
-        return new_event
-
     @staticmethod
     def get_n_pulses(params):
         return params['pulse_freq'] * params['stim_duration'] / (1000 * 1000)
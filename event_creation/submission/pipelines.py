@@ -18,6 +18,7 @@ from .parsers.math_parser import MathLogParser
 from .parsers.ltpfr2_log_parser import LTPFR2SessionLogParser
 from .parsers.ltpfr_log_parser import LTPFRSessionLogParser
 from .parsers.mat_converter import MathMatConverter
+from .readers.event_log_reader import clear_event_log_cache
 from .transfer_config import TransferConfig
 from .tasks import ImportJsonMontageTask, CleanLeafTask
 from .transferer import generate_ephys_transferer, generate_session_transferer, generate_localization_transferer,\
@@ -205,6 +206,9 @@ class TransferPipeline(object):
         except Exception as e:
             self.on_failure()
             raise
+        finally:
+            # Event logs decoded for this session are not needed by the next one
+            clear_event_log_cache()
 
 def build_micro_pipeline(subject, montage, experiment, session, protocol='r1', groups=tuple(), code=None,
                          original_session=None, new_experiment=None, **kwargs):
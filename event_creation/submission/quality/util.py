@@ -1,6 +1,8 @@
 import numpy as np
 from functools import wraps
 
+from ..readers.event_log_reader import read_event_log
+
 
 def timed(timed_function):
 
@@ -13,10 +15,8 @@ def timed(timed_function):
 
 
 def get_time_field(files):
-    import yaml
     if 'event_log' in files:
-        with open(files['event_log'][0]) as event_log_file:
-            event_log = yaml.load(event_log_file)
+        event_log = read_event_log(files['event_log'][0])
         version_no = event_log['versions']['Ramulator']
         if version_no >= '3.3':
             time_field = 'eegoffset'
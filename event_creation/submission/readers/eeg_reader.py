@@ -8,9 +8,17 @@ import os
 import re
 import numpy as np
 import json
-from shutil import copy
+import threading
+import time
+import bz2
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from shutil import copy, rmtree
+from scipy import sparse
 from scipy.linalg import pinv
-from scipy.signal import filtfilt, butter
+from scipy.signal import filtfilt, butter, resample_poly, sosfilt, sosfilt_zi, tf2sos
 from scipy.io import savemat
 
 import tables
@@ -22,11 +30,405 @@ except ImportError:
     warnings.warn("pyEDFlib not available")
 
 from .. import fileutil
+from ..configuration import config
 from ..log import logger
-from .nsx_utility.brpylib import NsxFile
-from ..exc import EEGError
+from .nsx_utility.nsx_blocks import NsxBlockFile
+from ..exc import EEGError, DecompressionError
 from ..parsers.electrode_config_parser import ElectrodeConfig
 
+BZ2_READ_BYTES = 16 * 1024 * 1024
+
+
+def _decompress_bz2(source, destination, block_size=BZ2_READ_BYTES):
+    """
+    Streams the bzip2 archive at source into destination, a block at a time. Handles multi-stream archives
+    (e.g. those written by pbzip2), which a single BZ2Decompressor stops reading after the first stream of.
+    :param source: path to the .bz2 file
+    :param destination: path of the decompressed file to write
+    :param block_size: number of compressed bytes to read at once
+    :raises DecompressionError: if the archive ends part way through a stream
+    """
+    decompressor = bz2.BZ2Decompressor()
+    with open(source, 'rb') as infile, open(destination, 'wb') as outfile:
+        while True:
+            block = infile.read(block_size)
+            if not block:
+                break
+            while block:
+                try:
+                    outfile.write(decompressor.decompress(block))
+                except EOFError:
+                    # Previous stream ended exactly on the last block; start the next one
+                    decompressor = bz2.BZ2Decompressor()
+                    continue
+                block = decompressor.unused_data
+                if block:
+                    decompressor = bz2.BZ2Decompressor()
+    if not _stream_ended(decompressor):
+        raise DecompressionError('{} is truncated'.format(source))
+
+
+def _stream_ended(decompressor):
+    """
+    :return: whether decompressor has reached the end of its stream. Python 2's BZ2Decompressor has no eof
+    attribute, but refuses further input once its stream has ended.
+    """
+    if hasattr(decompressor, 'eof'):
+        return decompressor.eof
+    try:
+        decompressor.decompress(b'')
+    except EOFError:
+        return True
+    return False
+
+
+def _original_raw_file(raw_filename):
+    """
+    :param raw_filename: path (or link) to the raw EEG file
+    :return: absolute path of the file raw_filename links to, or of raw_filename itself if it is not a link
+    """
+    if os.path.islink(raw_filename):
+        return os.path.abspath(os.path.join(os.path.dirname(raw_filename), os.readlink(raw_filename)))
+    else:
+        return os.path.abspath(raw_filename)
+
+
+@contextmanager
+def decompressed_raw_file(raw_filename):
+    """
+    Context manager yielding the path to an uncompressed copy of raw_filename.
+
+    If raw_filename (or the file it links to) is bzip2 compressed, it is decompressed into a temporary
+    directory that is removed on exit. The source archive is never modified. An uncompressed file
+    already sitting next to the archive is used directly and left in place.
+    :param raw_filename: path (or link) to the raw EEG file
+    :raises DecompressionError: if the archive cannot be decompressed
+    """
+    original_path = _original_raw_file(raw_filename)
+
+    if not original_path.endswith('.bz2'):
+        yield original_path
+        return
+
+    unzip_path = original_path[:-4]
+    if os.path.isfile(unzip_path):
+        yield unzip_path
+        return
+
+    temp_dir = tempfile.mkdtemp(prefix='eeg_unzip_')
+    try:
+        # Keep the original basename, as MNE picks the parser from the file extension
+        temp_path = os.path.join(temp_dir, os.path.basename(unzip_path))
+        logger.debug('Decompressing {} to {}'.format(original_path, temp_path))
+        try:
+            _decompress_bz2(original_path, temp_path)
+        except (IOError, OSError, EOFError, ValueError) as e:
+            raise DecompressionError('Could not decompress {}: {}'.format(original_path, e))
+        yield temp_path
+    finally:
+        rmtree(temp_dir, ignore_errors=True)
+
+
+def open_raw_file(raw_filename):
+    """
+    Opens a raw EEG file for binary reading. A bzip2 compressed file is decompressed on the fly as it is read, so
+    reading its header only unpacks the start of the archive.
+    :param raw_filename: path (or link) to the raw EEG file
+    :return: the open file
+    """
+    original_path = _original_raw_file(raw_filename)
+    if original_path.endswith('.bz2'):
+        if os.path.isfile(original_path[:-4]):
+            return open(original_path[:-4], 'rb')
+        return bz2.BZ2File(original_path, 'rb')
+    return open(original_path, 'rb')
+
+
+def read_egi_header(raw_filename):
+    """
+    Reads the header of an EGI simple binary (.raw) file, as described in
+    https://sccn.ucsd.edu/eeglab/testfiles/EGI/NEWTESTING/rawformat.pdf, without reading any of the samples.
+    :param raw_filename: path (or link) to the (possibly bzip2 compressed) .raw file
+    :return: dict with the start time, sample rate and number of samples of the recording
+    """
+    with open_raw_file(raw_filename) as f:
+        header = f.read(36)
+    if len(header) < 36:
+        raise EEGError('Could not read EGI header of {}'.format(raw_filename))
+    (version, year, month, day, hour, minute, second, _, sample_rate, _, _, _, _,
+     n_samples, _) = struct.unpack('>i6hi5hih', header)
+    if version & 1:
+        raise EEGError('Only continuous EGI files are supported')
+
+    # Matches the measurement date given by MNE, which takes the header time as local time and stores the timestamp
+    # as a float32, rounding it to a multiple of 128 seconds
+    local_time = datetime.datetime(year, month, day, hour, minute, second)
+    start_time = datetime.datetime.utcfromtimestamp(float(np.float32(time.mktime(local_time.timetuple()))))
+    return {'start_time': start_time,
+            'sample_rate': sample_rate,
+            'n_samples': n_samples}
+
+
+def read_bdf_header(raw_filename):
+    """
+    Reads the header of an EDF or BDF file without reading any of the data records.
+    :param raw_filename: path (or link) to the (possibly bzip2 compressed) .bdf file
+    :return: dict with the start time, sample rate and number of samples of the recording
+    """
+    with open_raw_file(raw_filename) as f:
+        fixed_header = f.read(256)
+        if len(fixed_header) < 256:
+            raise EEGError('Could not read BDF header of {}'.format(raw_filename))
+        header_bytes = int(fixed_header[184:192])
+        n_channels = int(fixed_header[252:256])
+        # Number of samples in each data record is the last field before the reserved bytes of each channel
+        f.read(216 * n_channels)
+        samples_per_record = [int(f.read(8)) for _ in range(n_channels)]
+        file_size = None if isinstance(f, bz2.BZ2File) else os.fstat(f.fileno()).st_size
+
+    day, month, year = [int(x) for x in re.findall(r'(\d+)', fixed_header[168:176].decode('latin-1'))]
+    hour, minute, second = [int(x) for x in re.findall(r'(\d+)', fixed_header[176:184].decode('latin-1'))]
+    century = 2000 if year < 50 else 1900
+    start_time = datetime.datetime(year + century, month, day, hour, minute, second)
+
+    n_records = int(fixed_header[236:244])
+    record_length = float(fixed_header[244:252]) or 1.
+    if file_size is not None:
+        # As MNE does, trust the size of the file over the number of records given in the header
+        bytes_per_sample = 3 if fixed_header[192:197] == b'24BIT' or fixed_header[:1] == b'\xff' else 2
+        n_records = (file_size - header_bytes) // bytes_per_sample // sum(samples_per_record)
+
+    max_samples = max(samples_per_record)
+    return {'start_time': start_time,
+            'sample_rate': max_samples / record_length,
+            'n_samples': int(n_records * max_samples)}
+
+
+def _sosfiltfilt_blocks(read_block, n_samples, sos, padlen, block_samples):
+    """
+    Zero-phase filters a multichannel signal as scipy.signal.sosfiltfilt does (odd extension of padlen samples at
+    each end, forward then backward pass), while reading only block_samples samples of it at a time.
+
+    The forward state at the start of every block is kept, so that during the backward pass, which runs from the
+    end of the signal to the start, each block's forward output can be recomputed from the source rather than held
+    in memory or written to disk.
+    :param read_block: function (start, stop) -> channels x samples array of the signal
+    :param n_samples: total number of samples in the signal
+    :param sos: second-order sections of the filter
+    :param padlen: number of samples to extend the signal by at each end
+    :param block_samples: number of samples read and filtered at once
+    :return: generator of (start, filtered block), from the last block to the first
+    """
+    padlen = min(padlen, n_samples - 1)
+    zi = sosfilt_zi(sos)[:, None, :]
+    starts = range(0, n_samples, block_samples)
+
+    head = read_block(0, padlen + 1)
+    head_ext = 2 * head[:, :1] - head[:, padlen:0:-1]
+    _, state = sosfilt(sos, head_ext, zi=zi * head_ext[None, :, :1])
+    block_states = []
+    for start in starts:
+        block_states.append(state)
+        _, state = sosfilt(sos, read_block(start, min(start + block_samples, n_samples)), zi=state)
+    tail = read_block(n_samples - padlen - 1, n_samples)
+    tail_ext = 2 * tail[:, -1:] - tail[:, -2::-1]
+    tail_filtered, _ = sosfilt(sos, tail_ext, zi=state)
+
+    _, state = sosfilt(sos, tail_filtered[:, ::-1], zi=zi * tail_filtered[None, :, -1:])
+    for start, block_state in reversed(list(zip(starts, block_states))):
+        forward, _ = sosfilt(sos, read_block(start, min(start + block_samples, n_samples)), zi=block_state)
+        backward, state = sosfilt(sos, forward[:, ::-1], zi=state)
+        yield start, backward[:, ::-1]
+
+
+def split_highpassed_raw(raw, channel_files, bounds, data_format, block_samples, l_freq=.1):
+    """
+    Writes channels of an MNE Raw, which need not be preloaded, each to its own file in data_format. EEG and EOG
+    channels are run through the zero-phase IIR highpass filter MNE's Raw.filter uses and converted to uV; other
+    channels are written as they are. Only block_samples samples of each channel are held in memory at once.
+    :param raw: MNE Raw object
+    :param channel_files: dict mapping the index of each channel in raw to the file it is written to
+    :param bounds: finfo or iinfo giving the range the data is clipped to before it is cast to data_format
+    :param data_format: dtype of the written files
+    :param block_samples: number of samples of each channel read and written at once
+    :param l_freq: highpass cutoff in Hz
+    """
+    n_samples = raw.n_times
+    picks_eeg_eog = [i for i in mne.pick_types(raw.info, eeg=True, eog=True) if i in channel_files]
+    other_picks = [i for i in sorted(channel_files) if i not in picks_eeg_eog]
+    outputs = {i: np.memmap(filename, dtype=data_format, mode='w+', shape=(n_samples,))
+               for i, filename in channel_files.items()}
+
+    def write_block(picks, start, block):
+        block = block.clip(bounds.min, bounds.max).astype(data_format)
+        for row, i in enumerate(picks):
+            outputs[i][start:start + block.shape[1]] = block[row]
+
+    if picks_eeg_eog:
+        iir_params = mne.filter.create_filter(np.broadcast_to(0., (n_samples,)), raw.info['sfreq'], l_freq, None,
+                                              method='iir', phase='zero-double', l_trans_bandwidth='auto',
+                                              h_trans_bandwidth='auto', verbose=False)
+        sos = iir_params['sos'] if 'sos' in iir_params else tf2sos(iir_params['b'], iir_params['a'])
+        logger.debug('Running {} Hz highpass filter on {} channels.'.format(l_freq, len(picks_eeg_eog)))
+        filtered_blocks = _sosfiltfilt_blocks(lambda start, stop: raw[picks_eeg_eog, start:stop][0],
+                                              n_samples, sos, iir_params['padlen'], block_samples)
+        for start, block in filtered_blocks:
+            write_block(picks_eeg_eog, start, block * 1000000)
+
+    if other_picks:
+        for start in range(0, n_samples, block_samples):
+            write_block(other_picks, start, raw[other_picks, start:start + block_samples][0])
+
+    for output in outputs.values():
+        output.flush()
+
+
+def _mean_of_channel_files(filenames, data_format, block_samples):
+    """
+    Takes the mean across split channel files of the same length, as np.mean(..., axis=0) would over their stacked
+    contents, reading only block_samples samples of each file at a time.
+    """
+    channels = [np.memmap(filename, dtype=data_format, mode='r') for filename in filenames]
+    n_samples = len(channels[0])
+    return np.concatenate([np.mean([channel[start:start + block_samples] for channel in channels], axis=0)
+                           for start in range(0, n_samples, block_samples)])
+
+
+class SplitManifest(object):
+    """
+    Records every split channel file in split_manifest.json, alongside sources.json, as soon as it has been
+    completely written. The entry for a split is marked incomplete before any data is written and complete once the
+    split finishes. When a split into the same location is rerun after an attempt died part way through, channel files
+    that still match their record are left alone, and only the missing or incomplete ones are written again.
+
+    Records are only reused from an interrupted split of the same source, with the same channel mapping (jacksheet and
+    channel map) and the same SPLIT_FORMAT_VERSION. A split that finished is never resumed, so a deliberate re-split
+    always writes every file again.
+    """
+
+    FILENAME = 'split_manifest.json'
+
+    # Increment whenever a change to the readers changes the contents of the files they split
+    SPLIT_FORMAT_VERSION = 1
+
+    def __init__(self, location, basename, source_file, channel_mapping=None):
+        self.filename = os.path.join(location, self.FILENAME)
+        self.basename = basename
+        self.key = {'source': os.path.basename(source_file),
+                    'size': os.path.getsize(source_file),
+                    'channel_mapping': self.digest(channel_mapping),
+                    'split_format_version': self.SPLIT_FORMAT_VERSION}
+        self.lock = threading.Lock()
+        entry = self._load().get(basename, {})
+        if entry.get('key') == self.key and entry.get('complete') is False:
+            self.entry = entry
+        else:
+            self.entry = {'channels': {}, 'n_samples': {}, 'expected': {}}
+        self.entry.update({'key': self.key, 'complete': False})
+
+    @property
+    def channels(self):
+        return self.entry['channels']
+
+    def _load(self):
+        try:
+            with open(self.filename) as manifest_file:
+                return json.load(manifest_file)
+        except (IOError, ValueError):
+            return {}
+
+    def _save(self):
+        with self.lock:
+            manifests = self._load()
+            manifests[self.basename] = self.entry
+            # Written to a temporary file first, so the manifest is never left half written
+            with fileutil.open_with_perms(self.filename + '.tmp', 'w') as manifest_file:
+                json.dump(manifests, manifest_file, indent=2, sort_keys=True)
+            os.rename(self.filename + '.tmp', self.filename)
+
+    @staticmethod
+    def digest(contents):
+        """
+        :param contents: anything that can be written to JSON
+        :return: md5 digest of its JSON representation
+        """
+        return hashlib.md5(json.dumps(contents, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _file_record(filename):
+        stat = os.stat(filename)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def start(self):
+        """
+        Marks the split as incomplete, before any of its files are written
+        """
+        self._save()
+
+    def finish(self):
+        """
+        Marks the split as complete, so that it is never resumed
+        """
+        self.entry['complete'] = True
+        self._save()
+
+    def is_complete(self, filename):
+        record = self.channels.get(os.path.basename(filename))
+        return record is not None and os.path.isfile(filename) and self._file_record(filename) == record
+
+    def pending(self, filenames):
+        """
+        :param filenames: channel files the split would write
+        :return: those of filenames that still have to be written. Any existing copies of them are removed first, so
+        that a file is never rewritten in place.
+        """
+        pending = []
+        for filename in filenames:
+            if self.is_complete(filename):
+                logger.debug('{} already split'.format(filename))
+                continue
+            with self.lock:
+                self.channels.pop(os.path.basename(filename), None)
+            if os.path.lexists(filename):
+                os.remove(filename)
+            pending.append(filename)
+        return pending
+
+    def record(self, filenames):
+        """
+        Marks filenames, which must have been closed, as completely written
+        """
+        records = {os.path.basename(filename): self._file_record(filename) for filename in filenames}
+        with self.lock:
+            self.channels.update(records)
+        self._save()
+
+    def expect(self, source_file, filenames):
+        """
+        Notes every channel file that the split of source_file writes, so that a rerun can tell that they have all
+        been written without reading the source
+        """
+        self.entry['expected'][os.path.basename(source_file)] = [os.path.basename(f) for f in filenames]
+        self._save()
+
+    def expected(self, source_file, location):
+        """
+        :return: paths in location of the channel files noted by expect, or None if they are not known
+        """
+        expected = self.entry['expected'].get(os.path.basename(source_file))
+        return None if expected is None else [os.path.join(location, f) for f in expected]
+
+    def record_n_samples(self, source_file, n_samples):
+        self.entry['n_samples'][os.path.basename(source_file)] = int(n_samples)
+        self._save()
+
+    def n_samples(self, source_file):
+        """
+        :return: the number of samples recorded by record_n_samples for source_file, or None
+        """
+        return self.entry['n_samples'].get(os.path.basename(source_file))
+
+
 class EEG_reader(object):
 
     DATA_FORMAT = 'int16'
@@ -36,6 +438,11 @@ class EEG_reader(object):
 
     EPOCH = datetime.datetime.utcfromtimestamp(0)
 
+    # SplitManifest of the split in progress, if any
+    split_manifest = None
+    # ThreadPool over which the split in progress spreads its channel writes, if any (see _map_channels)
+    channel_pool = None
+
     def get_start_time(self):
         raise NotImplementedError
 
@@ -54,6 +461,16 @@ class EEG_reader(object):
     def get_n_samples(self):
         raise NotImplementedError
 
+    def read_header_info(self):
+        """
+        Probes the start time, sample rate and number of samples of the recording. Only the file headers are read,
+        so this is cheap enough to use when only the metadata (e.g. for alignment or sources.json) is needed.
+        :return: dict with keys start_time, sample_rate and n_samples
+        """
+        return {'start_time': self.get_start_time(),
+                'sample_rate': self.get_sample_rate(),
+                'n_samples': self.get_n_samples()}
+
     def write_sources(self, location, basename):
         try:
             with open(os.path.join(location, 'sources.json')) as source_file:
@@ -79,13 +496,87 @@ class EEG_reader(object):
         if not os.path.exists(noreref_location):
             fileutil.makedirs(noreref_location)
         logger.info("Splitting data into {}/{}".format(noreref_location, basename))
-        self._split_data(noreref_location, basename)
+        split_manifest = SplitManifest(location, basename, self.get_source_file(), self.get_channel_mapping())
+        split_manifest.start()
+        self.split_manifest = split_manifest
+        n_workers = int(config.eeg_split.n_workers or 1)
+        self.channel_pool = ThreadPool(n_workers) if n_workers > 1 else None
+        try:
+            self._split_data(noreref_location, basename)
+        finally:
+            self.split_manifest = None
+            if self.channel_pool is not None:
+                self.channel_pool.close()
+                self.channel_pool.join()
+                self.channel_pool = None
+        split_manifest.finish()
         self.write_sources(location, basename)
         logger.info("Splitting complete")
 
     def _split_data(self, location, basename):
         return NotImplementedError
 
+    def get_channel_mapping(self):
+        """
+        :return: the parts of the reader's configuration that decide which channel goes to which split file, as
+        something that can be written to JSON
+        """
+        return {'jacksheet': getattr(self, 'jacksheet', None), 'channel_map': getattr(self, 'channel_map', None)}
+
+    def _pending_files(self, filenames):
+        """
+        :return: those of filenames which the split in progress still has to write
+        """
+        if self.split_manifest is None:
+            return list(filenames)
+        return self.split_manifest.pending(filenames)
+
+    def _record_files(self, filenames):
+        """
+        Marks filenames as completely written by the split in progress
+        """
+        if self.split_manifest is not None:
+            self.split_manifest.record(filenames)
+
+    def _close_and_record(self, open_files):
+        """
+        Closes each of open_files, all of which have been completely written, and marks it as such as soon as it is
+        closed
+        """
+        for open_file in open_files:
+            open_file.close()
+            self._record_files([open_file.name])
+
+    def _expect_files(self, filenames):
+        """
+        Notes that the split in progress writes filenames from this reader's source
+        """
+        if self.split_manifest is not None:
+            self.split_manifest.expect(self.get_source_file(), filenames)
+
+    def _already_split(self, location):
+        """
+        :return: the channel files that an earlier attempt at the split in progress noted with _expect_files, if every
+        one of them has been written, otherwise None
+        """
+        if self.split_manifest is None:
+            return None
+        expected = self.split_manifest.expected(self.get_source_file(), location)
+        if expected is None or self._pending_files(expected):
+            return None
+        return expected
+
+    def _map_channels(self, write_channel, channels):
+        """
+        Calls write_channel on each of channels and returns the results in order. Each call must write to its own
+        file. If the eeg_split n_workers option is greater than 1, split_data starts that many threads once for the
+        whole split, and the calls are spread over them.
+        """
+        channels = list(channels)
+        if self.channel_pool is None or len(channels) <= 1:
+            return [write_channel(channel) for channel in channels]
+        return self.channel_pool.map(write_channel, channels)
+
 
     def get_matching_jacksheet_dict_label(self, label, jacksheet_dict, channel_map):
         if label in channel_map:
@@ -108,6 +599,9 @@ class EEG_reader(object):
 
 class HD5_reader(EEG_reader):
 
+    # Number of samples of every port converted and written at once
+    SPLIT_BLOCK_SAMPLES = 1000 * 60
+
     def __init__(self, hd5_filename, experiment_config_filename, channel_map_filename=None):
         self.raw_filename = hd5_filename
         self.exp_config_filename = experiment_config_filename
@@ -165,28 +659,62 @@ class HD5_reader(EEG_reader):
             super(HD5_reader, self).write_sources(location,basename+'.h5')
 
     def _split_data(self, location, basename):
+        """
+        Writes each port to its own file, SPLIT_BLOCK_SAMPLES samples at a time. Blocks are read along the time axis
+        (rounded to the HDF5 chunk length) and, if the file holds bipolar data, converted to monopolar with a sparse
+        copy of bipolar_to_monopolar_matrix before being appended to the port files.
+        """
         if self.should_split:
-            time_series = self.h5file.get_node('/','timeseries').read()
-            if self.by_row:
-                time_series = time_series.T
+            time_series = self.h5file.get_node('/','timeseries')
             if 'bipolar_to_monopolar_matrix' in self.h5file.root:
-                transform = self.h5file.root.bipolar_to_monopolar_matrix.read()
-                time_series = np.dot(transform,time_series).astype(self.DATA_FORMAT)
-            ports = self.h5file.root.ports
-            for i, port in enumerate(ports):
-                filename = os.path.join(location, basename + ('.%03d' % port))
-                data = time_series[i]
-                logger.debug("Writing channel {} ({})".format(self.h5file.root.names[i], port))
-                logger.debug('len(data):%s'%len(data))
-                data.tofile(filename)
+                transform = sparse.csr_matrix(self.h5file.root.bipolar_to_monopolar_matrix.read())
+            else:
+                transform = None
+            ports = self.h5file.root.ports.read()
+            names = self.h5file.root.names.read()
+
+            time_axis = 0 if self.by_row else 1
+            chunk_samples = time_series.chunkshape[time_axis] if time_series.chunkshape else 1
+            block_samples = max(chunk_samples, self.SPLIT_BLOCK_SAMPLES // chunk_samples * chunk_samples)
+            n_samples = self.get_n_samples()
+
+            filenames = [os.path.join(location, basename + ('.%03d' % port)) for port in ports]
+            pending = self._pending_files(filenames)
+            to_write = [i for i, filename in enumerate(filenames) if filename in pending]
+            if not to_write:
+                return
+
+            out_files = {}
+            try:
+                for i in to_write:
+                    logger.debug("Writing channel {} ({})".format(names[i], ports[i]))
+                    out_files[i] = open(filenames[i], 'wb')
+                for start in range(0, n_samples, block_samples):
+                    if self.by_row:
+                        block = time_series[start:start + block_samples].T
+                    else:
+                        block = time_series[:, start:start + block_samples]
+                    if transform is not None:
+                        block = transform.dot(block).astype(self.DATA_FORMAT)
+                    self._map_channels(lambda i: block[i].tofile(out_files[i]), to_write)
+                logger.debug('len(data):%s' % n_samples)
+                self._close_and_record(out_files[i] for i in to_write)
+            finally:
+                for out_file in out_files.values():
+                    out_file.close()
         else:
             filename= os.path.join(location,basename+'.h5')
-            logger.debug('Moving HD5 file')
-            copy(self.raw_filename,filename)
+            if self._pending_files([filename]):
+                logger.debug('Moving HD5 file')
+                copy(self.raw_filename,filename)
+                self._record_files([filename])
 
 
 class NK_reader(EEG_reader):
 
+    # Size of the block of the waveform data held in memory at once while splitting
+    SPLIT_CHUNK_BYTES = 64 * 1024 * 1024
+
     def __init__(self, nk_filename, jacksheet_filename=None, channel_map_filename=None):
         self.raw_filename = nk_filename
         if jacksheet_filename:
@@ -208,57 +736,41 @@ class NK_reader(EEG_reader):
         return self.raw_filename
 
     def get_n_samples(self):
+        if self.num_samples is None:
+            self.read_header_info()
         return self.num_samples
 
     def get_sample_rate(self):
+        if self.sample_rate is None:
+            self.read_header_info()
         return self.sample_rate
 
     def set_jacksheet(self, jacksheet_filename):
         self.jacksheet = {v:k for k,v in read_jacksheet(jacksheet_filename).items()}
 
     def get_start_time(self):
-        with open(self.raw_filename, 'rb') as f:
-            # Skipping device block
-            deviceBlockLen = 128
-            f.seek(deviceBlockLen)
-
-            # Reading EEG1 control block
-            _ = f.read(1)  # block ID
-            device_type = self.char_(f, 16)  # Device type
-            new_format = device_type[:9] == 'EEG-1200A'
-            number_of_blocks = self.uint8(f)
-            if number_of_blocks > 1:
-                raise EEGError('%s EEG2 Control blocks detected' % number_of_blocks)
-            block_address = self.int32(f)
-            _ = f.read(16)  # EEG control block name
-
-            # Reading EEG2 Control block
-            f.seek(block_address, 0)
-            _ = f.read(1)  # Block ID
-            _ = f.read(16)  # Data format
-            number_of_blocks = self.uint8(f)
-            if number_of_blocks > 1:
-                raise EEGError('%d waveform blocks detected' % number_of_blocks)
-            block_address = self.int32(f)
-            _ = self.char_(f)  # Name of waveform block
-
-            # Reading waveform block
-            f.seek(block_address, 0)
-            _ = self.uint8(f)  # Block ID
-            _ = self.char_(f,16)  # Data format
-            _ = self.uint8(f)  # Data type
-            L = self.uint8(f)  # Byte length of one data
-            M = self.uint8(f)  # Mark/event flag
-
-            T_year = self.bcd_converter(self.uint8(f)) + 2000
-            T_month = self.bcd_converter(self.uint8(f))
-            T_day = self.bcd_converter(self.uint8(f))
-            T_hour = self.bcd_converter(self.uint8(f))
-            T_minute = self.bcd_converter(self.uint8(f))
-            T_second = self.bcd_converter(self.uint8(f))
+        if self.start_datetime is None:
+            self.read_header_info()
+        return self.start_datetime
 
-            dt = datetime.datetime(T_year, T_month, T_day, T_hour, T_minute, T_second)
-            return dt
+    def read_header_info(self):
+        """
+        Reads the start time, sample rate and number of samples from the control and waveform blocks of the .EEG file,
+        without reading any of the waveform data or requiring a jacksheet.
+        """
+        with open(self.raw_filename, 'rb') as f:
+            header = self._read_waveform_header(f)
+            # As in get_data, trust the size of the file over the length given in the header
+            bytes_per_sample = 2 * (header['num_channels'] + 1)
+            data_start = f.tell() + 10 * header['num_channels']
+            available_samples = (os.path.getsize(self.raw_filename) - data_start) // bytes_per_sample
+        self.start_datetime = header['start_time']
+        self.sample_rate = header['sample_rate']
+        if self.num_samples is None:
+            self.num_samples = min(header['num_samples'], available_samples)
+        return {'start_time': self.start_datetime,
+                'sample_rate': self.sample_rate,
+                'n_samples': self.num_samples}
 
     @staticmethod
     def bcd_converter(bits_in):
@@ -339,201 +851,243 @@ class NK_reader(EEG_reader):
 
         return {i+1:c[0] for i,c in enumerate(channels)}
 
-    def get_data(self, jacksheet_dict, channel_map):
-        eeg_file = self.raw_filename
-        elec_file = os.path.splitext(eeg_file)[0] + '.21E'
-
-        with open(eeg_file, 'rb') as f:
-            # Skipping device block
-            deviceBlockLen = 128
-            f.seek(deviceBlockLen)
-
-            # Reading EEG1 control block
-            _ = f.read(1)  # block ID
-            device_type = self.char_(f, 16)  # Device type
-            new_format = device_type[:9] == 'EEG-1200A'
-            number_of_blocks = self.uint8(f)
-            if number_of_blocks > 1:
-                raise EEGError('%s EEG2 Control blocks detected' % number_of_blocks)
-            block_address = self.int32(f)
-            _ = f.read(16)  # EEG control block name
-
-            # Reading EEG2 Control block
-            f.seek(block_address, 0)
-            _ = f.read(1)  # Block ID
-            _ = f.read(16)  # Data format
-            number_of_blocks = self.uint8(f)
-            if number_of_blocks > 1:
-                raise EEGError('%d waveform blocks detected' % number_of_blocks)
-            block_address = self.int32(f)
-            _ = f.read(16)  # Name of waveform block
-
-            # Reading waveform block
-            f.seek(block_address, 0)
-            _ = f.read(1)  # Block ID
-            _ = f.read(16)  # Data format
-            _ = f.read(1)  # Data type
+    def _read_waveform_header(self, f):
+        """
+        Reads the device, control and waveform blocks of an open .EEG file, up to the number of recorded channels.
+        None of the waveform data is read.
+
+        :param f: The .EEG file, opened for binary reading
+        :return: dict containing the start time, sample rate, number of samples specified in the header, AD offset,
+        AD value for one division and number of recorded channels. f is left positioned at the channel descriptions.
+        """
+        # Skipping device block
+        deviceBlockLen = 128
+        f.seek(deviceBlockLen)
+
+        # Reading EEG1 control block
+        _ = f.read(1)  # block ID
+        device_type = self.char_(f, 16)  # Device type
+        new_format = device_type[:9] == 'EEG-1200A'
+        number_of_blocks = self.uint8(f)
+        if number_of_blocks > 1:
+            raise EEGError('%s EEG2 Control blocks detected' % number_of_blocks)
+        block_address = self.int32(f)
+        _ = f.read(16)  # EEG control block name
+
+        # Reading EEG2 Control block
+        f.seek(block_address, 0)
+        _ = f.read(1)  # Block ID
+        _ = f.read(16)  # Data format
+        number_of_blocks = self.uint8(f)
+        if number_of_blocks > 1:
+            raise EEGError('%d waveform blocks detected' % number_of_blocks)
+        block_address = self.int32(f)
+        _ = f.read(16)  # Name of waveform block
+
+        # Reading waveform block
+        f.seek(block_address, 0)
+        _ = f.read(1)  # Block ID
+        _ = f.read(16)  # Data format
+        _ = f.read(1)  # Data type
+        L = self.uint8(f)  # Byte length of one data
+        M = self.uint8(f)  # Mark/event flag
+
+        T_year = self.bcd_converter(self.uint8(f)) + 2000
+        T_month = self.bcd_converter(self.uint8(f))
+        T_day = self.bcd_converter(self.uint8(f))
+        T_hour = self.bcd_converter(self.uint8(f))
+        T_minute = self.bcd_converter(self.uint8(f))
+        T_second = self.bcd_converter(self.uint8(f))
+        start_time = datetime.datetime(T_year, T_month, T_day, T_hour, T_minute, T_second)
+        logger.debug('Start of session: {}'.format(start_time))
+
+        sample_rate = self.uint16(f)
+        sample_rate_conversion = {
+            int('C064', 16): 100,
+            int('C068', 16): 200,
+            int('C068', 16): 500,
+            int('C3E8', 16): 1000,
+            int('C7D0', 16): 2000,
+            int('D388', 16): 5000,
+            int('E710', 16): 10000
+        }
+
+        if sample_rate in sample_rate_conversion:
+            actual_sample_rate = sample_rate_conversion[sample_rate]
+        else:
+            raise EEGError('Unknown sample rate')
+
+        num_100_ms_blocks = self.uint32(f)
+        logger.debug('Length of session: %2.2f hours\n' % (num_100_ms_blocks / 10. / 3600.))
+        num_samples = actual_sample_rate * num_100_ms_blocks / 10.
+        ad_off = self.int16(f)
+        ad_val = self.uint16(f)
+        bit_len = self.uint8(f)
+        com_flag = self.uint8(f)
+        num_channels = self.uint8(f)
+
+        if (num_channels == 1 and num_samples - actual_sample_rate == 0) and not new_format:
+            raise EEGError('Expecting old format, but 1 channel for 1 second')
+        elif num_channels > 1 and new_format:
+            raise EEGError('Expecting new format, but > 1 channel')
+
+        if new_format:
+            logger.debug('NEW FORMAT...')
+
+            waveform_block_old_format = 39 + 10 + 2 * actual_sample_rate + float(M) * actual_sample_rate
+            control_block_eeg1_new = 1072
+            block_address_eeg2 = block_address + waveform_block_old_format + control_block_eeg1_new
+
+            # EEG2 Format
+            add_try = block_address_eeg2
+            f.seek(add_try, 0)
+            _ = self.uint8(f)  # block ID
+            _ = self.char_(f, 16)  # data format
+            _ = self.uint16(f)  # # of waveform blocks
+            _ = self.char_(f)  # Reserved
+            wave_block_new = self.int64(f)  # Address of block 1
+
+            # EEG2 waveform format
+            f.seek(wave_block_new, 0)
+            _ = self.uint8(f)  # block ID
+            _ = self.char_(f, 16)  # Device format
+            _ = self.uint8(f)  # Data type
             L = self.uint8(f)  # Byte length of one data
             M = self.uint8(f)  # Mark/event flag
 
-            T_year = self.uint8(f)
-            T_month = self.uint8(f)
-            T_day = self.uint8(f)
-            T_hour = self.uint8(f)
-            T_minute = self.uint8(f)
-            T_second = self.uint8(f)
-
-            logger.debug('Date of session: %d/%d/%d\n' % (T_month, T_day, T_year))
-            logger.debug('Time of start: %02d:%02d:%02d\n' % (T_hour, T_minute, T_second))
-
-            sample_rate = self.uint16(f)
-            sample_rate_conversion = {
-                int('C064', 16): 100,
-                int('C068', 16): 200,
-                int('C068', 16): 500,
-                int('C3E8', 16): 1000,
-                int('C7D0', 16): 2000,
-                int('D388', 16): 5000,
-                int('E710', 16): 10000
-            }
+            #  Now things get a little different with the new header
+            _ = self.char_(f, 20)  # Start time string
+            actual_sample_rate = self.uint32(f)  # Data interval (sample rate)
+            num_100_ms_blocks = self.uint64(f)  # Length of session
+
+            num_samples = actual_sample_rate * num_100_ms_blocks / 10
+            ad_off = self.int16(f)  # AD offset at 0V
+            ad_val = self.uint16(f)  # ACD val for 1 division
+            bit_len = self.uint16(f)  # Bit length of one sample
+            com_flag = self.uint16(f)  # Data compression
+            reserve_l = self.uint16(f)  # Reserve length
+            _ = self.char_(f, reserve_l)  # Reserve data
+
+            num_channels = self.uint32(f)  # Number of RAW recordings
+
+        return {'start_time': start_time,
+                'sample_rate': actual_sample_rate,
+                'num_samples': num_samples,
+                'ad_off': ad_off,
+                'ad_val': ad_val,
+                'num_channels': num_channels}
+
+    def _read_header(self, f, jacksheet_dict, channel_map):
+        """
+        Reads the device, control and waveform blocks of an open .EEG file, leaving f positioned at the start of the
+        waveform data. Sets sample_rate, num_samples and gain on the reader.
+
+        :param f: The .EEG file, opened for binary reading
+        :param jacksheet_dict: Mapping from channel label to jacksheet number
+        :param channel_map: Mapping from recorded channel label to jacksheet label
+        :return: dict containing the number of recorded channels, the number of samples specified in the header, the
+        AD offset, the index of each recorded channel into the filtered jacksheet (-1 if unused), and the filtered
+        jacksheet numbers
+        """
+        elec_file = os.path.splitext(self.raw_filename)[0] + '.21E'
 
-            if sample_rate in sample_rate_conversion:
-                actual_sample_rate = sample_rate_conversion[sample_rate]
-                self.sample_rate = actual_sample_rate
+        waveform_header = self._read_waveform_header(f)
+        self.sample_rate = waveform_header['sample_rate']
+        self.num_samples = num_samples = waveform_header['num_samples']
+        ad_off = waveform_header['ad_off']
+        ad_val = waveform_header['ad_val']
+        num_channels = waveform_header['num_channels']
+
+        lines = [line.strip() for line in open(elec_file).readlines()]
+        end_range = lines.index('[SD_DEF]')
+        split_lines = [line.split('=') for line in lines[:end_range] if '=' in line]
+        nums_21e, names_21e = zip(*split_lines[:end_range])
+        nums_21e = [int(n) for n in nums_21e]
+
+        channel_order = range(10) + [22, 23] + range(10, 19) + [20, 21] + range(24, 37) + [74, 75] + \
+                        range(100, 254) + [50, 51]
+
+        jacksheet_nums = np.arange(len(channel_order)) + 1
+        names_21e_ordered = np.chararray(len(channel_order), 16)
+        nums_21e_ordered = np.array([-1 for _ in channel_order])
+        for i, chan_num in enumerate(channel_order):
+            if not chan_num in nums_21e:
+                names_21e_ordered[i] = ''
+                continue
+            names_21e_ordered[i] = names_21e[nums_21e.index(chan_num)]
+            nums_21e_ordered[i] = chan_num
+
+        jacksheet_nums = jacksheet_nums[names_21e_ordered != '']
+        nums_21e_ordered = nums_21e_ordered[names_21e_ordered != '']
+        names_21e_ordered = names_21e_ordered[names_21e_ordered != '']
+
+        data_num_to_21e_index = np.zeros(num_channels) - 1
+
+        channel_mask = np.array(
+            [not self.get_matching_jacksheet_dict_label(name, jacksheet_dict, self.channel_map) is None
+             for name in names_21e_ordered])
+        nums_21e_filtered = nums_21e_ordered[channel_mask]
+        names_21e_filtered = names_21e_ordered[channel_mask]
+        jacksheet_filtered = [
+            jacksheet_dict[self.get_matching_jacksheet_dict_label(name, jacksheet_dict, self.channel_map)]
+            for name in names_21e_filtered]
+
+        for e_name, e_num in jacksheet_dict.items():
+            if e_num not in jacksheet_filtered:
+                logger.critical("skipping electruode {}: {}".format(e_num, e_name))
+
+        gain = [-1 for _ in range(num_channels)]
+        for i in range(num_channels):
+            chan = self.int16(f)
+            matching_row = (nums_21e_filtered == chan)
+            if matching_row.any():
+                data_num_to_21e_index[i] = np.where(matching_row)[0]
             else:
-                raise EEGError('Unknown sample rate')
+                data_num_to_21e_index[i] = -1
+
+            f.seek(6, 1)
+            chan_sensitivity = self.uint8(f)
+            raw_cal = self.uint8(f)
+            cal_conversion = {
+                0: 1000.,
+                1: 2.,
+                2: 5.,
+                3: 10.,
+                4: 20.,
+                5: 50.,
+                6: 100.,
+                7: 200.,
+                8: 500.,
+                9: 1000.
+            }
+            gain[i] = cal_conversion[raw_cal] / float(ad_val)
+
+        if not len(np.unique(gain)) == 1:
+            raise EEGError('All channels do not have the same gain')
+        self.gain = gain[0]
+
+        if not (np.count_nonzero(data_num_to_21e_index != -1) == len(nums_21e_filtered)):
+            bad_indices = [not i in data_num_to_21e_index for i in range(len(names_21e_filtered))]
+            bad_names = names_21e_filtered[np.array(bad_indices)]
+            good_names = names_21e_filtered[np.logical_not(np.array(bad_indices))]
+            unique_bad_names = bad_names[np.array([bad_name not in good_names for bad_name in bad_names])]
+            if len(unique_bad_names) > 0:
+                raise EEGError('Could not find recording for channels:\n%s' % unique_bad_names)
+
+        return {'num_channels': num_channels,
+                'num_samples': num_samples,
+                'ad_off': ad_off,
+                'data_num_to_21e_index': data_num_to_21e_index,
+                'jacksheet_filtered': jacksheet_filtered}
 
-            num_100_ms_blocks = self.uint32(f)
-            logger.debug('Length of session: %2.2f hours\n' % (num_100_ms_blocks / 10. / 3600.))
-            num_samples = actual_sample_rate * num_100_ms_blocks / 10.
-            self.num_samples = num_samples
-            ad_off = self.int16(f)
-            ad_val = self.uint16(f)
-            bit_len = self.uint8(f)
-            com_flag = self.uint8(f)
-            num_channels = self.uint8(f)
-
-            if (num_channels == 1 and num_samples - actual_sample_rate == 0) and not new_format:
-                raise EEGError('Expecting old format, but 1 channel for 1 second')
-            elif num_channels > 1 and new_format:
-                raise EEGError('Expecting new format, but > 1 channel')
-
-            if new_format:
-                logger.debug('NEW FORMAT...')
-
-                waveform_block_old_format = 39 + 10 + 2 * actual_sample_rate + float(M) * actual_sample_rate
-                control_block_eeg1_new = 1072
-                block_address_eeg2 = block_address + waveform_block_old_format + control_block_eeg1_new
-
-                # EEG2 Format
-                add_try = block_address_eeg2
-                f.seek(add_try, 0)
-                _ = self.uint8(f)  # block ID
-                _ = self.char_(f, 16)  # data format
-                _ = self.uint16(f)  # # of waveform blocks
-                _ = self.char_(f)  # Reserved
-                wave_block_new = self.int64(f)  # Address of block 1
-
-                # EEG2 waveform format
-                f.seek(wave_block_new, 0)
-                _ = self.uint8(f)  # block ID
-                _ = self.char_(f, 16)  # Device format
-                _ = self.uint8(f)  # Data type
-                L = self.uint8(f)  # Byte length of one data
-                M = self.uint8(f)  # Mark/event flag
-
-                #  Now things get a little different with the new header
-                _ = self.char_(f, 20)  # Start time string
-                actual_sample_rate = self.uint32(f)  # Data interval (sample rate)
-                self.sample_rate = actual_sample_rate
-                num_100_ms_blocks = self.uint64(f)  # Length of session
-
-                num_samples = actual_sample_rate * num_100_ms_blocks / 10
-                self.num_samples = num_samples
-                ad_off = self.int16(f)  # AD offset at 0V
-                ad_val = self.uint16(f)  # ACD val for 1 division
-                bit_len = self.uint16(f)  # Bit length of one sample
-                com_flag = self.uint16(f)  # Data compression
-                reserve_l = self.uint16(f)  # Reserve length
-                _ = self.char_(f, reserve_l)  # Reserve data
-
-                num_channels = self.uint32(f)  # Number of RAW recordings
-
-            lines = [line.strip() for line in open(elec_file).readlines()]
-            end_range = lines.index('[SD_DEF]')
-            split_lines = [line.split('=') for line in lines[:end_range] if '=' in line]
-            nums_21e, names_21e = zip(*split_lines[:end_range])
-            nums_21e = [int(n) for n in nums_21e]
-
-            channel_order = range(10) + [22, 23] + range(10, 19) + [20, 21] + range(24, 37) + [74, 75] + \
-                            range(100, 254) + [50, 51]
-
-            jacksheet_nums = np.arange(len(channel_order)) + 1
-            names_21e_ordered = np.chararray(len(channel_order), 16)
-            nums_21e_ordered = np.array([-1 for _ in channel_order])
-            for i, chan_num in enumerate(channel_order):
-                if not chan_num in nums_21e:
-                    names_21e_ordered[i] = ''
-                    continue
-                names_21e_ordered[i] = names_21e[nums_21e.index(chan_num)]
-                nums_21e_ordered[i] = chan_num
-
-            jacksheet_nums = jacksheet_nums[names_21e_ordered != '']
-            nums_21e_ordered = nums_21e_ordered[names_21e_ordered != '']
-            names_21e_ordered = names_21e_ordered[names_21e_ordered != '']
-
-            data_num_to_21e_index = np.zeros(num_channels) - 1
-
-            channel_mask = np.array(
-                [not self.get_matching_jacksheet_dict_label(name, jacksheet_dict, self.channel_map) is None
-                 for name in names_21e_ordered])
-            nums_21e_filtered = nums_21e_ordered[channel_mask]
-            names_21e_filtered = names_21e_ordered[channel_mask]
-            jacksheet_filtered = [
-                jacksheet_dict[self.get_matching_jacksheet_dict_label(name, jacksheet_dict, self.channel_map)]
-                for name in names_21e_filtered]
-
-            for e_name, e_num in jacksheet_dict.items():
-                if e_num not in jacksheet_filtered:
-                    logger.critical("skipping electruode {}: {}".format(e_num, e_name))
-
-            gain = [-1 for _ in range(num_channels)]
-            for i in range(num_channels):
-                chan = self.int16(f)
-                matching_row = (nums_21e_filtered == chan)
-                if matching_row.any():
-                    data_num_to_21e_index[i] = np.where(matching_row)[0]
-                else:
-                    data_num_to_21e_index[i] = -1
-
-                f.seek(6, 1)
-                chan_sensitivity = self.uint8(f)
-                raw_cal = self.uint8(f)
-                cal_conversion = {
-                    0: 1000.,
-                    1: 2.,
-                    2: 5.,
-                    3: 10.,
-                    4: 20.,
-                    5: 50.,
-                    6: 100.,
-                    7: 200.,
-                    8: 500.,
-                    9: 1000.
-                }
-                gain[i] = cal_conversion[raw_cal] / float(ad_val)
-
-            if not len(np.unique(gain)) == 1:
-                raise EEGError('All channels do not have the same gain')
-            self.gain = gain[0]
-
-            if not (np.count_nonzero(data_num_to_21e_index != -1) == len(nums_21e_filtered)):
-                bad_indices = [not i in data_num_to_21e_index for i in range(len(names_21e_filtered))]
-                bad_names = names_21e_filtered[np.array(bad_indices)]
-                good_names = names_21e_filtered[np.logical_not(np.array(bad_indices))]
-                unique_bad_names = bad_names[np.array([bad_name not in good_names for bad_name in bad_names])]
-                if len(unique_bad_names) > 0:
-                    raise EEGError('Could not find recording for channels:\n%s' % unique_bad_names)
+    def get_data(self, jacksheet_dict, channel_map):
+        with open(self.raw_filename, 'rb') as f:
+            header = self._read_header(f, jacksheet_dict, channel_map)
+            num_channels = header['num_channels']
+            num_samples = header['num_samples']
+            ad_off = header['ad_off']
+            data_num_to_21e_index = header['data_num_to_21e_index']
+            jacksheet_filtered = header['jacksheet_filtered']
 
             # Get the data!
             logger.debug('Reading...')
@@ -566,21 +1120,67 @@ class NK_reader(EEG_reader):
         return self._data[channel]
 
     def _split_data(self, location, basename):
+        """
+        Writes each channel to its own file without loading the recording into memory. The waveform block is
+        memory-mapped and copied out SPLIT_CHUNK_BYTES at a time, so peak memory is set by the chunk size rather than
+        by the length of the recording.
+        """
         if not os.path.exists(location):
             fileutil.makedirs(location)
         if not self.jacksheet:
             raise EEGError('Jacksheet not specified')
-        data = self.get_data(self.jacksheet, self.channel_map)
+        with open(self.raw_filename, 'rb') as f:
+            header = self._read_header(f, self.jacksheet, self.channel_map)
+            data_offset = f.tell()
         if not self.sample_rate:
             raise EEGError('Sample rate not determined')
 
-        sys.stdout.flush()
-        for channel, channel_data in data.items():
-            filename = os.path.join(location, basename + ('.%03d' % channel))
+        num_columns = int(header['num_channels']) + 1
+        row_bytes = num_columns * np.dtype('int16').itemsize
+        num_samples = int(header['num_samples'])
+        available_samples = int((os.path.getsize(self.raw_filename) - data_offset) // row_bytes)
+        if available_samples < num_samples:
+            logger.warn(
+                'Number of samples specified in file is wrong. Specified: {}, actual: {}'.format(self.num_samples,
+                                                                                                 available_samples))
+            num_samples = available_samples
+            self.num_samples = num_samples
 
-            logger.debug(channel)
-            sys.stdout.flush()
-            channel_data.astype(self.DATA_FORMAT).tofile(filename)
+        # Later recordings of the same jacksheet channel take precedence, as they do in get_data
+        data_num_to_21e_index = header['data_num_to_21e_index']
+        columns = {}
+        for i in np.where(data_num_to_21e_index != -1)[0]:
+            columns[header['jacksheet_filtered'][int(data_num_to_21e_index[i])]] = i
+
+        filenames = {channel: os.path.join(location, basename + ('.%03d' % channel)) for channel in columns}
+        pending = self._pending_files(filenames.values())
+        columns = {channel: column for channel, column in columns.items() if filenames[channel] in pending}
+        if not columns:
+            return
+
+        data = np.memmap(self.raw_filename, dtype='int16', mode='r', offset=data_offset,
+                         shape=(num_samples, num_columns))
+        chunk_samples = max(1, self.SPLIT_CHUNK_BYTES // row_bytes)
+
+        out_files = {}
+        try:
+            for channel in columns:
+                out_files[channel] = open(filenames[channel], 'wb')
+            for start in range(0, num_samples, chunk_samples):
+                logger.debug('Writing samples {} to {}'.format(start, min(start + chunk_samples, num_samples)))
+                chunk = np.array(data[start:start + chunk_samples])
+
+                def write_channel(channel):
+                    # Remove offset
+                    (chunk[:, columns[channel]] + header['ad_off']).astype(self.DATA_FORMAT).tofile(out_files[channel])
+
+                self._map_channels(write_channel, columns)
+                sys.stdout.flush()
+            self._close_and_record(out_files.values())
+        finally:
+            for out_file in out_files.values():
+                out_file.close()
+            del data
 
 
 class Multi_NSx_reader(EEG_reader):
@@ -635,9 +1235,20 @@ class Multi_NSx_reader(EEG_reader):
         with fileutil.open_with_perms(os.path.join(location, 'sources.json'), 'w') as source_file:
             json.dump(sources, source_file, indent=2, sort_keys=True)
 
+    def get_channel_mapping(self):
+        mapping = self.readers[0].get_channel_mapping()
+        mapping['sources'] = [os.path.basename(reader.get_source_file()) for reader in self.readers]
+        return mapping
+
     def _split_data(self, location, basename):
         for reader in self.readers:
-            reader._split_data(location, basename)
+            reader.split_manifest = self.split_manifest
+            reader.channel_pool = self.channel_pool
+            try:
+                reader._split_data(location, basename)
+            finally:
+                reader.split_manifest = None
+                reader.channel_pool = None
 
 
 
@@ -652,6 +1263,9 @@ class NSx_reader(EEG_reader):
         '.ns6': 30000,
     }
 
+    # Number of samples of every split channel read from the file at once
+    SPLIT_BLOCK_SAMPLES = 30000 * 60
+
 
     def __init__(self, nsx_filename, jacksheet_filename=None,  file_number = 0, channel_map_filename=None):
         self.raw_filename = nsx_filename
@@ -693,13 +1307,19 @@ class NSx_reader(EEG_reader):
 
     @property
     def data(self):
-        if not self._data:
-            self._data = self.nsx_info['data'] # I apologize for this.
+        if self._data is None:
+            logger.debug('Reading data from {}'.format(self.raw_filename))
+            self._data = self.nsx_info['reader'].getdata()
         return self._data
 
     def channel_data(self, channel):
-        channels = np.array(self.data['elec_ids'])
-        return self.data['data'][channels==channel, :]
+        if self._data is not None or channel not in self.nsx_info['elec_ids']:
+            channels = np.array(self.nsx_info['elec_ids'])
+            return self.data['data'][channels==channel, :]
+        # Stream the single channel rather than reading every channel into memory
+        reader = self.nsx_info['reader']
+        data = np.concatenate(list(reader.iterdata([channel])), 1).astype(np.float32)
+        return data * reader.getscalefactors([channel]).astype(np.float32)[:, None]
 
     @classmethod
     def _my_downsample(cls, signal, sr, desired_downsample_rate):
@@ -727,27 +1347,82 @@ class NSx_reader(EEG_reader):
         #     new_ts = timestamps[inds]
         return new_sigals, new_sr
 
+    @classmethod
+    def _polyphase_downsample(cls, blocks, sr, desired_downsample_rate):
+        """
+        Downsample a stream of (channels x samples) blocks with a polyphase FIR filter, all channels at once.
+
+        Each block is filtered together with the samples around it, so the output matches that of filtering the whole
+        recording in one go, and only one block (plus the filter overlap) is held in memory. As with filtfilt, the
+        ends of the recording are extended by odd reflection before filtering. Decimation is by the same integer
+        factor as _my_downsample.
+
+        :param blocks: iterable of 2D arrays, channels x samples, in sample order
+        :return: generator of downsampled 2D float arrays, and the new sample rate
+        """
+        dec_factor = int(np.floor(1. / (desired_downsample_rate * (1. / sr))))
+        new_sr = float(sr) / dec_factor
+        # resample_poly's filter extends 10 * dec_factor samples either side of each output sample
+        overlap = 10 * dec_factor
+
+        def downsampled_blocks():
+            history = None
+            pending = None
+            for block in blocks:
+                block = np.asarray(block, dtype=np.float64)
+                pending = block if pending is None else np.concatenate((pending, block), 1)
+                n_emit = (pending.shape[1] - overlap) // dec_factor * dec_factor
+                if n_emit <= 0:
+                    continue
+                if history is None:
+                    history = 2 * pending[:, :1] - pending[:, overlap:0:-1]
+                filtered = resample_poly(np.concatenate((history, pending[:, :n_emit + overlap]), 1),
+                                         1, dec_factor, axis=1)
+                yield filtered[:, history.shape[1] // dec_factor:(history.shape[1] + n_emit) // dec_factor]
+                history = np.concatenate((history, pending[:, :n_emit]), 1)[:, -overlap:]
+                pending = pending[:, n_emit:]
+
+            if pending is None or pending.shape[1] == 0:
+                return
+            if history is None:
+                n_history = min(overlap, pending.shape[1] - 1) // dec_factor * dec_factor
+                history = 2 * pending[:, :1] - pending[:, n_history:0:-1]
+            tail = np.concatenate((history, pending), 1)
+            n_future = min(overlap, tail.shape[1] - 1)
+            tail = np.concatenate((tail, 2 * tail[:, -1:] - tail[:, -2:-n_future - 2:-1]), 1)
+            filtered = resample_poly(tail, 1, dec_factor, axis=1)
+            n_out = int(np.ceil(pending.shape[1] / float(dec_factor)))
+            yield filtered[:, history.shape[1] // dec_factor:history.shape[1] // dec_factor + n_out]
+
+        return downsampled_blocks(), new_sr
+
     @classmethod
     def get_nsx_info(cls, nsx_file):
-        reader = NsxFile(nsx_file)
+        """
+        Reads the metadata of an NSx file from its basic, extended and data packet headers. None of the data packets
+        are read.
+
+        :param nsx_file: path to the .nsx file
+        :return: dict with the start time, length, number of samples, sample rate, electrode ids, the headers of each
+        data segment, and the open NsxBlockFile from which the data can later be read
+        """
+        reader = NsxBlockFile(nsx_file)
         _, extension = os.path.splitext(nsx_file)
-        data = reader.getdata()
-        headers = data['data_headers']
+        headers = reader.getdataheaders()
 
         if len(headers) > 1:
+            # Samples before the NSPs were synced are overwritten by the segment that follows them
             pre_data_points = headers[0]['NumDataPoints']
-
-            # Have to get the data starting at a sample after the last segment starts
-            # or reader fills it with all zeros. Because blackrock.
-            data_actual = reader.getdata(start_time_s = float(pre_data_points+1)/data['samp_per_s'])
         else:
             pre_data_points = -1
-            data_actual = data
 
-        data['data'][:,pre_data_points+1:] = data_actual['data']
+        if reader.basic_header['FileSpec'] == '2.1':
+            elec_ids = reader.basic_header['ChannelID']
+        else:
+            elec_ids = [header['ElectrodeID'] for header in reader.extended_headers]
 
         start_time = reader.basic_header['TimeOrigin']
-        total_data_points = sum([header['NumDataPoints'] for header in data['data_headers']])
+        total_data_points = sum([header['NumDataPoints'] for header in headers])
         used_data_points = total_data_points - pre_data_points
         sample_rate = NSx_reader.SAMPLE_RATES[extension]
         length_ms = used_data_points / float(sample_rate) * 1000.
@@ -756,42 +1431,120 @@ class NSx_reader(EEG_reader):
                 'length_ms': length_ms,
                 'n_samples': used_data_points,
                 'sample_rate': sample_rate,
-                'reader': reader,
-                'data': data}
+                'elec_ids': elec_ids,
+                'data_headers': headers,
+                'reader': reader}
 
     def _split_data(self, location, basename):
-        channels = np.array(self.data['elec_ids'])
-        buffer_size = self.data['data_headers'][-1]['Timestamp'] / (self.TIC_RATE / self.get_sample_rate())
+        """
+        Streams the requested channels out of the NSx file SPLIT_BLOCK_SAMPLES at a time, downsampling all of them
+        together to 2000 Hz. Raw 30 kHz data is also saved to a .mat file per channel, one channel in memory at a time.
+        If an earlier attempt completed one of a channel's two files, only the other is written.
+        """
+        channels = np.array(self.nsx_info['elec_ids'])
+        buffer_size = int(self.nsx_info['data_headers'][-1]['Timestamp'] / (self.TIC_RATE / self.get_sample_rate()))
+        to_split = []
         for label, channel in self.labels.items():
             recording_channel = channel - self.lowest_channel
             if recording_channel < 0 or not recording_channel in channels:
                 logger.debug('Not getting channel {} from file {}'.format(channel, self.raw_filename))
                 continue
-            filename = os.path.join(location, basename + '.%03d' % channel)
-            logger.debug('%s: %s' % (label, channel))
-            data = self.data['data'][channels==recording_channel, :].astype(self.DATA_FORMAT)
-            if len(data) == 0:
-                raise EEGError("EEG File {} contains no data "
-                                                   "for channel {}".format(self.raw_filename, recording_channel))
-            data = np.concatenate((np.ones((1, buffer_size), self.DATA_FORMAT) * data[0,0], data), 1)
-
-            # JFM: for now, save out the raw non-downsampled data as mat files for easier reading into combinato for
-            # cluster cutting
-            if self.nsx_info['sample_rate'] == 30000:
+            to_split.append((label, channel, recording_channel))
+        if not to_split:
+            return
+
+        # JFM: for now, save out the raw non-downsampled data as mat files for easier reading into combinato for
+        # cluster cutting
+        save_raw = self.nsx_info['sample_rate'] == 30000
+        filenames = [os.path.join(location, basename + '.%03d' % channel) for _, channel, _ in to_split]
+        # Downsampled channel files and raw .mat files still to be written, by position in to_split
+        to_downsample = [i for i, filename in enumerate(filenames) if self._pending_files([filename])]
+        to_save_raw = [i for i, filename in enumerate(filenames)
+                       if save_raw and self._pending_files([filename + '_orig_sr.mat'])]
+        pending = sorted(set(to_downsample + to_save_raw))
+        if not to_downsample:
+            # Every channel file was written by an earlier attempt, which recorded the downsampled length before any
+            # channel
+            self.nsx_info['sample_rate'] = 2000
+            self.nsx_info['n_samples'] = self.split_manifest.n_samples(self.raw_filename)
+            if not pending:
+                return
+        # Rows of each block that are downsampled, and that are saved raw
+        ds_rows = [pending.index(i) for i in to_downsample]
+        raw_rows = [pending.index(i) for i in to_save_raw]
+        to_split = [to_split[i] for i in pending]
+        filenames = [filenames[i] for i in pending]
+
+        reader = self.nsx_info['reader']
+        recording_channels = [recording_channel for _, _, recording_channel in to_split]
+        scale = reader.getscalefactors(recording_channels).astype(np.float32)[:, None]
+
+        def split_blocks():
+            first_block = True
+            for block in reader.iterdata(recording_channels, block_size=self.SPLIT_BLOCK_SAMPLES):
+                block = (block.astype(np.float32) * scale).astype(self.DATA_FORMAT)
+                if first_block:
+                    yield np.ones((len(block), buffer_size), self.DATA_FORMAT) * block[:, :1]
+                    first_block = False
+                yield block
+            if first_block:
+                raise EEGError("EEG File {} contains no data".format(self.raw_filename))
+
+        out_files = []
+        raw_files = []
+        n_ds_samples = 0
+        try:
+            for row in ds_rows:
+                out_files.append(open(filenames[row], 'wb'))
+            for row in raw_rows:
+                raw_files.append(open(filenames[row] + '_orig_sr.int16', 'wb'))
+
+            def saved_blocks():
+                for block in split_blocks():
+                    if raw_rows:
+                        self._map_channels(lambda i: block[raw_rows[i]].tofile(raw_files[i]), range(len(raw_rows)))
+                    yield block if len(ds_rows) == len(block) else block[ds_rows]
+
+            if ds_rows:
+                # now downsample the data and save out
+                logger.info('Downsampling {} channels to 2000 Hz'.format(len(ds_rows)))
+                ds_blocks, ds_sr = self._polyphase_downsample(saved_blocks(), 30000, 2000)
+                for ds_block in ds_blocks:
+                    self._map_channels(lambda i: ds_block[i].tofile(out_files[i]), range(len(ds_block)))
+                    n_ds_samples += ds_block.shape[1]
+                    sys.stdout.flush()
+                if self.split_manifest is not None:
+                    self.split_manifest.record_n_samples(self.raw_filename, n_ds_samples)
+                self._close_and_record(out_files)
+            else:
+                logger.info('Saving {} channels at the original sample rate'.format(len(raw_rows)))
+                for _ in saved_blocks():
+                    pass
+            for open_file in raw_files:
+                open_file.close()
+        finally:
+            for open_file in out_files + raw_files:
+                open_file.close()
+
+        if raw_rows:
+            def save_mat(row):
+                label, channel, _ = to_split[row]
                 logger.info('Saving raw to .mat file: %s: %s' % (label, channel))
-                savemat(filename+'_orig_sr.mat', {'data': data, 'sr': 30000})
+                data = np.fromfile(filenames[row] + '_orig_sr.int16', self.DATA_FORMAT)[None, :]
+                savemat(filenames[row] + '_orig_sr.mat', {'data': data, 'sr': 30000})
+                os.remove(filenames[row] + '_orig_sr.int16')
+                self._record_files([filenames[row] + '_orig_sr.mat'])
 
-            # now downsample the data and save out
-            ds_data, ds_sr = self._my_downsample(data[0], 30000, 2000)
-            logger.info('Downsampling %s: %s to 2000 Hz' % (label, channel))
-            ds_data.tofile(filename)
-            sys.stdout.flush()
+            self._map_channels(save_mat, raw_rows)
+
+        if not ds_rows:
+            return
 
         # update .nsx_info to account for new sample rate
         self.nsx_info['sample_rate'] = int(ds_sr)
 
         # JFM: I'm not sure why n_samples above is "used_data_points" and not just the length of the actual data?
-        self.nsx_info['n_samples'] = len(ds_data)
+        self.nsx_info['n_samples'] = n_ds_samples
 
 
 class EDF_reader(EEG_reader):
@@ -866,6 +1619,7 @@ class EDF_reader(EEG_reader):
     def _split_data(self, location, basename):
         sys.stdout.flush()
         used_jacksheet_labels = []
+        to_split = []
         for channel, header in self.headers.items():
             if self.jacksheet:
                 label = self.get_matching_jacksheet_dict_label(header['label'], self.jacksheet, self.channel_map)
@@ -882,12 +1636,25 @@ class EDF_reader(EEG_reader):
                     logger.info("skipping channel {}".format(label))
             else:
                 out_channel = channel
+            to_split.append((channel, out_channel))
+
+        # pyedflib reads through a single file handle, so only the conversion and writing happen concurrently
+        read_lock = threading.Lock()
+
+        def write_channel(channel_out_channel):
+            channel, out_channel = channel_out_channel
             filename = os.path.join(location, basename + '.%03d' % (out_channel))
+            if not self._pending_files([filename]):
+                return
 
-            logger.debug('{}: {}'.format(out_channel, header['label']))
+            logger.debug('{}: {}'.format(out_channel, self.headers[channel]['label']))
             sys.stdout.flush()
-            data = self.reader.readSignal(channel).astype(self.DATA_FORMAT)
-            data.tofile(filename)
+            with read_lock:
+                data = self.reader.readSignal(channel)
+            data.astype(self.DATA_FORMAT).tofile(filename)
+            self._record_files([filename])
+
+        self._map_channels(write_channel, to_split)
         if self.jacksheet:
             for label in self.jacksheet:
                 if label not in used_jacksheet_labels:
@@ -903,6 +1670,7 @@ class EGI_reader_new(EEG_reader):
         """
         self.raw_filename = raw_filename
         self.start_datetime = None
+        self.header_info = None
         self.names = None
         self.data = None
 
@@ -914,31 +1682,20 @@ class EGI_reader_new(EEG_reader):
         written in the data file.
         """
         # logger.debug('Unzipping EEG data file ' + self.raw_filename)
-        original_path = os.path.abspath(os.path.join(os.path.dirname(self.raw_filename), os.readlink(self.raw_filename)))
-        unzip_path = original_path[:-4]  # remove '.bz2' from end of file name
-        already_unzipped = os.path.isfile(unzip_path)
-        # If data file is already unzipped, use it; otherwise unzip the file for reading
-        if already_unzipped or os.system('bunzip2 -k ' + original_path.replace(' ', '\ ')) == 0:
-            try:
-                logger.debug('Parsing EEG data file ' + self.raw_filename)
-                self.data = mne.io.read_raw_egi(unzip_path, eog=['EEG 008', 'EEG 025', 'EEG 126', 'EEG 127'], preload=True)
-                logger.debug('Finished parsing EEG data.')
-
-                # Pull relevant header info
-                self.start_datetime = datetime.datetime.utcfromtimestamp(self.data.info['meas_date'])
-                self.names = [str(x) for x in self.data.info['ch_names']]
-            except:
-                logger.critical('Unable to parse EEG data file!')
-
-            # Remove unzipped file if zipped version exists, otherwise zip the file
-            if os.path.isfile(original_path):
-                os.system('rm ' + unzip_path.replace(' ', '\ '))
-            else:
-                os.system('bzip2 ' + unzip_path.replace(' ', '\ '))
+        try:
+            with decompressed_raw_file(self.raw_filename) as unzip_path:
+                try:
+                    logger.debug('Parsing EEG data file ' + self.raw_filename)
+                    self.data = mne.io.read_raw_egi(unzip_path, eog=['EEG 008', 'EEG 025', 'EEG 126', 'EEG 127'], preload=True)
+                    logger.debug('Finished parsing EEG data.')
+
+                    # Pull relevant header info
+                    self.start_datetime = datetime.datetime.utcfromtimestamp(self.data.info['meas_date'])
+                    self.names = [str(x) for x in self.data.info['ch_names']]
+                except:
+                    logger.critical('Unable to parse EEG data file!')
             logger.debug('Finished getting EEG data.')
-
-        # If unzip attempt fails, return error
-        else:
+        except DecompressionError:
             logger.critical('Unzipping failed! Unable to read data file!')
 
     def postprocess(self):
@@ -992,10 +1749,15 @@ class EGI_reader_new(EEG_reader):
         ica_filename = os.path.join(location, basename + '_reref-ica.fif')
         self.run_ica(ica_filename)
 
+    def read_header_info(self):
+        if self.header_info is None:
+            self.header_info = read_egi_header(self.raw_filename)
+        return self.header_info
+
     def get_start_time(self):
-        # Read header info if have not already done so, as the header contains the start time info
+        # The header contains the start time info, so there is no need to read the data
         if self.start_datetime is None:
-            self.get_data()
+            self.start_datetime = self.read_header_info()['start_time']
         return self.start_datetime
 
     def get_start_time_string(self):
@@ -1006,7 +1768,7 @@ class EGI_reader_new(EEG_reader):
 
     def get_sample_rate(self):
         if self.data is None:
-            self.get_data()
+            return self.read_header_info()['sample_rate']
         return self.data.info['sfreq']
 
     def get_source_file(self):
@@ -1014,7 +1776,7 @@ class EGI_reader_new(EEG_reader):
 
     def get_n_samples(self):
         if self.data is None:
-            self.get_data()
+            return self.read_header_info()['n_samples']
         return self.data.n_times
 
 
@@ -1036,6 +1798,9 @@ class EGI_reader(EEG_reader):
     num_chans: The number of EEG and EOG channels. This does not include sync pulse channels, etc.
     DATA_FORMAT: The format in which the split channel files will be written.
     """
+    # Number of samples of every channel filtered and written at once
+    SPLIT_BLOCK_SAMPLES = 1024 * 60
+
     def __init__(self, raw_filename, unused_jacksheet=None):
         """
         :param raw_filename: The file path to the .raw.bz2 file containing the EEG recording from the session.
@@ -1047,9 +1812,11 @@ class EGI_reader(EEG_reader):
         self.basename = ''
         self.noreref_loc = ''
         self.start_datetime = None
+        self.header_info = None
         self.data = None
         self.sample_rate = None
         self.chans = None
+        self.channel_files = None
         self.num_chans = 129
         self.DATA_FORMAT = 'float16'
         try:
@@ -1070,37 +1837,29 @@ class EGI_reader(EEG_reader):
         file. We convert it back to uV before saving it out to individual channel files.
         """
         logger.debug('Unzipping EEG data file ' + self.raw_filename)
-        original_path = os.path.abspath(os.path.join(os.path.dirname(self.raw_filename), os.readlink(self.raw_filename)))
-        unzip_path = original_path[:-4]
-        already_unzipped = os.path.isfile(unzip_path)
-        # If data file is already unzipped, use it; otherwise unzip the file for reading
-        if already_unzipped or os.system('bunzip2 -k ' + original_path.replace(' ', '\ ')) == 0:
-            try:
-                logger.debug('Parsing EEG data file ' + self.raw_filename)
-                raw = mne.io.read_raw_egi(unzip_path, eog=['EEG 008', 'EEG 025', 'EEG 126', 'EEG 127'], preload=True)
-                logger.debug('Finished parsing EEG data.')
-                picks_eeg_eog = mne.pick_types(raw.info, eeg=True, eog=True)
-                logger.debug('Running .1 Hz highpass filter on all channels.')
-                raw.filter(.1, None, picks=picks_eeg_eog, method='iir', phase='zero-double', l_trans_bandwidth='auto', h_trans_bandwidth='auto')
-
-                # Pull relevant header info
-                self.sample_rate = int(raw.info['sfreq'])
-                self.start_datetime = datetime.datetime.utcfromtimestamp(raw.info['meas_date'])
-                self.chans = raw.info['chs']
-
-                # Extract the EEG data from the RawEDF data structure and convert all non-sync pulse channels to uV.
-                self.data = raw[:][0]
-                self.data[:picks_eeg_eog.size] *= 1000000
-
-            except Exception as e:
-                logger.critical('Unable to parse EEG data file!')
-
-            if os.path.isfile(original_path):  # Remove unzipped file if zipped version exists
-                os.system('rm ' + unzip_path.replace(' ', '\ '))
-            else:  # Zip file if only unzipped version exists
-                os.system('bzip2 ' + unzip_path.replace(' ', '\ '))
+        try:
+            with decompressed_raw_file(self.raw_filename) as unzip_path:
+                try:
+                    logger.debug('Parsing EEG data file ' + self.raw_filename)
+                    raw = mne.io.read_raw_egi(unzip_path, eog=['EEG 008', 'EEG 025', 'EEG 126', 'EEG 127'], preload=True)
+                    logger.debug('Finished parsing EEG data.')
+                    picks_eeg_eog = mne.pick_types(raw.info, eeg=True, eog=True)
+                    logger.debug('Running .1 Hz highpass filter on all channels.')
+                    raw.filter(.1, None, picks=picks_eeg_eog, method='iir', phase='zero-double', l_trans_bandwidth='auto', h_trans_bandwidth='auto')
+
+                    # Pull relevant header info
+                    self.sample_rate = int(raw.info['sfreq'])
+                    self.start_datetime = datetime.datetime.utcfromtimestamp(raw.info['meas_date'])
+                    self.chans = raw.info['chs']
+
+                    # Extract the EEG data from the RawEDF data structure and convert all non-sync pulse channels to uV.
+                    self.data = raw[:][0]
+                    self.data[:picks_eeg_eog.size] *= 1000000
+
+                except Exception as e:
+                    logger.critical('Unable to parse EEG data file!')
             logger.debug('Finished getting EEG data.')
-        else:
+        except DecompressionError:
             logger.critical('Unzipping failed! Unable to parse data file!')
 
     def _split_data(self, location, basename):
@@ -1113,27 +1872,36 @@ class EGI_reader(EEG_reader):
         """
         self.basename = basename
         self.noreref_loc = location
-        if self.data is None:
-            self.get_data()
-
-        # Clip to within bounds of selected data format, and change the data format
-        self.data = self.data.clip(self.bounds.min, self.bounds.max)
-        self.data = self.data.astype(self.DATA_FORMAT)
 
         # Create directory if needed
         if not os.path.exists(location):
             fileutil.makedirs(location)
 
-        # Write EEG channel files
-        for i in range(self.data.shape[0]):
-            if self.chans[i]['kind'] in (2, 202):  # EEG/EOG channels
-                filename = os.path.join(location, basename + '.' + self.chans[i]['ch_name'][-3:])
-            else:  # "Event" channels
-                filename = os.path.join(location, basename + '.' + self.chans[i]['ch_name'])
-            logger.debug(str(i+1))
-            sys.stdout.flush()
-            # Each row of self._data contains all samples for one channel or event, so write each row to its own file
-            self.data[i].tofile(filename)
+        # Every channel may have been split by an earlier attempt, in which case there is no need to decompress
+        self.channel_files = self._already_split(location)
+        if self.channel_files is not None:
+            self.sample_rate = self.get_sample_rate()
+        else:
+            logger.debug('Unzipping EEG data file ' + self.raw_filename)
+            with decompressed_raw_file(self.raw_filename) as unzip_path:
+                # The recording is read a block at a time rather than preloaded, so it is never held in memory in full
+                logger.debug('Parsing EEG data file ' + self.raw_filename)
+                raw = mne.io.read_raw_egi(unzip_path, eog=['EEG 008', 'EEG 025', 'EEG 126', 'EEG 127'],
+                                          preload=False)
+                self.sample_rate = int(raw.info['sfreq'])
+                self.chans = raw.info['chs']
+
+                # EEG/EOG channel files are named by channel number, "event" channel files by the name of the event
+                self.channel_files = [os.path.join(location, basename + '.' + (chan['ch_name'][-3:]
+                                                                               if chan['kind'] in (2, 202)
+                                                                               else chan['ch_name']))
+                                      for chan in self.chans]
+                self._expect_files(self.channel_files)
+                pending = self._pending_files(self.channel_files)
+                channel_files = {i: filename for i, filename in enumerate(self.channel_files) if filename in pending}
+                split_highpassed_raw(raw, channel_files, self.bounds, self.DATA_FORMAT, self.SPLIT_BLOCK_SAMPLES)
+                for filename in pending:
+                    self._record_files([filename])
 
         # Write the sample rate, data format, and amplifier gain to two params.txt files in the noreref folder
         logger.debug('Writing param files.')
@@ -1165,7 +1933,11 @@ class EGI_reader(EEG_reader):
         good_chans = np.setdiff1d(all_chans, np.array(bad_chans))
 
         # Find the average value of each sample across all good channels (index of each channel is channel number - 1)
-        means = np.mean(self.data[good_chans-1], axis=0)
+        if self.channel_files:
+            means = _mean_of_channel_files([self.channel_files[i - 1] for i in good_chans], self.DATA_FORMAT,
+                                           self.SPLIT_BLOCK_SAMPLES)
+        else:
+            means = np.mean(self.data[good_chans-1], axis=0)
         means = means.clip(self.bounds.min, self.bounds.max).astype(self.DATA_FORMAT)
 
         logger.debug('Writing common average reference data...')
@@ -1206,10 +1978,15 @@ class EGI_reader(EEG_reader):
 
         return bad_chans
 
+    def read_header_info(self):
+        if self.header_info is None:
+            self.header_info = read_egi_header(self.raw_filename)
+        return self.header_info
+
     def get_start_time(self):
-        # Read header info if have not already done so, as the header contains the start time info
+        # The header contains the start time info, so there is no need to read the data
         if self.start_datetime is None:
-            self.get_data()
+            self.start_datetime = self.read_header_info()['start_time']
         return self.start_datetime
 
     def get_start_time_string(self):
@@ -1220,7 +1997,7 @@ class EGI_reader(EEG_reader):
 
     def get_sample_rate(self):
         if self.sample_rate is None:
-            self.get_data()
+            self.sample_rate = int(self.read_header_info()['sample_rate'])
         return self.sample_rate
 
     def get_source_file(self):
@@ -1228,7 +2005,7 @@ class EGI_reader(EEG_reader):
 
     def get_n_samples(self):
         if self.data is None:
-            self.get_data()
+            return self.read_header_info()['n_samples']
         return self.data.shape[1]
 
 
@@ -1241,6 +2018,7 @@ class BDF_reader_new(EEG_reader):
         """
         self.raw_filename = raw_filename
         self.start_datetime = None
+        self.header_info = None
         self.names = None
         self.data = None
 
@@ -1252,33 +2030,22 @@ class BDF_reader_new(EEG_reader):
         written in the data file.
         """
         # logger.debug('Unzipping EEG data file ' + self.raw_filename)
-        original_path = os.path.abspath(os.path.join(os.path.dirname(self.raw_filename), os.readlink(self.raw_filename)))
-        unzip_path = original_path[:-4]  # remove '.bz2' from end of file name
-        already_unzipped = os.path.isfile(unzip_path)
-        # If data file is already unzipped, use it; otherwise unzip the file for reading
-        if already_unzipped or os.system('bunzip2 -k ' + original_path.replace(' ', '\ ')) == 0:
-            try:
-                logger.debug('Parsing EEG data file ' + self.raw_filename)
-                self.data = mne.io.read_raw_edf(unzip_path, eog=['EXG1', 'EXG2', 'EXG3', 'EXG4'],
-                                                misc=['EXG5', 'EXG6', 'EXG7', 'EXG8'], montage='biosemi128',
-                                                preload=True)
-                logger.debug('Finished parsing EEG data.')
-
-                # Pull relevant header info
-                self.start_datetime = datetime.datetime.utcfromtimestamp(self.data.info['meas_date'])
-                self.names = [str(x) for x in self.data.info['ch_names']]
-            except:
-                logger.critical('Unable to parse EEG data file!')
-
-            # Remove unzipped file if zipped version exists, otherwise zip the file
-            if os.path.isfile(original_path):
-                os.system('rm ' + unzip_path.replace(' ', '\ '))
-            else:
-                os.system('bzip2 ' + unzip_path.replace(' ', '\ '))
+        try:
+            with decompressed_raw_file(self.raw_filename) as unzip_path:
+                try:
+                    logger.debug('Parsing EEG data file ' + self.raw_filename)
+                    self.data = mne.io.read_raw_edf(unzip_path, eog=['EXG1', 'EXG2', 'EXG3', 'EXG4'],
+                                                    misc=['EXG5', 'EXG6', 'EXG7', 'EXG8'], montage='biosemi128',
+                                                    preload=True)
+                    logger.debug('Finished parsing EEG data.')
+
+                    # Pull relevant header info
+                    self.start_datetime = datetime.datetime.utcfromtimestamp(self.data.info['meas_date'])
+                    self.names = [str(x) for x in self.data.info['ch_names']]
+                except:
+                    logger.critical('Unable to parse EEG data file!')
             logger.debug('Finished getting EEG data.')
-
-        # If unzip attempt fails, return error
-        else:
+        except DecompressionError:
             logger.critical('Unzipping failed! Unable to read data file!')
 
     def postprocess(self):
@@ -1332,10 +2099,15 @@ class BDF_reader_new(EEG_reader):
         ica_filename = os.path.join(location, basename + '_reref-ica.fif')
         self.run_ica(ica_filename)
 
+    def read_header_info(self):
+        if self.header_info is None:
+            self.header_info = read_bdf_header(self.raw_filename)
+        return self.header_info
+
     def get_start_time(self):
-        # Read header info if have not already done so, as the header contains the start time info
+        # The header contains the start time info, so there is no need to read the data
         if self.start_datetime is None:
-            self.get_data()
+            self.start_datetime = self.read_header_info()['start_time']
         return self.start_datetime
 
     def get_start_time_string(self):
@@ -1346,7 +2118,7 @@ class BDF_reader_new(EEG_reader):
 
     def get_sample_rate(self):
         if self.data is None:
-            self.get_data()
+            return self.read_header_info()['sample_rate']
         return self.data.info['sfreq']
 
     def get_source_file(self):
@@ -1354,11 +2126,14 @@ class BDF_reader_new(EEG_reader):
 
     def get_n_samples(self):
         if self.data is None:
-            self.get_data()
+            return self.read_header_info()['n_samples']
         return self.data.n_times
 
 
 class BDF_reader(EEG_reader):
+    # Number of samples of every channel filtered and written at once
+    SPLIT_BLOCK_SAMPLES = 2048 * 30
+
     def __init__(self, raw_filename, unused_jacksheet=None):
         """
         :param raw_filename: The file path to the .raw.bz2 file containing the EEG recording from the session.
@@ -1369,10 +2144,12 @@ class BDF_reader(EEG_reader):
         self.basename = ''
         self.noreref_loc = ''
         self.start_datetime = None
+        self.header_info = None
         self.sample_rate = None
         self.names = None
         self.data = None
         self.sync = None
+        self.channel_files = None
         self.DATA_FORMAT = 'float16'
         try:
             self.bounds = np.finfo(self.DATA_FORMAT)
@@ -1392,43 +2169,35 @@ class BDF_reader(EEG_reader):
         written in the data file.
         """
         # logger.debug('Unzipping EEG data file ' + self.raw_filename)
-        original_path = os.path.abspath(os.path.join(os.path.dirname(self.raw_filename), os.readlink(self.raw_filename)))
-        unzip_path = original_path[:-4]  # remove '.bz2' from end of file name
-        already_unzipped = os.path.isfile(unzip_path)
-        # If data file is already unzipped, use it; otherwise unzip the file for reading
-        if already_unzipped or os.system('bunzip2 -k ' + original_path.replace(' ', '\ ')) == 0:
-            try:
-                logger.debug('Parsing EEG data file ' + self.raw_filename)
-                raw = mne.io.read_raw_edf(unzip_path, eog=['EXG1', 'EXG2', 'EXG3', 'EXG4'],
-                                          misc=['EXG5', 'EXG6', 'EXG7', 'EXG8',
-                                                'GSR1', 'GSR2', 'Erg1', 'Erg2', 'Resp', 'Plet', 'Temp'], montage='biosemi128',
-                                          preload=True,)
-
-                logger.debug('Finished parsing EEG data.')
-                picks_eeg_eog = mne.pick_types(raw.info, eeg=True, eog=True)
-                logger.debug('Running .1 Hz highpass filter on all channels.')
-                raw.filter(.1, None, picks=picks_eeg_eog, method='iir', phase='zero-double', l_trans_bandwidth='auto', h_trans_bandwidth='auto')
-
-                # Pull relevant header info
-                self.sample_rate = int(raw.info['sfreq'])
-                self.start_datetime = datetime.datetime.utcfromtimestamp(raw.info['meas_date'])
-                self.names = [str(x) for x in raw.info['ch_names']]
-
-                # Extract the EEG data from the RawEDF data structure and convert all non-sync pulse channels to uV.
-                self.data = raw[:][0]
-                self.data[:picks_eeg_eog.size] *= 1000000
-                self.sync_nums = np.unique(mne.find_events(raw)[:,2])
-
-            except Exception as e:
-                logger.critical('Unable to parse EEG data file!')
-                raise e
-
-            if os.path.isfile(original_path):  # Remove unzipped file if zipped version exists
-                os.system('rm ' + unzip_path.replace(' ', '\ '))
-            else:  # Zip file if only unzipped version exists
-                os.system('bzip2 ' + unzip_path.replace(' ', '\ '))
+        try:
+            with decompressed_raw_file(self.raw_filename) as unzip_path:
+                try:
+                    logger.debug('Parsing EEG data file ' + self.raw_filename)
+                    raw = mne.io.read_raw_edf(unzip_path, eog=['EXG1', 'EXG2', 'EXG3', 'EXG4'],
+                                              misc=['EXG5', 'EXG6', 'EXG7', 'EXG8',
+                                                    'GSR1', 'GSR2', 'Erg1', 'Erg2', 'Resp', 'Plet', 'Temp'], montage='biosemi128',
+                                              preload=True,)
+
+                    logger.debug('Finished parsing EEG data.')
+                    picks_eeg_eog = mne.pick_types(raw.info, eeg=True, eog=True)
+                    logger.debug('Running .1 Hz highpass filter on all channels.')
+                    raw.filter(.1, None, picks=picks_eeg_eog, method='iir', phase='zero-double', l_trans_bandwidth='auto', h_trans_bandwidth='auto')
+
+                    # Pull relevant header info
+                    self.sample_rate = int(raw.info['sfreq'])
+                    self.start_datetime = datetime.datetime.utcfromtimestamp(raw.info['meas_date'])
+                    self.names = [str(x) for x in raw.info['ch_names']]
+
+                    # Extract the EEG data from the RawEDF data structure and convert all non-sync pulse channels to uV.
+                    self.data = raw[:][0]
+                    self.data[:picks_eeg_eog.size] *= 1000000
+                    self.sync_nums = np.unique(mne.find_events(raw)[:,2])
+
+                except Exception as e:
+                    logger.critical('Unable to parse EEG data file!')
+                    raise e
             logger.debug('Finished getting EEG data.')
-        else:
+        except DecompressionError:
             logger.critical('Unzipping failed! Unable to parse data file!')
 
     def _split_data(self, location, basename):
@@ -1441,42 +2210,56 @@ class BDF_reader(EEG_reader):
         """
         self.basename = basename
         self.noreref_loc = location
-        if self.data is None:
-            self.get_data()
-
-        # MNE reads sync pulses as either 15 or 65551 and non-pulses as 7 or 65543
-        # Here we convert the sync pulse channel to 1s for pulses and 0s for non-pulses
-        if not self.sync_nums.any():
-            self.sync_nums = []
-        self.data[-1] = np.in1d(self.data[-1],self.sync_nums)
-
-        # Clip to within bounds of selected data format, and change the data format
-        self.data = self.data.clip(self.bounds.min, self.bounds.max)
-        self.data = self.data.astype(self.DATA_FORMAT)
-
-        # Separate sync pulse channel and drop all channels after EXG4
-        self.sync = self.data[-1]
-        self.data = self.data[:132]
-        self.names = self.names[:132]
 
         # Create directory if needed
         if not os.path.exists(location):
             fileutil.makedirs(location)
 
-        # Write EEG channel files
-        for i in range(self.data.shape[0]):
-            filename = os.path.join(location, basename + ('.' + self.names[i]))
-            logger.debug(i + 1)
-            sys.stdout.flush()
-            # Each row of self._data contains all samples for one channel or event
-            self.data[i].tofile(filename)
+        # Every channel may have been split by an earlier attempt, in which case there is no need to decompress.
+        # The sync pulse channel file is noted last, after the channel files
+        sync_filename = os.path.join(location, basename + '.Status')
+        already_split = self._already_split(location)
+        if already_split is not None:
+            self.sample_rate = int(self.get_sample_rate())
+            self.channel_files = already_split[:-1]
+            self.names = [os.path.basename(filename)[len(basename) + 1:] for filename in self.channel_files]
+        else:
+            with decompressed_raw_file(self.raw_filename) as unzip_path:
+                # The recording is read a block at a time rather than preloaded, so it is never held in memory in full
+                logger.debug('Parsing EEG data file ' + self.raw_filename)
+                raw = mne.io.read_raw_edf(unzip_path, eog=['EXG1', 'EXG2', 'EXG3', 'EXG4'],
+                                          misc=['EXG5', 'EXG6', 'EXG7', 'EXG8',
+                                                'GSR1', 'GSR2', 'Erg1', 'Erg2', 'Resp', 'Plet', 'Temp'],
+                                          montage='biosemi128', preload=False)
+                self.sample_rate = int(raw.info['sfreq'])
 
-        # Write sync pulse channel file
-        filename = os.path.join(location, basename + '.Status')
-        logger.debug(i + 1)
-        sys.stdout.flush()
-        # Each row of self._data contains all samples for one channel or event
-        self.sync.tofile(filename)
+                # Drop all channels after EXG4
+                self.names = [str(x) for x in raw.info['ch_names']][:132]
+                self.channel_files = [os.path.join(location, basename + '.' + name) for name in self.names]
+                self._expect_files(self.channel_files + [sync_filename])
+                pending = self._pending_files(self.channel_files)
+                channel_files = {i: filename for i, filename in enumerate(self.channel_files) if filename in pending}
+                split_highpassed_raw(raw, channel_files, self.bounds, self.DATA_FORMAT, self.SPLIT_BLOCK_SAMPLES)
+                for filename in pending:
+                    self._record_files([filename])
+
+                # MNE reads sync pulses as either 15 or 65551 and non-pulses as 7 or 65543
+                # Here we convert the sync pulse channel to 1s for pulses and 0s for non-pulses
+                self.sync_nums = np.unique(mne.find_events(raw)[:, 2])
+                if not self.sync_nums.any():
+                    self.sync_nums = []
+
+                # Write sync pulse channel file
+                if self._pending_files([sync_filename]):
+                    logger.debug('Writing sync pulse channel.')
+                    sync_channel = len(raw.ch_names) - 1
+                    sync = np.memmap(sync_filename, dtype=self.DATA_FORMAT, mode='w+', shape=(raw.n_times,))
+                    for start in range(0, raw.n_times, self.SPLIT_BLOCK_SAMPLES):
+                        stop = min(start + self.SPLIT_BLOCK_SAMPLES, raw.n_times)
+                        sync[start:stop] = np.in1d(raw[sync_channel, start:stop][0][0], self.sync_nums)
+                    sync.flush()
+                    del sync
+                    self._record_files([sync_filename])
 
         logger.debug('Saved.')
 
@@ -1510,7 +2293,11 @@ class BDF_reader(EEG_reader):
         good_chans = np.setdiff1d(all_chans, np.array(bad_chans))
 
         # Find the average value of each sample across all good channels (index of each channel is channel number - 1)
-        means = np.mean(self.data[good_chans - 1], axis=0)
+        if self.channel_files:
+            means = _mean_of_channel_files([self.channel_files[i - 1] for i in good_chans], self.DATA_FORMAT,
+                                           self.SPLIT_BLOCK_SAMPLES)
+        else:
+            means = np.mean(self.data[good_chans - 1], axis=0)
         means = means.clip(self.bounds.min, self.bounds.max).astype(self.DATA_FORMAT)
 
         logger.debug('Writing common average reference data...')
@@ -1526,10 +2313,15 @@ class BDF_reader(EEG_reader):
         # of the common average reference
         np.savetxt(os.path.join(location, 'bad_chans.txt'), bad_chans, fmt='%s')
 
+    def read_header_info(self):
+        if self.header_info is None:
+            self.header_info = read_bdf_header(self.raw_filename)
+        return self.header_info
+
     def get_start_time(self):
-        # Read header info if have not already done so, as the header contains the start time info
+        # The header contains the start time info, so there is no need to read the data
         if self.start_datetime is None:
-            self.get_data()
+            self.start_datetime = self.read_header_info()['start_time']
         return self.start_datetime
 
     def get_start_time_string(self):
@@ -1540,7 +2332,7 @@ class BDF_reader(EEG_reader):
 
     def get_sample_rate(self):
         if self.sample_rate is None:
-            self.get_data()
+            self.sample_rate = int(self.read_header_info()['sample_rate'])
         return self.sample_rate
 
     def get_source_file(self):
@@ -1548,7 +2340,7 @@ class BDF_reader(EEG_reader):
 
     def get_n_samples(self):
         if self.data is None:
-            self.get_data()
+            return self.read_header_info()['n_samples']
         return self.data.shape[1]
 
 
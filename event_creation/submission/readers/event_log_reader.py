@@ -0,0 +1,42 @@
+import json
+import os
+from collections import OrderedDict
+
+from ..log import logger
+
+EVENT_LOG_CACHE_SIZE = 4  # Number of decoded event logs kept in memory
+
+_event_log_cache = OrderedDict()
+
+
+def read_event_log(event_log):
+    """
+    Decodes a System 3 event_log.json, reusing the contents if the same file has already been decoded and has not
+    changed since, so that the parser, aligner and quality checks for a session only decode it once.
+    The returned dictionary is shared between callers, so it must not be modified
+    :param event_log: path to the event log
+    :return: the decoded JSON
+    """
+    path = os.path.realpath(event_log)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime)
+    if key in _event_log_cache:
+        contents = _event_log_cache.pop(key)
+    else:
+        logger.debug('Reading event log {}'.format(event_log))
+        with open(path) as event_log_file:
+            contents = json.load(event_log_file)
+        for stale_key in [k for k in _event_log_cache if k[0] == path]:
+            del _event_log_cache[stale_key]
+        while len(_event_log_cache) >= EVENT_LOG_CACHE_SIZE:
+            _event_log_cache.popitem(last=False)
+    _event_log_cache[key] = contents
+    return contents
+
+
+def clear_event_log_cache():
+    """
+    Drops every cached event log. Called when each transfer pipeline finishes, so that the decoded logs of one
+    session are not held while the next is processed
+    """
+    _event_log_cache.clear()
@@ -0,0 +1,124 @@
+"""
+Block-wise reading of Blackrock NSx files, kept apart from the vendored brpylib so that it can be updated from upstream
+unchanged
+"""
+
+import numpy as np
+from math import ceil
+from os import path as ospath
+from struct import calcsize
+
+from .brpylib import NsxFile, processheaders, check_elecid, getdigfactor, nsx_header_dict, \
+    ELEC_ID_DEF, UV_PER_BIT_21, DATA_BYTE_SIZE, TIMESTAMP_NULL_21
+
+DATA_BLOCK_SAMPLES = 30000 * 60
+
+
+class NsxBlockFile(NsxFile):
+    """
+    NsxFile that can read the data packet headers on their own, and iterate over the raw data in blocks of samples
+    instead of reading the whole file into memory with getdata()
+    """
+
+    def _all_elec_ids(self):
+        if self.basic_header['FileSpec'] == '2.1':
+            return self.basic_header['ChannelID']
+        return [d['ElectrodeID'] for d in self.extended_headers]
+
+    def getdataheaders(self):
+        """
+        Returns the data packet headers of the NSx datafile without reading any of the data.
+
+        The file position is moved from header to header, skipping over the data points of each packet, so the cost
+        depends on the number of packets rather than the size of the file. For File Spec 2.1, which has no data
+        packet headers, a single header spanning the whole file is returned, as in getdata().
+        :return: list of dictionaries of all data headers, in file order
+        """
+        self.datafile.seek(self.basic_header['BytesInHeader'], 0)
+        file_size = ospath.getsize(self.datafile.name)
+
+        if self.basic_header['FileSpec'] == '2.1':
+            return [{'Timestamp': TIMESTAMP_NULL_21,
+                     'NumDataPoints': (file_size - self.datafile.tell())
+                                      // (DATA_BYTE_SIZE * self.basic_header['ChannelCount'])}]
+
+        output = []
+        while self.datafile.tell() < file_size:
+            output.append(processheaders(self.datafile, nsx_header_dict['data']))
+            if output[-1]['Header'] == 0:
+                print('Invalid Header.  File may be corrupt')
+            self.datafile.seek(output[-1]['NumDataPoints'] * self.basic_header['ChannelCount'] * DATA_BYTE_SIZE, 1)
+
+        return output
+
+    def getscalefactors(self, elec_ids=ELEC_ID_DEF):
+        """
+        Returns the factors that convert raw data to analog units (e.g., uV).
+        :param elec_ids: List of elec_ids (e.g., [13]), in the order the factors are to be returned
+        :return: numpy array of the float factor for each elec_id
+        """
+        all_elec_ids = self._all_elec_ids()
+        if elec_ids == ELEC_ID_DEF:
+            elec_ids = all_elec_ids
+        else:
+            elec_ids = check_elecid(elec_ids)
+
+        if self.basic_header['FileSpec'] == '2.1':
+            return np.ones(len(elec_ids)) * UV_PER_BIT_21
+        return np.array([getdigfactor(self.extended_headers, all_elec_ids.index(e)) for e in elec_ids])
+
+    def iterdata(self, elec_ids=ELEC_ID_DEF, start_idx=0, stop_idx=None, block_size=DATA_BLOCK_SAMPLES):
+        """
+        Iterates over the continuous data of the NSx datafile in blocks of raw samples.
+
+        Samples are indexed and laid out as in the output of getdata(): periods of file pausing are filled with zeros
+        and a data packet that starts before the end of the previous one (e.g., after syncing two NSPs) overwrites it.
+        Only one block is held in memory at a time and no scaling is applied; multiply a block by
+        getscalefactors(elec_ids)[:, None] to convert it to analog units.
+        :param elec_ids: List of elec_ids to extract (e.g., [13]), in the order they are returned
+        :param start_idx: Index of the first sample to return (e.g., 30000)
+        :param stop_idx: Index after the last sample to return, defaults to the end of the data
+        :param block_size: Maximum number of samples in each block
+        :return: generator of int16 numpy arrays of shape (len(elec_ids), samples in block)
+        """
+        all_elec_ids = self._all_elec_ids()
+        if elec_ids == ELEC_ID_DEF:
+            elec_ids = all_elec_ids
+        else:
+            elec_ids = check_elecid(elec_ids)
+        missing_elec_ids = [e for e in elec_ids if e not in all_elec_ids]
+        if missing_elec_ids:
+            raise ValueError('Channels ' + str(missing_elec_ids) + ' do not exist in the data')
+        elec_id_indices = [all_elec_ids.index(e) for e in elec_ids]
+        block_size = int(block_size)
+
+        # Locate the data of each packet: (first output sample, number of samples, file offset of the data)
+        data_headers = self.getdataheaders()
+        packets = []
+        offset = self.basic_header['BytesInHeader']
+        for header in data_headers:
+            if self.basic_header['FileSpec'] != '2.1':
+                offset += calcsize('<' + ''.join([fmt for name, fmt, fun in nsx_header_dict['data']]))
+            if header['NumDataPoints'] > 0:
+                packets.append((int(round(header['Timestamp'] / self.basic_header['Period'])),
+                                header['NumDataPoints'], offset))
+            offset += header['NumDataPoints'] * self.basic_header['ChannelCount'] * DATA_BYTE_SIZE
+
+        if stop_idx is None:
+            stop_idx = int(ceil(data_headers[-1]['Timestamp'] / self.basic_header['Period'])) + \
+                       data_headers[-1]['NumDataPoints']
+
+        for block_start in range(int(start_idx), int(stop_idx), block_size):
+            block_stop = min(block_start + block_size, int(stop_idx))
+            block = np.zeros((len(elec_ids), block_stop - block_start), dtype=np.int16)
+            for packet_start, num_pts, packet_offset in packets:
+                first = max(block_start, packet_start)
+                last = min(block_stop, packet_start + num_pts)
+                if first >= last:
+                    continue
+                shape = (last - first, self.basic_header['ChannelCount'])
+                mm = np.memmap(self.datafile, dtype=np.int16, mode='r', shape=shape,
+                               offset=packet_offset + (first - packet_start) * shape[1] * DATA_BYTE_SIZE)
+                block[:, first - block_start:last - block_start] = mm[:, elec_id_indices].T
+                del mm
+            yield block
@@ -3,17 +3,22 @@ import re
 import json
 import traceback
 import shutil
+import gzip
 
 import fileutil
 from .log import logger
-from .configuration import paths
-from .exc import ProcessingError
+from .configuration import config, paths
+from .exc import ProcessingError, ConfigurationError
+from .viewers.recarray import iter_json, to_npy, GZIP_SUFFIX
 
 try:
     from ptsa.data.readers import BaseEventReader
 except:
     logger.warn('PTSA NOT LOADED')
 
+EVENTS_JSON_FORMATS = ('indented', 'compact', 'gzip')
+
+
 class PipelineTask(object):
     """Base class for running tasks in a pipeline.
 
@@ -33,12 +38,65 @@ class PipelineTask(object):
     def set_pipeline(self, pipeline):
         self.pipeline = pipeline
 
-    def create_file(self, filename, contents, label, index_file=True):
-        with fileutil.open_with_perms(os.path.join(self.destination, filename), 'w') as f:
-            f.write(contents)
+    def create_file(self, filename, contents, label, index_file=True, compress=False):
+        """
+        Writes a file to the destination, and registers it in the index
+        :param contents: the string to write, or an iterable of strings to be written one after another
+        :param compress: whether to gzip the file as it is written
+        """
+        with fileutil.open_with_perms(os.path.join(self.destination, filename), 'wb' if compress else 'w') as f:
+            if compress:
+                f = gzip.GzipFile(fileobj=f, mode='wb')
+            if isinstance(contents, basestring):
+                f.write(contents)
+            else:
+                for chunk in contents:
+                    f.write(chunk)
+            if compress:
+                f.close()
         if index_file:
             self.pipeline.register_output(filename, label)
 
+    def create_events_file(self, events, event_label, json_format=None, write_npy=None):
+        """
+        Writes events to <event_label>_events.json in the format set by the events_json option: indented (the
+        default), compact, or gzip, which writes compact JSON to <event_label>_events.json.gz.
+        Files are registered under the same label in either case, and viewers.recarray.from_json reads any of them.
+        If the events_json write_npy option is set, the events are also written to <event_label>_events.npy
+        :param events: the recarray to write
+        :param event_label: e.g. 'task' or 'math'
+        :param json_format: overrides the format set by the events_json option
+        :param write_npy: overrides the write_npy events_json option
+        :return: the name of the file that was written
+        """
+        if json_format is None:
+            json_format = config.events_json.format
+        if write_npy is None:
+            write_npy = str(config.events_json.write_npy).lower() in ('true', 'yes', '1')
+        if json_format not in EVENTS_JSON_FORMATS:
+            raise ConfigurationError('Unknown events_json format {}. Valid formats are {}'.format(
+                json_format, ', '.join(EVENTS_JSON_FORMATS)))
+        filename = '{}_events.json'.format(event_label)
+        if json_format == 'gzip':
+            filename += GZIP_SUFFIX
+        self.create_file(filename, iter_json(events, compact=json_format != 'indented'),
+                         '{}_events'.format(event_label), compress=json_format == 'gzip')
+        if write_npy:
+            self.create_npy_file(events, event_label)
+        return filename
+
+    def create_npy_file(self, events, event_label):
+        """
+        Writes events to <event_label>_events.npy with their structured dtype, so that they can be memory-mapped with
+        viewers.recarray.from_npy rather than parsed from JSON
+        :param events: the recarray to write
+        :param event_label: e.g. 'task' or 'math'
+        """
+        filename = '{}_events.npy'.format(event_label)
+        with fileutil.open_with_perms(os.path.join(self.destination, filename), 'wb') as f:
+            to_npy(events, f)
+        self.pipeline.register_output(filename, '{}_events_npy'.format(event_label))
+
     def run(self, files, db_folder):
         self.destination = db_folder
         try:
@@ -1,6 +1,8 @@
 import pprint
 import numpy as np
 import json
+import gzip
+import os
 import numpy
 import unicodedata
 from collections import defaultdict
@@ -97,11 +99,76 @@ class MyEncoder(json.JSONEncoder):
         else:
             return super(MyEncoder, self).default(obj)
 
-def to_json(arr, fp=None):
+# Number of events converted to dictionaries at a time when writing JSON
+JSON_CHUNK_SIZE = 1000
+
+GZIP_SUFFIX = '.gz'
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def iter_json(arr, chunk_size=JSON_CHUNK_SIZE, compact=False):
+    """
+    Encodes a recarray as JSON a chunk of records at a time, so that the whole dictionary tree is never held in memory.
+    The concatenated output is identical to json.dumps(to_dict(arr), cls=MyEncoder, indent=2, sort_keys=True), or
+    with compact=True to json.dumps(to_dict(arr), cls=MyEncoder, separators=(',', ':'), sort_keys=True)
+    :param arr: the recarray to encode
+    :param chunk_size: the number of records to convert at a time
+    :param compact: whether to leave out all whitespace
+    :return: generator of strings which together make up the JSON document
+    """
+    if compact:
+        encoder = MyEncoder(separators=(',', ':'), sort_keys=True)
+    else:
+        encoder = MyEncoder(indent=2, sort_keys=True)
+    if arr.ndim == 0:
+        yield encoder.encode(to_dict(arr))
+        return
+
+    first = True
+    for start in range(0, len(arr), chunk_size):
+        for entry in to_dict(arr[start:start + chunk_size]):
+            if compact:
+                yield ('[' if first else encoder.item_separator) + encoder.encode(entry)
+            else:
+                # Each record is one level deeper than it would be on its own
+                yield ('[' if first else encoder.item_separator) + '\n  ' + encoder.encode(entry).replace('\n', '\n  ')
+            first = False
+    if first:
+        yield '[]'
+    else:
+        yield ']' if compact else '\n]'
+
+
+def to_json(arr, fp=None, compact=False):
     if fp:
-        json.dump(to_dict(arr), fp, cls=MyEncoder, indent=2, sort_keys=True)
+        for chunk in iter_json(arr, compact=compact):
+            fp.write(chunk)
     else:
-        return json.dumps(to_dict(arr), cls=MyEncoder, indent=2, sort_keys=True)
+        return ''.join(iter_json(arr, compact=compact))
+
+def to_npy(arr, fp):
+    """
+    Writes a recarray to a .npy file with its structured dtype, dropping the records and field that to_dict drops
+    :param arr: the recarray to write
+    :param fp: filename or open binary file to write to
+    """
+    if arr.dtype.names and '_remove' in arr.dtype.names:
+        names = [name for name in arr.dtype.names if name != '_remove']
+        kept = arr[~arr['_remove'].astype(bool)] if arr.ndim > 0 else arr
+        arr = np.zeros(kept.shape, [(name, arr.dtype[name]) for name in names])
+        for name in names:
+            arr[name] = kept[name]
+    np.save(fp, arr.view(np.ndarray))
+
+def from_npy(npy_filename, mmap_mode='r'):
+    """
+    Loads a recarray written by to_npy. By default the file is memory-mapped read-only, so records are only
+    read from disk as they are accessed
+    :param npy_filename: path to the .npy file
+    :param mmap_mode: passed to np.load; None reads the whole file into memory
+    :return: the recarray
+    """
+    return np.load(npy_filename, mmap_mode=mmap_mode).view(np.recarray)
 
 def get_element_dtype(element):
     if isinstance(element, dict):
@@ -130,8 +197,36 @@ def mkdtype(d):
 
     return np.dtype(dtype)
 
+def open_json(json_filename):
+    """
+    Opens a JSON file for reading whether or not it was written with gzip, which is detected from the file's
+    contents. If json_filename does not exist but a gzipped copy with the .gz suffix does, that is opened instead
+    :param json_filename: path to the JSON file
+    :return: the open file
+    """
+    if not os.path.exists(json_filename) and os.path.exists(json_filename + GZIP_SUFFIX):
+        json_filename += GZIP_SUFFIX
+    with open(json_filename, 'rb') as f:
+        is_gzip = f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    return gzip.open(json_filename) if is_gzip else open(json_filename)
+
+def detect_json_format(json_filename):
+    """
+    :param json_filename: path to the JSON file, as passed to open_json
+    :return: the format of the file open_json opens for json_filename: indented, compact, or gzip
+    """
+    f = open_json(json_filename)
+    try:
+        if isinstance(f, gzip.GzipFile):
+            return 'gzip'
+        start = f.read(2)
+    finally:
+        f.close()
+    return 'indented' if start[1:] == '\n' else 'compact'
+
 def from_json_old(json_filename):
-    d = json.load(open(json_filename))
+    with open_json(json_filename) as f:
+        d = json.load(f)
     if not isinstance(d, list):
         d = [d]
     dt = mkdtype(d[0])
@@ -145,7 +240,8 @@ def from_jsons(jsons):
     return from_dict(d)
 
 def from_json(json_filename):
-    d = json.load(open(json_filename))
+    with open_json(json_filename) as f:
+        d = json.load(f)
     return from_dict(d)
 
 def from_dict(d,dtypes=None):
@@ -184,6 +280,13 @@ def from_dict(d,dtypes=None):
     return arr.view(np.recarray)
 
 def copy_values(dict_list, rec_arr, list_info=None):
+    """
+    Copies a list of dictionaries into a record array with one element per dictionary, filling a field at a time.
+    Fields which are missing from some dictionaries, or cannot be assigned as a column, are copied element by element.
+    :param dict_list: the dictionaries to copy
+    :param rec_arr: the record array to copy them into
+    :param list_info: {key: {'len': ..., 'dtype': ...}} for the fields that hold lists, as built by from_dict
+    """
     if len(dict_list) == 0:
         return
 
@@ -192,34 +295,87 @@ def copy_values(dict_list, rec_arr, list_info=None):
         if isinstance(v, dict):
             dict_fields[k] = [inner_dict[k] for inner_dict in dict_list]
 
-    for i, sub_dict in enumerate(dict_list):
-        for k, v in sub_dict.items():
-            if k in dict_fields or  list_info and k in list_info:
-                continue
-
-            if isinstance(v, dict):
-                copy_values([v], rec_arr[i][k])
-            elif isinstance(v, basestring):
-                rec_arr[i][k] = strip_accents(v)
-            else:
-                rec_arr[i][k] = v
-
-    for i, sub_dict in enumerate(dict_list):
-        for k,v in sub_dict.items():
-            if list_info and k in list_info:
-                arr = np.zeros(list_info[k]['len'], list_info[k]['dtype'])
-                if len(v) > 0:
-                    if isinstance(v[0], dict):
-                        copy_values(v, arr)
-                    else:
-                        for j, element in enumerate(v):
-                            arr[j] = element
-
-                rec_arr[i][k] = arr.view(np.recarray)
+    keys = set()
+    for sub_dict in dict_list:
+        keys.update(sub_dict)
+
+    for k in keys:
+        if k in dict_fields or list_info and k in list_info:
+            continue
+        try:
+            values = [sub_dict[k] for sub_dict in dict_list]
+        except KeyError:
+            values = None
+        if values is None or any(isinstance(v, dict) for v in values) or not _copy_column(rec_arr, k, values):
+            _copy_field_by_element(dict_list, rec_arr, k)
+
+    if list_info:
+        for k in keys:
+            if k in list_info:
+                _copy_list_field(dict_list, rec_arr, k, list_info[k])
 
     for k, v in dict_fields.items():
         copy_values( v, rec_arr[k])
 
+
+def _copy_column(rec_arr, k, values):
+    """
+    Assigns a whole field at once, stripping accents from strings as copy_values does
+    :return: True if the values could be assigned
+    """
+    stripped = {}
+    column = []
+    for v in values:
+        if isinstance(v, basestring):
+            if v not in stripped:
+                stripped[v] = strip_accents(v)
+            v = stripped[v]
+        column.append(v)
+    try:
+        rec_arr[k] = column
+    except (ValueError, TypeError):
+        return False
+    return True
+
+
+def _copy_field_by_element(dict_list, rec_arr, k):
+    for i, sub_dict in enumerate(dict_list):
+        if k not in sub_dict:
+            continue
+        v = sub_dict[k]
+        if isinstance(v, dict):
+            copy_values([v], rec_arr[k][i:i + 1])
+        elif isinstance(v, basestring):
+            rec_arr[i][k] = strip_accents(v)
+        else:
+            rec_arr[i][k] = v
+
+
+def _copy_list_field(dict_list, rec_arr, k, info):
+    """
+    Copies a field holding lists of (possibly different) lengths up to info['len'], one list position at a time
+    """
+    lengths = np.array([len(sub_dict[k]) if k in sub_dict else 0 for sub_dict in dict_list])
+    field = rec_arr[k]
+    if field.ndim == 1:
+        field = field[:, np.newaxis]
+    for j in range(info['len']):
+        rows = np.nonzero(lengths > j)[0]
+        if len(rows) == 0:
+            break
+        elements = [dict_list[i][k][j] for i in rows]
+        column = np.zeros(len(rows), info['dtype'])
+        if isinstance(elements[0], dict):
+            copy_values(elements, column)
+        else:
+            try:
+                column[:] = elements
+            except (ValueError, TypeError):
+                for row, element in enumerate(elements):
+                    column[row] = element
+        field[rows, j] = column
+
+
 def strip_accents(s):
     try:
         return str(''.join(c for c in unicodedata.normalize('NFD', unicode(s))
@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import pytest
+
+from ..submission.alignment import fit_plots
+from ..submission.alignment.fit_plots import save_fit, plot_saved_fit
+from ..submission.alignment.system2 import System2TaskAligner
+
+
+def test_save_fit_without_plotting(tmpdir, monkeypatch):
+    monkeypatch.setattr(fit_plots.config, 'show_plots', False, raising=False)
+    x = np.arange(100.)
+    y = 2 * x + 1 + np.tile([-.5, .5], 50)
+
+    fit_file = save_fit(x, y, (2., 1., .99, 0., 0.), str(tmpdir), 'task_host')
+
+    assert os.listdir(str(tmpdir)) == ['task_host_fit.npz']
+    saved = np.load(fit_file)
+    assert (saved['coefficients'] == [2., 1.]).all()
+    assert np.allclose(saved['residuals'], np.tile([-.5, .5], 50))
+
+
+def test_plot_saved_fit(tmpdir, monkeypatch):
+    matplotlib = pytest.importorskip('matplotlib')
+    matplotlib.use('agg')
+    monkeypatch.setattr(fit_plots.config, 'show_plots', False, raising=False)
+    fit_file = save_fit(np.arange(10.), np.arange(10.) * 2, (2., 0.), str(tmpdir), 'host_np')
+
+    plot_files = plot_saved_fit(fit_file)
+
+    assert [os.path.basename(f) for f in plot_files] == ['host_np_fit.png', 'host_np_residuals.png']
+    assert all(os.path.exists(f) for f in plot_files)
+
+
+def test_plot_saved_fits(tmpdir, monkeypatch):
+    matplotlib = pytest.importorskip('matplotlib')
+    matplotlib.use('agg')
+    monkeypatch.setattr(fit_plots.config, 'show_plots', False, raising=False)
+    for label in ('task_host', 'host_np', 'multi_ns2'):
+        System2TaskAligner.plot_fit(np.arange(10.), np.arange(10.) * 2, (2., 0.), str(tmpdir), label)
+    tmpdir.join('task_host.npz').write('')
+
+    plot_files = System2TaskAligner.plot_saved_fits(str(tmpdir))
+
+    assert [os.path.basename(f) for f in plot_files] == [
+        'host_np_fit.png', 'host_np_residuals.png', 'multi_ns2_fit.png', 'multi_ns2_residuals.png',
+        'task_host_fit.png', 'task_host_residuals.png']
+    assert all(os.path.exists(f) for f in plot_files)
@@ -0,0 +1,89 @@
+import bz2
+import os
+
+import pytest
+
+from ..submission.exc import EEGError, DecompressionError
+from ..submission.readers import eeg_reader
+from ..submission.readers.eeg_reader import _decompress_bz2, decompressed_raw_file, EGI_reader, EGI_reader_new, \
+    BDF_reader, BDF_reader_new
+
+CONTENTS = [os.urandom(5000), b'\0' * 20000, os.urandom(3)]
+
+
+@pytest.fixture
+def archive(tmpdir):
+    """ A multi-stream archive, as written by pbzip2 """
+    filename = str(tmpdir.join('session.raw.bz2'))
+    with open(filename, 'wb') as f:
+        for contents in CONTENTS:
+            f.write(bz2.compress(contents))
+    return filename
+
+
+@pytest.mark.parametrize('block_size', [1, 100, 4096, 10 ** 6])
+def test_decompress_multi_stream(archive, tmpdir, block_size):
+    destination = str(tmpdir.join('session.raw'))
+    _decompress_bz2(archive, destination, block_size)
+
+    with open(destination, 'rb') as f:
+        assert f.read() == b''.join(CONTENTS)
+
+
+@pytest.mark.parametrize('truncate', [1, 20])
+def test_decompress_truncated(archive, tmpdir, truncate):
+    with open(archive, 'rb') as f:
+        compressed = f.read()
+    with open(archive, 'wb') as f:
+        f.write(compressed[:-truncate])
+
+    with pytest.raises(DecompressionError):
+        _decompress_bz2(archive, str(tmpdir.join('decompressed.raw')), 4096)
+    with pytest.raises(DecompressionError):
+        with decompressed_raw_file(archive):
+            pass
+
+
+def test_decompress_corrupt(archive):
+    with open(archive, 'r+b') as f:
+        f.seek(20)
+        f.write(b'\0' * 20)
+
+    with pytest.raises(DecompressionError):
+        with decompressed_raw_file(archive):
+            pass
+
+
+def fail_to_parse(*args, **kwargs):
+    raise EEGError('Not an EEG file')
+
+
+class UnparseableMne(object):
+    class io(object):
+        read_raw_egi = staticmethod(fail_to_parse)
+        read_raw_edf = staticmethod(fail_to_parse)
+
+
+@pytest.mark.parametrize('reader_class, unzip_message, reraises', [
+    (EGI_reader_new, 'Unzipping failed! Unable to read data file!', False),
+    (EGI_reader, 'Unzipping failed! Unable to parse data file!', False),
+    (BDF_reader_new, 'Unzipping failed! Unable to read data file!', False),
+    (BDF_reader, 'Unzipping failed! Unable to parse data file!', True),
+])
+def test_get_data_reports_parse_errors(archive, monkeypatch, reader_class, unzip_message, reraises):
+    critical = []
+    monkeypatch.setattr(eeg_reader.logger, 'critical', critical.append)
+    monkeypatch.setattr(eeg_reader, 'mne', UnparseableMne)
+
+    if reraises:
+        with pytest.raises(EEGError):
+            reader_class(archive).get_data()
+    else:
+        reader_class(archive).get_data()
+    assert critical == ['Unable to parse EEG data file!']
+
+    with open(archive, 'wb') as f:
+        f.write(b'BZh9')
+    critical[:] = []
+    reader_class(archive).get_data()
+    assert critical == [unzip_message]
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from ..submission.viewers.recarray import copy_values, _copy_column, _copy_field_by_element, _copy_list_field, \
+    strip_accents, mkdtype, get_element_dtype
+
+
+def legacy_copy_values(dict_list, rec_arr, list_info=None):
+    """ copy_values as it was before it copied a field at a time, assigning each field of each element in turn """
+    if len(dict_list) == 0:
+        return
+
+    dict_fields = {}
+    for k, v, in dict_list[0].items():
+        if isinstance(v, dict):
+            dict_fields[k] = [inner_dict[k] for inner_dict in dict_list]
+
+    for i, sub_dict in enumerate(dict_list):
+        for k, v in sub_dict.items():
+            if k in dict_fields or list_info and k in list_info:
+                continue
+
+            if isinstance(v, dict):
+                legacy_copy_values([v], rec_arr[i][k])
+            elif isinstance(v, basestring):
+                rec_arr[i][k] = strip_accents(v)
+            else:
+                rec_arr[i][k] = v
+
+    for i, sub_dict in enumerate(dict_list):
+        for k, v in sub_dict.items():
+            if list_info and k in list_info:
+                arr = np.zeros(list_info[k]['len'], list_info[k]['dtype'])
+                if len(v) > 0:
+                    if isinstance(v[0], dict):
+                        legacy_copy_values(v, arr)
+                    else:
+                        for j, element in enumerate(v):
+                            arr[j] = element
+
+                rec_arr[i][k] = arr.view(np.recarray)
+
+    for k, v in dict_fields.items():
+        legacy_copy_values(v, rec_arr[k])
+
+
+def make_dicts():
+    """ Scalar fields (one of them missing from some events), a nested record, a list of numbers and a list of records """
+    dicts = []
+    for i in range(20):
+        event = {'type': u'WORD' if i % 2 else u'REC_WORD', 'mstime': 1000 * i, 'rectime': 1.5 * i,
+                 'item_name': u'CAFÉ' if i % 3 else u'ITEM{}'.format(i),
+                 'location': {'region': u'Hippocampus', 'x': float(i), 'stereo': {'side': u'L', 'depth': i}},
+                 'test': [i, 2 * i, 3 * i][:i % 4],
+                 'stim_params': [{'amplitude': 0.5 * i, 'anode_label': u'LA{}'.format(i)}] * (i % 3)}
+        if i % 5:
+            event['recalled'] = i % 2
+        dicts.append(event)
+    return dicts
+
+
+def make_array(dicts, missing_fields=()):
+    list_info = {'test': {'len': 3, 'dtype': np.int64},
+                 'stim_params': {'len': 2, 'dtype': mkdtype(dicts[1]['stim_params'][0])}}
+    dtypes = [(str(k), get_element_dtype(v)) for k, v in dicts[1].items() if k not in list_info]
+    dtypes += [(k, info['dtype'], info['len']) for k, info in list_info.items()]
+    dtypes += [(k, np.int64) for k in missing_fields]
+    return np.zeros(len(dicts), dtypes).view(np.recarray), list_info
+
+
+def assert_same_array(arr, expected):
+    assert arr.dtype == expected.dtype
+    assert arr.tobytes() == expected.tobytes()
+
+
+def test_copy_values_matches_legacy():
+    dicts = make_dicts()
+    arr, list_info = make_array(dicts)
+    expected, _ = make_array(dicts)
+
+    copy_values(dicts, arr, list_info)
+    legacy_copy_values(dicts, expected, list_info)
+
+    assert_same_array(arr, expected)
+    assert (arr.item_name[1:3] == 'CAFE').all()
+    assert (arr.recalled[::5] == 0).all()
+    assert (arr.location.stereo.depth == np.arange(20)).all()
+
+
+def test_copy_column():
+    dicts = make_dicts()
+    arr, _ = make_array(dicts)
+    expected, _ = make_array(dicts)
+    for i, d in enumerate(dicts):
+        expected[i]['mstime'] = d['mstime']
+        expected[i]['item_name'] = strip_accents(d['item_name'])
+
+    assert _copy_column(arr, 'mstime', [d['mstime'] for d in dicts])
+    assert _copy_column(arr, 'item_name', [d['item_name'] for d in dicts])
+    assert_same_array(arr, expected)
+
+    # Values that do not fit the field are left for the caller to copy element by element
+    assert not _copy_column(arr, 'mstime', [[1, 2]] * len(dicts))
+
+
+@pytest.mark.parametrize('field', ['recalled', 'location', 'item_name'])
+def test_copy_field_by_element(field):
+    dicts = make_dicts()
+    arr, _ = make_array(dicts)
+    expected, _ = make_array(dicts)
+    legacy_copy_values([{field: d[field]} if field in d else {} for d in dicts], expected)
+
+    _copy_field_by_element(dicts, arr, field)
+
+    assert_same_array(arr, expected)
+
+
+@pytest.mark.parametrize('field', ['test', 'stim_params'])
+def test_copy_list_field(field):
+    dicts = make_dicts()
+    arr, list_info = make_array(dicts)
+    expected, _ = make_array(dicts)
+    legacy_copy_values([{field: d[field]} for d in dicts], expected, {field: list_info[field]})
+
+    _copy_list_field(dicts, arr, field, list_info[field])
+
+    assert_same_array(arr, expected)
+    assert (arr[field][0] == np.zeros(1, arr[field].dtype)).all()
+
+
+def test_copy_values_with_missing_fields():
+    dicts = make_dicts()
+    arr, list_info = make_array(dicts, missing_fields=('answer',))
+    expected, _ = make_array(dicts, missing_fields=('answer',))
+    dicts[4]['answer'] = 12
+
+    copy_values(dicts, arr, list_info)
+    legacy_copy_values(dicts, expected, list_info)
+
+    assert_same_array(arr, expected)
+    assert list(arr.answer.nonzero()[0]) == [4]
@@ -0,0 +1,252 @@
+import datetime
+import json
+import os
+import struct
+import time
+
+import numpy as np
+import pytest
+
+from ..submission.readers import eeg_reader
+from ..submission.readers.nsx_utility import brpylib
+from ..submission.readers.eeg_reader import NK_reader, NSx_reader, EGI_reader, BDF_reader, HD5_reader, EDF_reader
+
+
+class ReadTracker(object):
+    """
+    Wraps an open file, recording the (start, end) byte range of every read made through it
+    """
+
+    def __init__(self, f, ranges):
+        self._f = f
+        self.ranges = ranges
+
+    def read(self, *args):
+        start = self._f.tell()
+        out = self._f.read(*args)
+        self.ranges.append((start, start + len(out)))
+        return out
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._f.close()
+
+
+@pytest.fixture
+def read_ranges(monkeypatch):
+    """ Tracks the byte ranges read from every file opened by the EEG readers """
+    ranges = []
+
+    def tracked_open(*args, **kwargs):
+        return ReadTracker(open(*args, **kwargs), ranges)
+
+    def tracked_openfilecheck(open_mode, file_name='', **kwargs):
+        return ReadTracker(open(file_name, open_mode), ranges)
+
+    monkeypatch.setattr(eeg_reader, 'open', tracked_open, raising=False)
+    monkeypatch.setattr(brpylib, 'openfilecheck', tracked_openfilecheck)
+    return ranges
+
+
+def assert_not_read(ranges, data_start, data_end):
+    assert ranges, 'No reads were tracked'
+    for start, end in ranges:
+        assert end <= data_start or start >= data_end, \
+            'Bytes {}-{} of the data section {}-{} were read'.format(start, end, data_start, data_end)
+
+
+def bcd(n):
+    return (n // 10) * 16 + n % 10
+
+
+def write_nk(filename, n_channels, n_samples, n_written=None):
+    """ Writes an old-format Nihon Kohden .EEG file at 1000 Hz, returning the offset of the waveform data """
+    n_written = n_samples if n_written is None else n_written
+    with open(filename, 'wb') as f:
+        f.write(b'\0' * 128)
+        f.write(b'\0' + b'EEG-1100A'.ljust(16, b' ') + struct.pack('<Bi', 1, 200) + b'\0' * 16)
+        f.write(b'\0' * (200 - f.tell()))
+        f.write(b'\0' + b'\0' * 16 + struct.pack('<Bi', 1, 300) + b'\0' * 16)
+        f.write(b'\0' * (300 - f.tell()))
+        f.write(b'\0' + b'\0' * 16 + b'\0' + struct.pack('<BB', 2, 1))
+        f.write(struct.pack('<6B', *[bcd(x) for x in (17, 3, 14, 15, 9, 26)]))
+        f.write(struct.pack('<HIhHBBB', 0xC3E8, n_samples // 100, 0, 1, 16, 0, n_channels))
+        for i in range(n_channels):
+            f.write(struct.pack('<h', i) + b'\0' * 6 + struct.pack('<BB', 0, 0))
+        data_start = f.tell()
+        np.zeros((n_written, n_channels + 1), '<i2').tofile(f)
+    return data_start
+
+
+def test_nk_header_info(tmpdir, read_ranges):
+    filename = str(tmpdir.join('test.EEG'))
+    data_start = write_nk(filename, 4, 5000)
+
+    info = NK_reader(filename).read_header_info()
+
+    assert info['start_time'] == datetime.datetime(2017, 3, 14, 15, 9, 26)
+    assert info['sample_rate'] == 1000
+    assert info['n_samples'] == 5000
+    assert_not_read(read_ranges, data_start, os.path.getsize(filename))
+
+
+def test_nk_header_info_truncated(tmpdir, read_ranges):
+    filename = str(tmpdir.join('test.EEG'))
+    data_start = write_nk(filename, 4, 5000, n_written=3000)
+
+    assert NK_reader(filename).get_n_samples() == 3000
+    assert_not_read(read_ranges, data_start, os.path.getsize(filename))
+
+
+def test_nsx_header_info(tmpdir, read_ranges):
+    filename = str(tmpdir.join('test.ns2'))
+    n_channels = 3
+    segments = [(0, 100), (300, 2000)]
+    data_ranges = []
+    with open(filename, 'wb') as f:
+        f.write(b'NEURALCD' + struct.pack('<2BI', 2, 2, 314 + 66 * n_channels))
+        f.write(b'label'.ljust(16, b'\0') + b'\0' * 256)
+        f.write(struct.pack('<II', 30, 30000))
+        f.write(struct.pack('<8H', 2017, 3, 2, 14, 15, 9, 26, 0))
+        f.write(struct.pack('<I', n_channels))
+        for elec_id in range(1, n_channels + 1):
+            f.write(b'CC' + struct.pack('<H', elec_id) + b'elec'.ljust(16, b'\0'))
+            f.write(struct.pack('<BBhhhh', 1, elec_id, -32764, 32764, -8191, 8191))
+            f.write(b'uV'.ljust(16, b'\0') + struct.pack('<IIHIIH', 0, 0, 0, 0, 0, 0))
+        for timestamp, n_samples in segments:
+            f.write(struct.pack('<BII', 1, timestamp, n_samples))
+            data_ranges.append((f.tell(), f.tell() + n_samples * n_channels * 2))
+            np.zeros((n_samples, n_channels), '<i2').tofile(f)
+
+    reader = NSx_reader(filename)
+    info = reader.read_header_info()
+
+    assert info['start_time'] == datetime.datetime(2017, 3, 14, 15, 9, 26)
+    assert info['sample_rate'] == 1000
+    assert info['n_samples'] == 2000
+    for data_start, data_end in data_ranges:
+        assert_not_read(read_ranges, data_start, data_end)
+
+
+def test_egi_header_info(tmpdir, read_ranges):
+    filename = str(tmpdir.join('test.raw'))
+    n_channels, n_events, n_samples = 129, 2, 1000
+    with open(filename, 'wb') as f:
+        f.write(struct.pack('>i6hi5hih', 2, 2017, 3, 14, 15, 9, 26, 0, 500, n_channels, 0, 0, 0, n_samples, n_events))
+        f.write(b'DIN1STIM')
+        data_start = f.tell()
+        np.zeros((n_samples, n_channels + n_events), '>i2').tofile(f)
+
+    info = EGI_reader(filename).read_header_info()
+
+    local_time = datetime.datetime(2017, 3, 14, 15, 9, 26)
+    meas_date = np.array([time.mktime(local_time.timetuple())], dtype=np.float32)
+    assert info['start_time'] == datetime.datetime.utcfromtimestamp(float(meas_date[0]))
+    assert info['sample_rate'] == 500
+    assert info['n_samples'] == n_samples
+    assert_not_read(read_ranges, data_start, os.path.getsize(filename))
+
+
+@pytest.mark.parametrize('timezone, expected', [
+    ('UTC', datetime.datetime(2017, 3, 14, 15, 8, 48)),
+    ('EST5EDT', datetime.datetime(2017, 3, 14, 19, 9, 52)),
+])
+def test_egi_start_time_matches_mne(tmpdir, monkeypatch, timezone, expected):
+    """ Start times are those MNE 0.14 gave as meas_date, including the rounding of its float32 timestamp """
+    monkeypatch.setenv('TZ', timezone)
+    time.tzset()
+    try:
+        filename = str(tmpdir.join('test.raw'))
+        with open(filename, 'wb') as f:
+            f.write(struct.pack('>i6hi5hih', 2, 2017, 3, 14, 15, 9, 26, 0, 500, 1, 0, 0, 0, 0, 0))
+        assert EGI_reader(filename).read_header_info()['start_time'] == expected
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def test_bdf_header_info(tmpdir, read_ranges):
+    filename = str(tmpdir.join('test.bdf'))
+    n_channels, n_records, samples_per_record = 3, 10, 512
+    header_bytes = 256 * (n_channels + 1)
+
+    def field(value, width):
+        return str(value).ljust(width).encode('ascii')
+
+    with open(filename, 'wb') as f:
+        f.write(b'\xffBIOSEMI' + field('', 160) + field('14.03.17', 8) + field('15.09.26', 8))
+        f.write(field(header_bytes, 8) + field('24BIT', 44) + field(n_records, 8) + field(1, 8) + field(n_channels, 4))
+        f.write(field('', 216 * n_channels))
+        f.write(b''.join(field(samples_per_record, 8) for _ in range(n_channels)))
+        f.write(field('', 32 * n_channels))
+        f.write(b'\0' * (3 * n_channels * n_records * samples_per_record))
+
+    info = BDF_reader(filename).read_header_info()
+
+    assert info['start_time'] == datetime.datetime(2017, 3, 14, 15, 9, 26)
+    assert info['sample_rate'] == 512
+    assert info['n_samples'] == n_records * samples_per_record
+    assert_not_read(read_ranges, header_bytes, os.path.getsize(filename))
+
+
+def test_hd5_header_info(tmpdir, monkeypatch):
+    tables = pytest.importorskip('tables')
+    filename = str(tmpdir.join('eeg_timeseries.h5'))
+    config_filename = str(tmpdir.join('experiment_config.json'))
+    with open(config_filename, 'w') as f:
+        json.dump({'global_settings': {'sampling_rate': 1000}}, f)
+    with tables.open_file(filename, 'w') as h5file:
+        h5file.create_array('/', 'start_ms', np.array([1489504166000]))
+        timeseries = h5file.create_array('/', 'timeseries', np.zeros((2500, 4), 'int16'))
+        timeseries.attrs['orient'] = 'row'
+
+    read_nodes = []
+    original_read = tables.Array.read
+    original_getitem = tables.Array.__getitem__
+
+    def tracked_read(self, *args, **kwargs):
+        read_nodes.append(self.name)
+        return original_read(self, *args, **kwargs)
+
+    def tracked_getitem(self, key):
+        read_nodes.append(self.name)
+        return original_getitem(self, key)
+
+    monkeypatch.setattr(tables.Array, 'read', tracked_read)
+    monkeypatch.setattr(tables.Array, '__getitem__', tracked_getitem)
+
+    info = HD5_reader(filename, config_filename).read_header_info()
+
+    assert info['start_time'] == datetime.datetime.utcfromtimestamp(1489504166)
+    assert info['sample_rate'] == 1000
+    assert info['n_samples'] == 2500
+    assert 'timeseries' not in read_nodes
+
+
+def test_edf_header_info(tmpdir, monkeypatch):
+    pyedflib = pytest.importorskip('pyedflib')
+    filename = str(tmpdir.join('test.edf'))
+    writer = pyedflib.EdfWriter(filename, 2)
+    writer.setStartdatetime(datetime.datetime(2017, 3, 14, 15, 9, 26))
+    writer.setSignalHeaders([{'label': 'ch%d' % i, 'dimension': 'uV', 'sample_rate': 256,
+                              'physical_max': 100, 'physical_min': -100,
+                              'digital_max': 32767, 'digital_min': -32768,
+                              'transducer': '', 'prefilter': ''} for i in range(2)])
+    writer.writeSamples([np.zeros(256 * 10) for _ in range(2)])
+    writer.close()
+
+    def fail_read(*args, **kwargs):
+        raise AssertionError('Signal data was read')
+
+    monkeypatch.setattr(pyedflib.EdfReader, 'readSignal', fail_read)
+
+    info = EDF_reader(filename).read_header_info()
+
+    assert info['start_time'] == datetime.datetime(2017, 3, 14, 15, 9, 26)
+    assert info['sample_rate'] == 256
+    assert info['n_samples'] == 256 * 10
@@ -1,4 +1,5 @@
 from ..submission.readers.eeg_reader import EDF_reader, NSx_reader, convert_nk_to_edf, NK_reader, read_text_jacksheet, EGI_reader
+from ..submission.readers.eeg_reader import _sosfiltfilt_blocks
 from ..submission.exc import EEGError
 import numpy as np
 import os
@@ -113,6 +114,41 @@ def xtest_nsx_split():
                 raise EEGError('old data does not match new data : max diff %.1f' %
                                max(abs(old_data - new_data)))
 
+
+def test_polyphase_downsample_streaming():
+    data = (np.random.RandomState(0).randn(3, 30011) * 1000).astype('int16')
+    whole, _ = NSx_reader._polyphase_downsample([data], 30000, 2000)
+    whole = np.concatenate(list(whole), 1)
+    assert whole.shape == (3, int(np.ceil(data.shape[1] / 15.)))
+    for block_size in (1, 7, 4096):
+        blocks = [data[:, i:i + block_size] for i in range(0, data.shape[1], block_size)]
+        streamed, _ = NSx_reader._polyphase_downsample(blocks, 30000, 2000)
+        np.testing.assert_allclose(np.concatenate(list(streamed), 1), whole)
+
+
+def test_blockwise_sosfiltfilt():
+    from scipy.signal import butter, sosfiltfilt
+    sos = butter(4, .1 / 250., 'highpass', output='sos')
+    data = np.random.RandomState(0).randn(4, 20011).cumsum(1)
+    whole = sosfiltfilt(sos, data, padlen=3000)
+    for block_size in (1, 777, 20011):
+        blocks = _sosfiltfilt_blocks(lambda start, stop: data[:, start:stop], data.shape[1], sos, 3000, block_size)
+        streamed = np.concatenate([block for _, block in reversed(list(blocks))], 1)
+        assert np.array_equal(streamed, whole)
+
+
+def test_polyphase_downsample_matches_filtfilt():
+    t = np.arange(30000 * 10) / 30000.
+    data = np.array([100 + 200 * np.sin(2 * np.pi * f * t) + 50 * np.sin(2 * np.pi * 3 * f * t + 1)
+                     for f in (5, 40, 120)]).astype('int16')
+    blocks = [data[:, i:i + 30000] for i in range(0, data.shape[1], 30000)]
+    new_data, new_sr = NSx_reader._polyphase_downsample(blocks, 30000, 2000)
+    new_data = np.concatenate(list(new_data), 1)
+    for channel, new_channel in zip(data, new_data):
+        old_channel, old_sr = NSx_reader._my_downsample(channel, 30000, 2000)
+        assert new_sr == old_sr
+        np.testing.assert_allclose(new_channel, old_channel, atol=1)
+
 nk_subjects = (('R1083J', 'FR1_0/RA2350UO.EEG', ''),
                ('R1008J', 'YC1_0/CA2417MP.EEG', 'R1008J_21Nov14_1037'),
                ('R1010J', 'FR1_0/CA2417SF.EEG', 'R1010J_08Dec14_1407'),
@@ -0,0 +1,89 @@
+import numpy as np
+
+from ..submission.parsers.base_log_parser import EventCombiner
+from ..submission.viewers.recarray import from_dict, to_dict
+
+
+def dict_combine(events_list, sort_field='mstime'):
+    """ EventCombiner.combine as it was before fill_defaults and copy_fields, going through a dict for each event """
+    combiner = EventCombiner(events_list, sort_field)
+    all_dict_events = []
+    for events in events_list:
+        if len(events) == 0:
+            continue
+        dict_events = to_dict(events)
+        if len(all_dict_events) > 0:
+            keys = [k for k in dict_events[0].keys() if k not in all_dict_events[0].keys()]
+            for key in keys:
+                default = combiner.get_default(dict_events[0][key])
+                for event in all_dict_events:
+                    event[key] = default
+            keys = [k for k in all_dict_events[0].keys() if k not in dict_events[0].keys()]
+            for key in keys:
+                default = combiner.get_default(all_dict_events[0][key])
+                for event in dict_events:
+                    event[key] = default
+        all_dict_events += dict_events
+    all_dict_events = sorted(all_dict_events, key=lambda d: d[sort_field])
+    dtypes = combiner.combine_dtypes([e.dtype for e in events_list])
+    return from_dict(all_dict_events, dtypes=dtypes)
+
+
+def task_events():
+    """ Fields shared with math_events, fields of their own, and stim_params of a different length """
+    return from_dict([
+        {'type': 'WORD', 'mstime': 1000 * i + 3, 'list': i // 4, 'item_name': 'ITEM{}'.format(i), 'recalled': i % 2,
+         'stim_params': [{'amplitude': 0.5 * i, 'anode_label': 'LA{}'.format(i), 'stim_on': bool(i % 2)}] * (i % 3),
+         '_remove': i == 5}
+        for i in range(12)
+    ])
+
+
+def math_events():
+    return from_dict([
+        {'type': 'PROB', 'mstime': 700 * i, 'list': i // 3, 'answer': 10 * i, 'iscorrect': i % 2 == 0,
+         'test': [i, i + 1, i + 2], 'rectime': 1.5 * i,
+         'stim_params': [{'amplitude': 0.25 * i, 'anode_label': 'LB1', 'stim_on': True}] * (i % 4)}
+        for i in range(10)
+    ])
+
+
+def assert_same_events(combined, expected):
+    assert combined.dtype == expected.dtype
+    assert len(combined) == len(expected)
+    for name in expected.dtype.names:
+        assert (combined[name] == expected[name]).all(), name
+
+
+def test_combine_matches_dict_combine():
+    events_list = [task_events(), math_events()]
+
+    combined = EventCombiner(events_list).combine()
+
+    assert_same_events(combined, dict_combine(events_list))
+    assert (np.diff(combined.mstime) >= 0).all()
+
+
+def test_combine_fills_defaults():
+    combined = EventCombiner([task_events(), math_events()]).combine()
+    words = combined[combined.type == 'WORD']
+    problems = combined[combined.type == 'PROB']
+
+    assert len(words) == 11
+    assert (words.answer == -999).all()
+    assert (words.rectime == -999).all()
+    assert (words.test == 0).all()
+    assert (problems.item_name == '').all()
+    assert (problems.recalled == -999).all()
+    # Lists are padded with empty entries
+    assert problems.stim_params.shape == (10, 3)
+    assert list(problems.stim_params['amplitude'][1]) == [0.25, 0, 0]
+    assert list(problems.stim_params['anode_label'][1]) == ['LB1', '', '']
+    assert list(words.stim_params['anode_label'][2]) == ['LA2', 'LA2', '']
+    assert (combined._remove == 0).all()
+
+
+def test_combine_skips_empty_events():
+    events_list = [task_events(), math_events()[:0], math_events()[:3]]
+
+    assert_same_events(EventCombiner(events_list).combine(), dict_combine(events_list))
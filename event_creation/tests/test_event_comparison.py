@@ -0,0 +1,174 @@
+import numpy as np
+import pytest
+
+from ..submission.parsers.base_log_parser import EventComparator, StimComparator, index_events_by_type, \
+    find_matching_events
+from ..submission.viewers.recarray import pformat_rec
+
+TYPE_SWITCH = {'WORD': ['PRACTICE_WORD'], 'REC_WORD': ['REC_WORD_VV', 'MISSING_2']}
+
+
+def make_events(types, times, time_dtype, items=None):
+    events = np.zeros(len(types), dtype=[('type', 'S16'), ('mstime', time_dtype), ('item_name', 'S16'),
+                                         ('serialpos', 'int16')]).view(np.recarray)
+    events.type = types
+    events.mstime = times
+    events.item_name = items if items is not None else ['ITEM{}'.format(i % 5) for i in range(len(types))]
+    events.serialpos = np.arange(len(types)) % 3
+    return events
+
+
+def synthetic_events(time_dtype):
+    """
+    events2 has duplicate timestamps, within and across types, and types that events1 lacks. events1 has events at,
+    just inside and just outside the tolerance of those in events2, and types that events2 lacks
+    """
+    types2 = ['WORD', 'WORD', 'WORD', 'PRACTICE_WORD', 'REC_WORD', 'REC_WORD', 'REC_WORD_VV', 'MISSING_1',
+              'DISTRACT', 'WORD']
+    times2 = [1000, 1000, 1010, 1010, 2000, 2004, 2004, 3000, 4000, 5000]
+    events2 = make_events(types2, times2, time_dtype)
+
+    offsets = [-5, -4, -3.5, 0, 3.5, 4, 4.0001, 5] if time_dtype == 'float64' else [-5, -4, -3, 0, 3, 4, 5]
+    types1, times1 = [], []
+    for event_type in ('WORD', 'REC_WORD', 'DISTRACT', 'MISSING_2', 'MATH'):
+        for time in (1000, 1010, 2000, 2004, 4000, 5000):
+            for offset in offsets:
+                types1.append(event_type)
+                times1.append(time + offset)
+    events1 = make_events(types1, times1, time_dtype)
+    return events1, events2
+
+
+def linear_scan_matches(events2, event1, types, match_field='mstime'):
+    """ How EventComparator.compare found the events close to event1 before index_events_by_type """
+    mask2 = np.zeros(len(events2), dtype=bool)
+    for this_type in types:
+        mask2 |= np.logical_and(np.abs(event1[match_field] - events2[match_field]) <= 4, this_type == events2['type'])
+    return np.nonzero(mask2)[0]
+
+
+def linear_scan_compare(comparator):
+    """ EventComparator.compare as it was before index_events_by_type, masking every event in events2 for each event """
+    found_bad = False
+    err_msg = ''
+    mask2 = np.ones(len(comparator.events2), dtype=bool)
+    for this_ignore in comparator.type_ignore:
+        mask2[comparator.events2['type'] == this_ignore] = False
+
+    bad_events1 = comparator.events1[0]
+    for i, event1 in enumerate(comparator.events1):
+        this_mask2 = np.logical_and(
+            np.abs(event1[comparator.match_field] - comparator.events2[comparator.match_field]) <= 4,
+            event1['type'] == comparator.events2['type'])
+        if event1['type'] in comparator.type_switch:
+            for this_type in comparator.type_switch[event1['type']]:
+                this_mask2 = np.logical_or(this_mask2, np.logical_and(
+                    np.abs(event1[comparator.match_field] - comparator.events2[comparator.match_field]) <= 4,
+                    this_type == comparator.events2['type']))
+
+        if not this_mask2.any() and not event1['type'] in comparator.type_ignore:
+            bad_events1 = np.append(bad_events1, event1)
+        elif event1['type'] not in comparator.type_ignore:
+            mismatches = comparator._get_field_mismatch(event1, comparator.events2[this_mask2])
+            if len(mismatches) > 0:
+                found_bad = True
+                bad_events1 = np.append(bad_events1, event1)
+                for mismatch in mismatches:
+                    err_msg += 'mismatch: %d %s\n' % (i, mismatch)
+        mask2[this_mask2] = False
+
+    if comparator.verbose:
+        if bad_events1.size > 1:
+            for bad_event1 in bad_events1[1:]:
+                if not comparator.exceptions(bad_event1, None, None):
+                    found_bad = True
+                    err_msg += '\n--1--\n' + pformat_rec(bad_event1)
+        if mask2.any():
+            for bad_event2 in comparator.events2[mask2]:
+                if not comparator.exceptions(None, bad_event2, None):
+                    found_bad = True
+                    err_msg += '\n--2--\n' + pformat_rec(bad_event2)
+
+    return found_bad, err_msg
+
+
+@pytest.mark.parametrize('time_dtype', ['int64', 'float64'])
+def test_find_matching_events_matches_linear_scan(time_dtype):
+    events1, events2 = synthetic_events(time_dtype)
+    match_index = index_events_by_type(events2, 'mstime')
+
+    assert sorted(match_index) == sorted(set(events2.type))
+    for event1 in events1:
+        types = [event1['type']] + TYPE_SWITCH.get(event1['type'], [])
+        matches = find_matching_events(match_index, event1['mstime'], types, EventComparator.MATCH_TOLERANCE)
+        assert list(matches) == list(linear_scan_matches(events2, event1, types))
+
+
+def test_find_matching_events_without_events():
+    match_index = index_events_by_type(make_events([], [], 'int64'), 'mstime')
+
+    assert match_index == {}
+    assert len(find_matching_events(match_index, 1000, ['WORD'], EventComparator.MATCH_TOLERANCE)) == 0
+
+
+@pytest.mark.parametrize('time_dtype', ['int64', 'float64'])
+@pytest.mark.parametrize('type_ignore', [None, ['DISTRACT', 'MISSING_1']])
+def test_compare_matches_linear_scan(time_dtype, type_ignore):
+    events1, events2 = synthetic_events(time_dtype)
+    # Some of the matched events differ in other fields
+    events2.item_name[[0, 4, 8]] = 'OTHER'
+
+    comparator = EventComparator(events1, events2, type_switch=TYPE_SWITCH, type_ignore=type_ignore)
+    legacy_comparator = EventComparator(events1, events2, type_switch=TYPE_SWITCH, type_ignore=type_ignore)
+
+    found_bad, err_msg = comparator.compare()
+    assert found_bad
+    assert (found_bad, err_msg) == linear_scan_compare(legacy_comparator)
+
+
+
+def make_stim_events(types, times):
+    events = np.zeros(len(types), dtype=[('type', 'S16'), ('mstime', 'int64'),
+                                         ('stim_params', [('amplitude', 'float32'), ('anode_label', 'S8')], 2)])
+    events = events.view(np.recarray)
+    events.type = types
+    events.mstime = times
+    events.stim_params['amplitude'][:, 0] = 0.5
+    events.stim_params['anode_label'][:, 0] = 'LA1'
+    return events
+
+
+def test_stim_compare_reports_mismatched_events():
+    events1 = make_stim_events(['WORD', 'STIM_ON', 'WORD', 'STIM_ON', 'STIM_ON'], [1000, 1500, 2000, 2500, 3000])
+    events2 = make_stim_events(['WORD', 'STIM_ON', 'WORD', 'STIM_ON', 'STIM_ON'], [1001, 1498, 2000, 2504, 3000])
+    events2.stim_params['amplitude'][3, 0] = 1.0
+    events2.stim_params['anode_label'][3, 0] = 'LA2'
+    events2.stim_params['anode_label'][4, 0] = 'LB1'
+
+    # Labels that only differ in their last character are acceptable
+    def exceptions(event1, event2, field_name1, field_name2):
+        return field_name1.endswith('anode_label') and event1['stim_params']['anode_label'][0][:-1] == \
+            event2['stim_params']['anode_label'][0, 0][:-1]
+
+    comparator = StimComparator(events1, events2, {'stim_params.amplitude': 'stim_params.amplitude',
+                                                   'stim_params.anode_label': 'stim_params.anode_label'}, exceptions)
+    diffs = comparator.diff_table()
+    report = comparator.compare()
+
+    assert list(diffs.columns) == ['event', 'type', 'mstime', 'field1', 'field2', 'value1', 'value2']
+    assert list(diffs.event) == [3, 4]
+    assert list(diffs.type) == ['STIM_ON', 'STIM_ON']
+    assert list(diffs.mstime) == [2500, 3000]
+    assert list(diffs.field1) == ['stim_params.amplitude', 'stim_params.anode_label']
+    report_lines = report.splitlines()
+    assert report_lines[0].split() == list(diffs.columns)
+    assert report_lines[1].split()[:5] == ['3', 'STIM_ON', '2500', 'stim_params.amplitude', 'stim_params.amplitude']
+    assert report_lines[2].split()[:5] == ['4', 'STIM_ON', '3000', 'stim_params.anode_label',
+                                           'stim_params.anode_label']
+
+
+def test_stim_compare_without_mismatches():
+    events = make_stim_events(['WORD', 'STIM_ON'], [1000, 1500])
+
+    assert StimComparator(events, events.copy(), {'stim_params.amplitude': 'stim_params.amplitude'},
+                          lambda *_: False).compare() == ''
@@ -0,0 +1,55 @@
+import json
+import os
+
+from ..submission.readers import event_log_reader
+from ..submission.readers.event_log_reader import read_event_log, clear_event_log_cache, EVENT_LOG_CACHE_SIZE
+
+
+def write_event_log(filename, n_events):
+    with open(filename, 'w') as f:
+        json.dump({'versions': {'Ramulator': '3.3.2'},
+                   'events': [{'event_label': 'STIM', 't_event': i} for i in range(n_events)]}, f)
+
+
+def count_decodes(monkeypatch):
+    decodes = []
+    original_load = json.load
+
+    def counted_load(*args, **kwargs):
+        decodes.append(args[0].name)
+        return original_load(*args, **kwargs)
+
+    monkeypatch.setattr(event_log_reader.json, 'load', counted_load)
+    return decodes
+
+
+def test_event_log_decoded_once(tmpdir, monkeypatch):
+    clear_event_log_cache()
+    decodes = count_decodes(monkeypatch)
+    filename = str(tmpdir.join('event_log.json'))
+    write_event_log(filename, 10)
+
+    first = read_event_log(filename)
+    assert read_event_log(filename) is first
+    assert len(decodes) == 1
+    assert len(first['events']) == 10
+
+    # A rewritten log is decoded again
+    write_event_log(filename, 20)
+    os.utime(filename, (0, 0))
+    assert len(read_event_log(filename)['events']) == 20
+    assert len(decodes) == 2
+
+
+def test_event_log_cache_is_bounded(tmpdir, monkeypatch):
+    clear_event_log_cache()
+    decodes = count_decodes(monkeypatch)
+    filenames = [str(tmpdir.join('event_log_{}.json'.format(i))) for i in range(EVENT_LOG_CACHE_SIZE + 1)]
+    for filename in filenames:
+        write_event_log(filename, 1)
+        read_event_log(filename)
+
+    read_event_log(filenames[-1])
+    assert len(decodes) == len(filenames)
+    read_event_log(filenames[0])
+    assert len(decodes) == len(filenames) + 1
@@ -0,0 +1,165 @@
+import numpy as np
+
+from ..submission.parsers.base_log_parser import BaseSessionLogParser, EventAccumulator
+
+
+class SyntheticLogParser(BaseSessionLogParser):
+    """
+    Parses a synthetic session.log with one WORD event per line, STIM_OFF lines that append an event from a
+    modifier, and REC_END lines that modify the previous event in place
+    """
+
+    def __init__(self, session_log):
+        super(SyntheticLogParser, self).__init__('r1', 'R1001P', '0.0', 'FR1', 0, {'session_log': session_log})
+        self._add_fields(('item_num', -1, 'int16'))
+        self._add_type_to_new_event(WORD=self.event_word, STIM_OFF=self._event_skip, REC_END=self._event_skip)
+        self._add_type_to_modify_events(STIM_OFF=self.add_stim_off, REC_END=self.mark_recalled)
+
+    def event_word(self, split_line):
+        event = self.event_default(split_line)
+        event.item_num = int(split_line[3])
+        return event
+
+    def add_stim_off(self, events):
+        off_event = events[-1].copy()
+        off_event.type = 'STIM_OFF'
+        return np.append(events, off_event).view(np.recarray)
+
+    def mark_recalled(self, events):
+        events[-1].item_num = -2
+        return events
+
+    def legacy_parse(self):
+        """ The np.append accumulation that parse used to do """
+        events = self._empty_event
+        for raw_event in self._contents:
+            this_type = self._get_raw_event_type(raw_event)
+            new_event = self._type_to_new_event[this_type](raw_event)
+            if isinstance(new_event, np.recarray):
+                events = np.append(events, new_event)
+            if this_type in self._type_to_modify_events:
+                events = self._type_to_modify_events[this_type](events.view(np.recarray))
+        return events[1:] if events.ndim > 0 else events
+
+
+def write_session_log(filename, n_lines, stim=True):
+    with open(filename, 'w') as f:
+        for i in range(n_lines):
+            if stim and i % 50 == 49:
+                f.write('{}\t0\tSTIM_OFF\n'.format(1000 + i))
+            elif i % 7 == 6:
+                f.write('{}\t0\tREC_END\n'.format(1000 + i))
+            else:
+                f.write('{}\t1\tWORD\t{}\n'.format(1000 + i, i % 300))
+
+
+def test_parse_matches_np_append(tmpdir):
+    session_log = str(tmpdir.join('session.log'))
+    write_session_log(session_log, 2000)
+    parser = SyntheticLogParser(session_log)
+
+    events = parser.parse()
+    expected = parser.legacy_parse()
+
+    assert events.dtype == expected.dtype
+    assert (events == expected).all()
+    assert (events['item_num'] == -2).any()
+    assert (events['type'] == b'STIM_OFF').sum() == 40
+
+
+def test_parse_without_events(tmpdir):
+    session_log = str(tmpdir.join('session.log'))
+    with open(session_log, 'w') as f:
+        f.write('1000\t0\tB\n')
+    parser = SyntheticLogParser(session_log)
+
+    assert parser.parse() == parser.legacy_parse()
+
+
+def test_accumulator_replace():
+    accumulator = EventAccumulator(np.rec.array((0, 0.), dtype=[('a', int), ('b', float)]))
+    for i in range(1, 1000):
+        accumulator.append(np.rec.array((i, i / 2.), dtype=[('a', int), ('b', float)]))
+    assert len(accumulator) == 1000
+
+    accumulator.replace(accumulator.view()[:10])
+    assert len(accumulator) == 10
+    accumulator.replace(accumulator.view()[::-1])
+    assert (accumulator.materialize()['a'] == np.arange(10)[::-1]).all()
+
+
+def test_accumulator_grows_geometrically():
+    """ Appending n events one at a time reallocates the buffer O(log n) times, where np.append reallocated n times """
+    dtype = [('a', int), ('b', float)]
+    expected = np.rec.array((0, 0.), dtype=dtype)
+    accumulator = EventAccumulator(expected)
+    capacities = []
+    for i in range(1, 5000):
+        event = np.rec.array((i, i / 2.), dtype=dtype)
+        accumulator.append(event)
+        expected = np.append(expected, event)
+        if not capacities or accumulator._buffer.size != capacities[-1]:
+            capacities.append(accumulator._buffer.size)
+
+    assert capacities == [EventAccumulator.INITIAL_CAPACITY * 2 ** k for k in range(len(capacities))]
+    assert capacities[-1] < 2 * len(expected)
+    assert len(accumulator) == len(expected)
+    assert accumulator.materialize().dtype == expected.dtype
+    assert (accumulator.materialize() == expected).all()
+
+
+def build_empty_event(parser):
+    """ How _empty_event built every event before it was copied from a prototype """
+    event = parser.event_from_template(parser._fields)
+    event.protocol = parser._protocol
+    event.subject = parser._subject
+    event.montage = parser._montage
+    event.experiment = parser._experiment
+    event.session = parser._session
+    return event
+
+
+def test_empty_event_prototype():
+    parser = SyntheticLogParser.__new__(SyntheticLogParser)
+    parser._protocol, parser._subject, parser._montage, parser._experiment, parser._session = \
+        'r1', 'R1001P', '0.0', 'FR1', 0
+    parser._fields = BaseSessionLogParser._BASE_FIELDS + (BaseSessionLogParser.stim_params_template(),)
+
+    event = parser._empty_event
+    event.type = 'WORD'
+    event.stim_params[0].amplitude = 500
+    assert parser._empty_event == build_empty_event(parser)
+    assert parser._empty_event.dtype == build_empty_event(parser).dtype
+
+    parser._session = 1
+    assert parser._empty_event.session == 1
+    parser._add_fields(('item_num', -1, 'int16'))
+    assert parser._empty_event == build_empty_event(parser)
+
+
+def test_empty_event_prototype_built_once(tmpdir, monkeypatch):
+    """ Parsing a session.log builds the event prototype once, and copies it for every event """
+    session_log = str(tmpdir.join('session.log'))
+    write_session_log(session_log, 2000)
+    parser = SyntheticLogParser(session_log)
+
+    builds = []
+    event_from_template = SyntheticLogParser.event_from_template
+
+    def counted_event_from_template(template):
+        if template is parser._fields:
+            builds.append(template)
+        return event_from_template(template)
+
+    monkeypatch.setattr(parser, 'event_from_template', counted_event_from_template)
+    parser._event_prototype = None
+    events = parser.parse()
+    assert len(builds) == 1
+
+    first, second = parser._empty_event, parser._empty_event
+    assert not np.may_share_memory(first, second)
+    assert first == build_empty_event(parser)
+    assert first.dtype == build_empty_event(parser).dtype
+
+    monkeypatch.setattr(SyntheticLogParser, '_empty_event', property(build_empty_event))
+    assert (events == parser.parse()).all()
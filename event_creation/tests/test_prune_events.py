@@ -0,0 +1,60 @@
+import gzip
+import os
+
+import pytest
+
+from ..submission.events_tasks import PruneEventsTask
+from ..submission.configuration import config
+from ..submission.viewers.recarray import from_dict, from_json, detect_json_format, to_json, GZIP_SUFFIX
+
+
+class IndexPipeline(object):
+    """ Stands in for a pipeline, keeping only the outputs that tasks register """
+
+    def __init__(self):
+        self.output_files = {}
+
+    def register_output(self, filename, label):
+        self.output_files[label] = filename
+
+
+def make_events():
+    return from_dict([{'type': 'WORD', 'mstime': 1000 + i} for i in range(10)])
+
+
+def prune(db_folder):
+    task = PruneEventsTask(lambda events: events.mstime < 1005)
+    task.set_pipeline(IndexPipeline())
+    task.run({}, db_folder)
+    return task.pipeline
+
+
+@pytest.fixture
+def gzip_configured(monkeypatch):
+    monkeypatch.setattr(config.events_json, 'format', 'gzip')
+
+
+def test_prune_keeps_source_format(tmpdir, gzip_configured):
+    filename = str(tmpdir.join('task_events.json'))
+    with open(filename, 'w') as f:
+        to_json(make_events(), f)
+
+    pipeline = prune(str(tmpdir))
+
+    assert os.listdir(str(tmpdir)) == ['task_events.json']
+    assert detect_json_format(filename) == 'indented'
+    assert list(from_json(filename).mstime) == list(range(1000, 1005))
+    assert pipeline.output_files == {'task_events': 'task_events.json'}
+
+
+def test_prune_removes_other_format(tmpdir, gzip_configured):
+    filename = str(tmpdir.join('task_events.json'))
+    with open(filename, 'w') as f:
+        to_json(make_events(), f)
+    with gzip.open(filename + GZIP_SUFFIX, 'wb') as f:
+        f.write(to_json(make_events(), compact=True).encode())
+
+    prune(str(tmpdir))
+
+    assert os.listdir(str(tmpdir)) == ['task_events.json']
+    assert list(from_json(filename).mstime) == list(range(1000, 1005))
@@ -0,0 +1,84 @@
+import gzip
+import json
+
+import numpy as np
+
+from ..submission.viewers.recarray import from_dict, from_json, from_npy, iter_json, to_dict, to_json, to_npy, \
+    MyEncoder
+
+
+def make_events():
+    return from_dict([
+        {'type': 'WORD', 'mstime': 1000 + i, 'recalled': bool(i % 2),
+         'stim_params': [{'amplitude': 500., 'anode_label': 'LA1'}] * (i % 3)}
+        for i in range(100)
+    ])
+
+
+def test_npy_round_trip(tmpdir):
+    filename = str(tmpdir.join('task_events.npy'))
+    events = make_events()
+    to_npy(events, filename)
+
+    loaded = from_npy(filename)
+
+    assert isinstance(loaded, np.recarray)
+    assert isinstance(loaded.base, np.memmap)
+    assert loaded.dtype == events.dtype
+    assert (loaded == events).all()
+    assert (loaded.mstime == events.mstime).all()
+
+
+def test_npy_drops_removed_events(tmpdir):
+    filename = str(tmpdir.join('task_events.npy'))
+    events = make_events()
+    flagged = np.zeros(len(events), events.dtype.descr + [('_remove', bool)]).view(np.recarray)
+    for name in events.dtype.names:
+        flagged[name] = events[name]
+    flagged._remove[::4] = True
+    to_npy(flagged, filename)
+
+    loaded = from_npy(filename, mmap_mode=None)
+
+    assert '_remove' not in loaded.dtype.names
+    assert len(loaded) == len(to_dict(flagged))
+    assert (loaded.mstime == events.mstime[~flagged._remove]).all()
+
+
+def test_compact_json_matches_json_dumps():
+    events = make_events()
+    expected = json.dumps(to_dict(events), cls=MyEncoder, separators=(',', ':'), sort_keys=True)
+
+    assert ''.join(iter_json(events, chunk_size=7, compact=True)) == expected
+    assert to_json(events[:0], compact=True) == '[]'
+
+
+def test_indented_json_matches_json_dumps():
+    events = make_events()
+    nested = from_dict([
+        {'type': 'STIM_ON', 'mstime': i, 'test': [i, i + 1],
+         'stim_params': {'amplitude': 250. * i, 'anode_label': 'LB{}'.format(i)}}
+        for i in range(5)
+    ])
+
+    for arr in (events, nested, events[3:4]):
+        expected = json.dumps(to_dict(arr), cls=MyEncoder, indent=2, sort_keys=True)
+        for chunk_size in (1, 7, len(arr), 1000):
+            assert ''.join(iter_json(arr, chunk_size=chunk_size)) == expected
+        assert to_json(arr) == expected
+    assert to_json(events[:0]) == json.dumps([], indent=2, sort_keys=True)
+
+
+def test_from_json_reads_gzip(tmpdir):
+    events = make_events()
+    filename = str(tmpdir.join('task_events.json'))
+    with gzip.open(filename + '.gz', 'wb') as f:
+        f.write(to_json(events, compact=True).encode())
+
+    gzipped = from_json(filename)
+    assert (gzipped == from_json(filename + '.gz')).all()
+
+    with open(filename, 'w') as f:
+        to_json(events, f)
+    assert (gzipped == from_json(filename)).all()
+    assert gzipped.dtype == from_json(filename).dtype
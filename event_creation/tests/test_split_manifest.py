@@ -0,0 +1,196 @@
+import os
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import pytest
+from scipy.io import loadmat
+
+from ..submission.configuration import config
+from ..submission.readers import eeg_reader
+from ..submission.readers.eeg_reader import SplitManifest, EEG_reader, NSx_reader
+
+
+@pytest.fixture
+def split(tmpdir):
+    source = tmpdir.join('source.raw')
+    source.write(b'\0' * 100)
+    location = tmpdir.mkdir('noreref')
+    channel_files = [str(location.join('session.{:03d}'.format(i))) for i in range(1, 4)]
+    return str(tmpdir), str(source), channel_files
+
+
+def write(filenames):
+    for filename in filenames:
+        with open(filename, 'wb') as f:
+            f.write(b'\1' * 10)
+
+
+def test_interrupted_split_resumes(split):
+    location, source, channel_files = split
+    manifest = SplitManifest(location, 'session', source, {'jacksheet': {'LA1': 1}})
+    manifest.start()
+    write(manifest.pending(channel_files)[:2])
+    for filename in channel_files[:2]:
+        manifest.record([filename])
+    manifest.record_n_samples(source, 1234)
+
+    resumed = SplitManifest(location, 'session', source, {'jacksheet': {'LA1': 1}})
+    assert resumed.pending(channel_files) == channel_files[2:]
+    assert resumed.n_samples(source) == 1234
+    assert all(os.path.exists(filename) for filename in channel_files[:2])
+
+
+def test_finished_split_is_not_resumed(split):
+    location, source, channel_files = split
+    manifest = SplitManifest(location, 'session', source)
+    manifest.start()
+    write(manifest.pending(channel_files))
+    manifest.record(channel_files)
+    manifest.finish()
+
+    rerun = SplitManifest(location, 'session', source)
+    assert rerun.pending(channel_files) == channel_files
+    assert rerun.n_samples(source) is None
+    assert not any(os.path.exists(filename) for filename in channel_files)
+
+
+@pytest.mark.parametrize('channel_mapping, split_format_version', [
+    ({'jacksheet': {'LA1': 2}}, SplitManifest.SPLIT_FORMAT_VERSION),
+    ({'jacksheet': {'LA1': 1}}, SplitManifest.SPLIT_FORMAT_VERSION + 1),
+])
+def test_changed_split_is_not_resumed(split, monkeypatch, channel_mapping, split_format_version):
+    location, source, channel_files = split
+    manifest = SplitManifest(location, 'session', source, {'jacksheet': {'LA1': 1}})
+    manifest.start()
+    write(manifest.pending(channel_files))
+    manifest.record(channel_files)
+
+    monkeypatch.setattr(SplitManifest, 'SPLIT_FORMAT_VERSION', split_format_version)
+    assert SplitManifest(location, 'session', source, channel_mapping).pending(channel_files) == channel_files
+
+
+def test_modified_file_is_rewritten(split):
+    location, source, channel_files = split
+    manifest = SplitManifest(location, 'session', source)
+    manifest.start()
+    write(manifest.pending(channel_files))
+    manifest.record(channel_files)
+    manifest.expect(source, channel_files)
+    with open(channel_files[0], 'ab') as f:
+        f.write(b'\1')
+
+    resumed = SplitManifest(location, 'session', source)
+    assert resumed.expected(source, os.path.dirname(channel_files[0])) == channel_files
+    assert resumed.pending(channel_files) == channel_files[:1]
+    assert not os.path.exists(channel_files[0])
+
+
+class BlockReader(EEG_reader):
+    """ Writes each of its channels a block at a time, as the NK, HD5 and NSx readers do """
+
+    def __init__(self, source, channels, n_blocks):
+        self.raw_filename = source
+        self.channels = channels
+        self.n_blocks = n_blocks
+        self.pools = []
+
+    def get_source_file(self):
+        return self.raw_filename
+
+    def write_sources(self, location, basename):
+        pass
+
+    def _split_data(self, location, basename):
+        filenames = [os.path.join(location, '{}.{:03d}'.format(basename, channel)) for channel in self.channels]
+        out_files = [open(filename, 'wb') for filename in filenames]
+        for block in range(self.n_blocks):
+            self.pools.append(self.channel_pool)
+            self._map_channels(lambda i: out_files[i].write(b'\1' * (block + 1)), range(len(out_files)))
+        self._close_and_record(out_files)
+
+
+@pytest.mark.parametrize('n_workers', [1, 4])
+def test_split_uses_one_pool(split, monkeypatch, n_workers):
+    location, source, _ = split
+    created = []
+
+    class CountingPool(ThreadPool):
+        def __init__(self, *args):
+            created.append(self)
+            ThreadPool.__init__(self, *args)
+
+    monkeypatch.setattr(eeg_reader, 'ThreadPool', CountingPool)
+    monkeypatch.setattr(config.eeg_split, 'n_workers', n_workers)
+    reader = BlockReader(source, range(1, 6), 3)
+    reader.split_data(location, 'session')
+
+    assert len(created) == (1 if n_workers > 1 else 0)
+    assert reader.pools == [created[0] if created else None] * 3
+    assert reader.channel_pool is None
+    for channel in range(1, 6):
+        with open(os.path.join(location, 'noreref', 'session.{:03d}'.format(channel)), 'rb') as f:
+            assert f.read() == b'\1' * 6
+
+
+class BlockNsxFile(object):
+    """ Stands in for the brpylib reader of a 30 kHz NSx file """
+
+    def __init__(self, data):
+        self.data = data
+
+    def getscalefactors(self, channels):
+        return np.ones(len(channels))
+
+    def iterdata(self, channels, block_size):
+        for start in range(0, self.data.shape[1], block_size):
+            yield self.data[np.array(channels) - 1, start:start + block_size]
+
+
+class SplitNsxReader(NSx_reader):
+    SPLIT_BLOCK_SAMPLES = 3000
+
+    def __init__(self, source, data):
+        self.raw_filename = source
+        self.lowest_channel = 0
+        self.jacksheet = {i + 1: 'LA{}'.format(i + 1) for i in range(len(data))}
+        self.channel_map = {}
+        self._data = None
+        self.nsx_info = {'elec_ids': list(self.jacksheet), 'data_headers': [{'Timestamp': 0}],
+                         'sample_rate': 30000, 'reader': BlockNsxFile(data)}
+
+    def write_sources(self, location, basename):
+        pass
+
+
+def test_nsx_split_resumes_raw_files_only(split, monkeypatch):
+    location, source, _ = split
+    data = (np.random.RandomState(0).randn(3, 20000) * 100).astype('int16')
+    channel_files = [os.path.join(location, 'noreref', 'session.{:03d}'.format(i)) for i in range(1, 4)]
+    save_mat = eeg_reader.savemat
+
+    def fail_on_second_channel(filename, *args, **kwargs):
+        if filename.startswith(channel_files[1]):
+            raise IOError('Disk full')
+        save_mat(filename, *args, **kwargs)
+
+    monkeypatch.setattr(eeg_reader, 'savemat', fail_on_second_channel)
+    with pytest.raises(IOError):
+        SplitNsxReader(source, data).split_data(location, 'session')
+    # Downsampled channels are written as float64, as they were before they were streamed
+    split_channels = [np.fromfile(filename) for filename in channel_files]
+    modified = [os.path.getmtime(filename) for filename in channel_files]
+
+    downsampled = []
+    monkeypatch.setattr(eeg_reader, 'savemat', save_mat)
+    monkeypatch.setattr(NSx_reader, '_polyphase_downsample', lambda *args: downsampled.append(args))
+    reader = SplitNsxReader(source, data)
+    reader.split_data(location, 'session')
+
+    assert downsampled == []
+    assert [os.path.getmtime(filename) for filename in channel_files] == modified
+    for filename, channel_data, split_data in zip(channel_files, data, split_channels):
+        assert (np.fromfile(filename) == split_data).all()
+        assert (loadmat(filename + '_orig_sr.mat')['data'][0] == channel_data).all()
+        assert not os.path.exists(filename + '_orig_sr.int16')
+    assert reader.get_sample_rate() == 2000
+    assert reader.get_n_samples() == len(split_channels[0])
@@ -0,0 +1,169 @@
+from copy import deepcopy
+
+import numpy as np
+import pytest
+
+from ..submission.parsers.base_log_parser import BaseLogParser
+from ..submission.parsers.system2_log_parser import System2LogParser
+from ..submission.parsers.system3_log_parser import System3LogParser
+
+# (time, duration, number of pulses) of each stimulation, in the order they appear in the host logs.
+# Task events occur every 100 ms from 0 to 1500
+STIM_SEQUENCES = {
+    'separate': [(150, 120, 10), (650, 50, 1), (1020, 200, 10)],
+    'adjacent': [(150, 100, 10), (250, 100, 10), (350, 100, 1), (350, 150, 10)],
+    'on_task_events': [(200, 200, 10), (700, 1, 10), (800, 100, 1)],
+    'overlapping': [(150, 300, 10), (300, 300, 10), (320, 50, 1), (1250, 500, 10), (1400, 50, 10)],
+    'out_of_order': [(650, 100, 10), (150, 100, 1), (1450, 300, 10), (120, 80, 10)],
+    'out_of_order_overlapping': [(450, 300, 10), (150, 400, 10), (-50, 100, 10), (1600, 10, 10)],
+    'simultaneous': [(250, 100, 10), (150, 100, 10), (250, 50, 1), (250, 100, 10), (350, 0, 10), (350, 100, 10)],
+}
+
+
+def legacy_partial_copy(event_to_copy, event_template, persistent_field_fn):
+    new_event = BaseLogParser.event_from_template(event_template)
+    for field in persistent_field_fn(event_to_copy):
+        new_event[field] = deepcopy(event_to_copy[field])
+    return new_event
+
+
+def legacy_system2_merge(parser, events, event_template, event_to_sort_value, persistent_field_fn):
+    """ How System2LogParser.merge_events inserted each stim event in turn before merge_stim_events """
+    merged_events = events[:]
+    for stim_event in parser.stim_events:
+        sort_value = event_to_sort_value(stim_event.stim_params)
+        after_events = (merged_events['mstime'] > sort_value)
+        insert_index = after_events.nonzero()[0][0] if after_events.any() else merged_events.shape[0]
+        event_to_copy = merged_events[insert_index - 1] if insert_index > 0 else \
+            BaseLogParser.event_from_template(event_template)
+        new_event = legacy_partial_copy(event_to_copy, event_template, persistent_field_fn)
+        new_event.type = 'STIM_ON' if stim_event.stim_params['n_pulses'][0] > 1 else 'STIM_SINGLE_PULSE'
+        new_event['is_stim'] = True
+        new_event['mstime'] = sort_value
+        new_event['stim_params'] = stim_event.stim_params
+        merged_events = np.append(merged_events[:insert_index], np.append(new_event, merged_events[insert_index:]))
+
+        if stim_event.stim_params['n_pulses'][0] > 1:
+            stim_off_sub_event = deepcopy(stim_event.stim_params).view(np.recarray)
+            stim_off_sub_event.stim_on = False
+            stim_off_sub_event.hosttime += stim_off_sub_event.stim_duration
+            stim_off_value = event_to_sort_value(stim_off_sub_event)
+            modify_indices = np.where(np.logical_and(merged_events['mstime'] > sort_value,
+                                                     merged_events['mstime'] < stim_off_value))[0]
+            for modify_index in modify_indices:
+                merged_events[modify_index]['stim_params'][0] = stim_event[0]
+                merged_events[modify_index]['is_stim'] = True
+
+            insert_index = modify_indices[-1] + 1 if len(modify_indices) > 0 else insert_index + 1
+            stim_off_event = legacy_partial_copy(merged_events[insert_index - 1], event_template, persistent_field_fn)
+            stim_off_event.type = 'STIM_OFF'
+            stim_off_event['is_stim'] = False
+            stim_off_event['stim_params'] = stim_off_sub_event
+            stim_off_event['mstime'] = stim_off_value
+            merged_events = np.append(merged_events[:insert_index],
+                                      np.append(stim_off_event, merged_events[insert_index:]))
+    return parser.mark_stim_items(merged_events)
+
+
+def legacy_system3_merge(parser, events, event_template, event_to_sort_value, persistent_field_fn):
+    """ How System3LogParser.merge_events inserted each stim event in turn before merge_stim_events """
+    merged_events = events[:]
+    for stim_event in parser.stim_events:
+        sort_value = event_to_sort_value(stim_event.stim_params[0])
+        after_events = (merged_events['mstime'] > sort_value)
+        insert_index = after_events.nonzero()[0][0] if after_events.any() else merged_events.shape[0]
+        event_to_copy = merged_events[insert_index - 1] if insert_index > 0 else \
+            BaseLogParser.event_from_template(event_template)
+        new_event = legacy_partial_copy(event_to_copy, event_template, persistent_field_fn)
+        new_event.type = 'STIM_ON' if stim_event.stim_params['n_pulses'][0] > 1 else 'STIM_SINGLE_PULSE'
+        new_event.stim_params = stim_event.stim_params
+        new_event['mstime'] = sort_value
+        merged_events = np.append(merged_events[:insert_index], np.append(new_event, merged_events[insert_index:]))
+
+        if new_event.type == 'STIM_ON':
+            stim_off_sub_event = deepcopy(stim_event.stim_params).view(np.recarray)
+            stim_off_sub_event.stim_on = False
+            stim_off_sub_event['host_time'] += stim_off_sub_event.stim_duration
+            stim_off_time = event_to_sort_value(stim_off_sub_event)
+            modify_indices = np.where(np.logical_and(merged_events['mstime'] > sort_value,
+                                                     merged_events['mstime'] < stim_off_time))[0]
+            for modify_index in modify_indices:
+                merged_events[modify_index].stim_params = stim_off_sub_event
+                merged_events[modify_index].is_stim = True
+
+            insert_index = modify_indices[-1] + 1 if len(modify_indices) > 0 else insert_index + 1
+            stim_off_event = legacy_partial_copy(merged_events[insert_index - 1], event_template, persistent_field_fn)
+            stim_off_event.type = 'STIM_OFF'
+            stim_off_event.stim_params = stim_off_sub_event
+            stim_off_event['mstime'] = stim_off_time
+            merged_events = np.append(merged_events[:insert_index],
+                                      np.append(stim_off_event, merged_events[insert_index:]))
+    return parser.mark_stim_items(merged_events)
+
+
+def task_events(event_template):
+    events = np.repeat(np.atleast_1d(BaseLogParser.event_from_template(event_template)), 16).view(np.recarray)
+    events.experiment = 'FR1'
+    events.mstime = np.arange(16) * 100
+    events.type = ['WORD', 'WORD_OFF'] * 8
+    events.item_name = ['ITEM{}'.format(i // 2) for i in range(16)]
+    events['list'] = np.arange(16) // 4
+    return events
+
+
+def persist_fields(event):
+    """ As in the FR parsers, more fields persist from a WORD event than from any other """
+    return ('list', 'item_name') if event['type'] == 'WORD' else ('list',)
+
+
+def make_parser(parser_class, stims, time_field, *no_logs):
+    parser = parser_class(*no_logs)
+    stim_events = np.repeat(np.atleast_1d(parser_class._empty_event()), len(stims)).view(np.recarray)
+    for i, (time, duration, n_pulses) in enumerate(stims):
+        stim_events.stim_params[time_field][i, 0] = time
+        stim_events.stim_params['stim_duration'][i, 0] = duration
+        stim_events.stim_params['n_pulses'][i, 0] = n_pulses
+        stim_events.stim_params['amplitude'][i, 0] = i + 1
+    parser._stim_events = stim_events
+    return parser
+
+
+def assert_same_events(merged_events, legacy_events):
+    assert merged_events.dtype == legacy_events.dtype
+    assert len(merged_events) == len(legacy_events)
+    for field in merged_events.dtype.names:
+        assert (merged_events[field] == legacy_events[field]).all(), field
+
+
+@pytest.mark.parametrize('sequence', sorted(STIM_SEQUENCES))
+def test_system2_merge_matches_legacy(sequence):
+    stims = STIM_SEQUENCES[sequence]
+    event_template = BaseLogParser._BASE_FIELDS + (('list', -999, 'int16'), ('item_name', '', 'S64'),
+                                                   ('is_stim', False, 'b1')) + System2LogParser.stim_params_template()
+    events = task_events(event_template)
+
+    def event_to_sort_value(stim_params):
+        return stim_params['hosttime'][0]
+
+    merged_events = make_parser(System2LogParser, stims, 'hosttime', []).merge_events(
+        events, event_template, event_to_sort_value, persist_fields)
+    legacy_events = legacy_system2_merge(make_parser(System2LogParser, stims, 'hosttime', []),
+                                         events, event_template, event_to_sort_value, persist_fields)
+    assert_same_events(merged_events, legacy_events)
+
+
+@pytest.mark.parametrize('sequence', sorted(STIM_SEQUENCES))
+def test_system3_merge_matches_legacy(sequence):
+    stims = STIM_SEQUENCES[sequence]
+    event_template = BaseLogParser._BASE_FIELDS + (('list', -999, 'int16'), ('item_name', '', 'S64'),
+                                                   ('is_stim', False, 'b1')) + System3LogParser.stim_params_template()
+    events = task_events(event_template)
+
+    def event_to_sort_value(stim_params):
+        return stim_params['host_time'] if not stim_params['host_time'].shape else stim_params['host_time'][0]
+
+    merged_events = make_parser(System3LogParser, stims, 'host_time', [], []).merge_events(
+        events, event_template, event_to_sort_value, persist_fields)
+    legacy_events = legacy_system3_merge(make_parser(System3LogParser, stims, 'host_time', [], []),
+                                         events, event_template, event_to_sort_value, persist_fields)
+    assert_same_events(merged_events, legacy_events)
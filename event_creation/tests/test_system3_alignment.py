@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from ..submission.alignment import system3
+from ..submission.alignment.system3 import System3Aligner
+
+HOST_ENDS = np.array([60000., 150000., 150000., 400000.])
+
+
+def make_aligner(seed):
+    """ An aligner with one pair of fits for each of several event logs, the last two ending at the same time """
+    random = np.random.RandomState(seed)
+    aligner = System3Aligner.__new__(System3Aligner)
+    aligner.host_ends = HOST_ENDS
+    aligner.host_to_ens_coefs = np.column_stack((random.uniform(.9, 1.1, len(HOST_ENDS)),
+                                                 random.uniform(-1e6, 1e6, len(HOST_ENDS))))
+    aligner.task_to_ens_coefs = np.column_stack((random.uniform(.9, 1.1, len(HOST_ENDS)),
+                                                 random.uniform(-1e9, 1e9, len(HOST_ENDS))))
+    return aligner
+
+
+def loop_host_time_to_mstime(aligner, host_time):
+    """ How stim_event_to_mstime converted each stim event's host time before host_times_to_mstimes """
+    coef_inds = np.where(host_time <= aligner.host_ends)[0]
+
+    if len(coef_inds) > 0:
+        coef_ind = coef_inds[-1]
+    else:
+        coef_ind = len(aligner.host_ends) - 1
+
+    ens_time = aligner.apply_coefficients(host_time, aligner.host_to_ens_coefs[coef_ind])
+    task_time = aligner.apply_coefficients_backwards(ens_time, aligner.task_to_ens_coefs[coef_ind])
+    return task_time, ens_time
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_host_times_to_mstimes_matches_loop(seed):
+    aligner = make_aligner(seed)
+    random = np.random.RandomState(seed)
+    host_times = np.concatenate((
+        # Within the range of each log, and before the first
+        random.uniform(-10000, HOST_ENDS[-1], 200),
+        # On and either side of each boundary
+        HOST_ENDS, HOST_ENDS - 1, HOST_ENDS + 1, HOST_ENDS - 1e-6, HOST_ENDS + 1e-6,
+        # After the end of every log, which fall back to the last
+        HOST_ENDS[-1] + np.array([1, 1999, 2000, 2001, 1e6]),
+    ))
+
+    task_times, ens_times = aligner.host_times_to_mstimes(host_times)
+
+    expected = [loop_host_time_to_mstime(aligner, host_time) for host_time in host_times]
+    assert list(task_times) == [task_time for task_time, _ in expected]
+    assert list(ens_times) == [ens_time for _, ens_time in expected]
+
+
+def test_stim_params_to_mstimes_matches_stim_event_to_mstime():
+    aligner = make_aligner(0)
+    stim_params = np.zeros((6, 2), dtype=[('host_time', 'int64'), ('amplitude', 'float32')])
+    stim_params['host_time'][:, 0] = [0, 60000, 60001, 150000, 400000, 500000]
+
+    mstimes = aligner.stim_params_to_mstimes(stim_params)
+
+    assert list(mstimes) == [aligner.stim_event_to_mstime(params) for params in stim_params]
+    assert list(mstimes) == [loop_host_time_to_mstime(aligner, params['host_time'][0])[0] for params in stim_params]
+    assert list(aligner.stim_params_to_mstimes(stim_params[:, 0])) == list(mstimes)
+
+
+@pytest.mark.parametrize('beyond_end, logged', [(2000, False), (2001, True)])
+def test_host_times_beyond_end_of_log(monkeypatch, beyond_end, logged):
+    errors = []
+    monkeypatch.setattr(system3.logger, 'error', errors.append)
+
+    make_aligner(0).host_times_to_mstimes([1000, HOST_ENDS[-1] + beyond_end, HOST_ENDS[-1] + beyond_end])
+
+    assert errors == (["Time extends beyond end of log file!"] if logged else [])
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from ..submission.alignment.window_matching import match_windows
+from ..submission.alignment.system1 import System1Aligner
+from ..submission.alignment.LTPAligner import match_sequences
+from ..submission.exc import AlignmentError
+
+
+def jittered_pulses(seed, n_pulses=200, jitter=3):
+    """
+    Differences between sent sync pulses, and between the same pulses as received with jitter, some of them dropped
+    and some spurious pulses before the first. Intervals are drawn from a few values so that short windows repeat
+    """
+    random = np.random.RandomState(seed)
+    sent = np.cumsum(random.choice([500, 750, 1000, 1250], n_pulses)).astype(float)
+    received = sent + random.uniform(-jitter, jitter, n_pulses)
+    received = np.delete(received, random.choice(n_pulses, 5, replace=False))
+    received = np.concatenate((received[0] - np.array([3000., 2000.]), received))
+    return np.diff(received), np.diff(sent)
+
+
+def loop_matches(sequence, start, window, haystack, maxdiff, n_offsets):
+    """ Compares the window against every offset in turn """
+    return [offset for offset in range(n_offsets)
+            if np.abs(haystack[offset:offset + window] - sequence[start:start + window]).max() < maxdiff]
+
+
+def intersect_best_offset(eeg_diff, task_diff, delta):
+    """ How System1Aligner.get_best_offset matched windows before match_windows """
+    ind = np.where(abs(task_diff - eeg_diff[0]) < delta)
+    for i, this_eeg_diff in enumerate(eeg_diff):
+        ind = np.intersect1d(ind, np.where(abs(task_diff - this_eeg_diff) < delta)[0] - i)
+        if len(ind) == 0:
+            return None
+    if len(ind) > 1:
+        raise AlignmentError("Multiple matching windows. Lower threshold or increase window.")
+    return ind[0]
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('window', [1, 3, 10])
+def test_match_windows_matches_loop(seed, window):
+    eeg_diff, task_diff = jittered_pulses(seed)
+    starts = np.arange(len(eeg_diff) - window + 1)
+    n_offsets = len(task_diff) - window + 1
+
+    positions, offsets = match_windows(eeg_diff, starts, window, task_diff, 10)
+
+    for position, start in enumerate(starts):
+        assert sorted(offsets[positions == position]) == loop_matches(eeg_diff, start, window, task_diff, 10,
+                                                                      n_offsets)
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('window', [3, 10])
+def test_get_best_offset_matches_intersection(seed, window):
+    eeg_diff, task_diff = jittered_pulses(seed)
+    for start in range(0, len(eeg_diff) - window, 7):
+        eeg_window = eeg_diff[start:start + window]
+        try:
+            expected = intersect_best_offset(eeg_window, task_diff, 10)
+        except AlignmentError:
+            with pytest.raises(AlignmentError):
+                System1Aligner.get_best_offset(eeg_window, task_diff, 10)
+        else:
+            assert System1Aligner.get_best_offset(eeg_window, task_diff, 10) == expected
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_match_sequences_matches_loop(seed):
+    eeg_diff, task_diff = jittered_pulses(seed)
+    nlen = 10
+    starts = np.arange(len(eeg_diff) - nlen)
+
+    first_offsets = match_sequences(eeg_diff, starts, nlen, task_diff, 10)
+
+    for start, first_offset in zip(starts, first_offsets):
+        # The final offset is never tried
+        expected = loop_matches(eeg_diff, start, nlen, task_diff, 10, len(task_diff) - nlen)
+        assert first_offset == (expected[0] if expected else -1)